@@ -0,0 +1,169 @@
+import asyncio
+import time
+from collections import Counter
+from telegram import Update
+from Metrics import ADMISSIONS
+
+DEFAULT_COALESCED_COMMANDS = ("get_wod", "analyze_workout")
+DEFAULT_DEBOUNCE = 3.0     # seconds after a reply during which the same command is ignored
+DEFAULT_MAX_LLM = 4        # LLM completions streaming at once
+DEFAULT_MAX_LLM_QUEUE = 16  # commands waiting for one before new ones are turned away
+
+# Verdicts of CommandCoalescer.enter()
+ADMITTED = "admitted"
+COALESCED = "coalesced"   # a duplicate of a command in progress; answered with a short notice
+DEBOUNCED = "debounced"   # a repeat right after the reply, or a further duplicate; dropped silently
+
+
+class Overloaded(Exception):
+    """Raised by `ConcurrencyGate.slot()` when its queue is full; the message is shown to the user."""
+
+
+class CommandCoalescer:
+    """Collapses repeated presses of the same command in one chat into a single reply.
+
+    `PerChatUpdateProcessor` asks `enter()` when an update arrives, before it
+    waits for the chat's lock. While an identical command from the same chat
+    is queued or running, a repeat is coalesced. The first repeat gets a
+    quick "still working" notice and later ones are dropped, so hammering a
+    keyboard button costs one fetch and one reply. For `debounce` seconds
+    after the reply, repeats are dropped as well. Only `commands` are
+    coalesced; everything else is admitted as usual.
+
+    Args:
+        commands (iterable, optional): Command names (without the slash) to coalesce.
+        debounce (float, optional): Seconds after a command finishes during which repeats are ignored.
+    """
+
+    def __init__(self, commands=DEFAULT_COALESCED_COMMANDS, debounce=DEFAULT_DEBOUNCE):
+        self.commands = set(commands)
+        self.debounce = debounce
+        self.counts = Counter()  # (command, verdict) -> updates
+        self._active = {}    # (chat_id, text) -> whether the chat was told it's in progress
+        self._finished = {}  # (chat_id, text) -> time.monotonic() the reply finished
+
+    def key(self, update):
+        """The (chat, command) an update is coalesced under, or None if it isn't a coalesced command."""
+        if not isinstance(update, Update) or update.effective_chat is None:
+            return None
+        message = update.effective_message
+        text = (message.text or "").strip() if message is not None else ""
+        if not text.startswith("/"):
+            return None
+        command = text[1:].split(maxsplit=1)[0].split("@", 1)[0].lower()
+        if command not in self.commands:
+            return None
+        # Arguments are part of the key: "/wod 2024-03-20" and "/wod 2024-03-21" are different requests
+        return update.effective_chat.id, " ".join([command] + text.split()[1:])
+
+    def enter(self, key):
+        """Returns ADMITTED (and marks `key` in progress), COALESCED or DEBOUNCED."""
+        if key in self._active:
+            verdict = DEBOUNCED if self._active[key] else COALESCED
+            self._active[key] = True
+        else:
+            finished = self._finished.get(key)
+            if finished is not None and time.monotonic() - finished < self.debounce:
+                verdict = DEBOUNCED
+            else:
+                verdict = ADMITTED
+                self._active[key] = False
+        command = key[1].split(maxsplit=1)[0]
+        self.counts[command, verdict] += 1
+        ADMISSIONS.inc(command=command, result=verdict)
+        return verdict
+
+    def leave(self, key):
+        """Marks the admitted command for `key` as answered."""
+        self._active.pop(key, None)
+        now = time.monotonic()
+        self._finished[key] = now
+        if len(self._finished) > 1024:
+            self._finished = {k: t for k, t in self._finished.items() if now - t < self.debounce}
+
+    async def notify(self, update, key):
+        """Tells the chat its earlier command is still being answered."""
+        try:
+            await update.effective_message.reply_text(f"⏳ Still working on your /{key[1]}, hang on...")
+        except Exception as e:
+            print(f"Error sending in-progress notice to chat_id {key[0]}: {e}")
+
+    def stats(self):
+        """Updates per command and verdict, and commands in progress."""
+        stats = {f"{command}_{verdict}": count for (command, verdict), count in self.counts.items()}
+        stats["in_progress"] = len(self._active)
+        return stats
+
+
+class ConcurrencyGate:
+    """Lets at most `limit` callers in at once and queues up to `max_queue` more, in arrival order.
+
+    A caller arriving when the queue is full is turned away at once with
+    `Overloaded`, so during a burst the wait stays bounded by
+    `max_queue / limit` slot times and work that can't be served soon is
+    never started.
+
+    Args:
+        limit (int): Callers inside at once.
+        max_queue (int): Callers allowed to wait for a slot.
+        busy_message (str, optional): Text of the `Overloaded` raised when the queue is full.
+    """
+
+    def __init__(self, limit, max_queue,
+                 busy_message="🚦 Lots of people are asking right now; please try again in a minute."):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.busy_message = busy_message
+        self.admitted = 0
+        self.rejected = 0
+        self.max_waiting = 0
+        self._waiting = 0
+        self._active = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    @property
+    def waiting(self):
+        return self._waiting
+
+    @property
+    def active(self):
+        return self._active
+
+    def slot(self):
+        """Async context manager holding one slot; raises `Overloaded` on entry if the queue is full."""
+        return _Slot(self)
+
+    def stats(self):
+        """Callers inside and waiting now, the longest queue seen, and admitted and rejected callers."""
+        return {
+            "active": self._active,
+            "waiting": self._waiting,
+            "max_waiting": self.max_waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+class _Slot:
+    def __init__(self, gate):
+        self.gate = gate
+
+    async def __aenter__(self):
+        gate = self.gate
+        # Checked before the first await, so the queue can't overshoot max_queue
+        if gate._active >= gate.limit and gate._waiting >= gate.max_queue:
+            gate.rejected += 1
+            raise Overloaded(gate.busy_message)
+        gate._waiting += 1
+        gate.max_waiting = max(gate.max_waiting, gate._waiting)
+        try:
+            await gate._semaphore.acquire()
+        finally:
+            gate._waiting -= 1
+        gate._active += 1
+        gate.admitted += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.gate._active -= 1
+        self.gate._semaphore.release()
@@ -0,0 +1,179 @@
+import asyncio
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from Metrics import CACHE_REQUESTS
+
+DEFAULT_MAX_ENTRIES = 128
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60  # seconds an analysis is reused
+DEFAULT_SAVE_DELAY = 2.0            # seconds writes are gathered before the file is rewritten
+
+
+def analysis_key(**parts):
+    """Hashes everything that affects a completion (workouts, prompt, model, settings) into a cache key."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+class AnalysisCache:
+    """Size- and age-bounded cache of finished workout analyses.
+
+    Everyone asks about the same day's workout, so one completion can serve
+    every /analyze_workout press. Concurrent misses for the same key wait for
+    the completion already in flight (single-flight) instead of starting
+    their own. When `path` is given entries survive restarts; as in
+    `WorkoutCache`, the file is rewritten on a timer thread `save_delay`
+    seconds after the first unsaved write (0 saves on every write), and
+    `flush()`, which also runs at exit, saves what is pending.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_age=DEFAULT_MAX_AGE, path=None,
+                 save_delay=DEFAULT_SAVE_DELAY):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.path = path
+        self.save_delay = save_delay
+        self.saves = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()  # key -> (created_at, analysis)
+        self._lock = threading.Lock()
+        self._key_locks = {}   # key -> threading.Lock, for sync callers
+        self._inflight = {}    # key -> asyncio task, for async callers
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._save_timer = None
+        if path:
+            self.load()
+            atexit.register(self.flush)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[0] > self.max_age:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                CACHE_REQUESTS.inc(cache="analysis", result="miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            CACHE_REQUESTS.inc(cache="analysis", result="hit")
+            return entry[1]
+
+    def peek(self, key):
+        """Returns the live analysis for `key` without counting a hit or miss or touching recency."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or time.time() - entry[0] > self.max_age:
+            return None
+        return entry[1]
+
+    def set(self, key, analysis):
+        with self._lock:
+            self._entries[key] = (time.time(), analysis)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        if self.path:
+            self._schedule_save()
+
+    def _schedule_save(self):
+        with self._lock:
+            self._dirty = True
+            if self.save_delay > 0:
+                if self._save_timer is None:
+                    self._save_timer = threading.Timer(self.save_delay, self.flush)
+                    self._save_timer.daemon = True
+                    self._save_timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        """Saves pending writes to `path` now instead of waiting for the timer."""
+        with self._save_lock:
+            with self._lock:
+                if self._save_timer is not None:
+                    self._save_timer.cancel()
+                    self._save_timer = None
+                dirty, self._dirty = self._dirty, False
+            if dirty:
+                self.save()
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached analysis for `key`, calling `compute()` at most once across threads."""
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None:
+                self.coalesced += 1
+                return entry[1]
+            value = compute()
+            self.set(key, value)
+        with self._lock:
+            self._key_locks.pop(key, None)
+        return value
+
+    async def aget_or_compute(self, key, compute):
+        """Async `get_or_compute`: concurrent callers await the same `compute()` coroutine."""
+        value = self.get(key)
+        if value is not None:
+            return value
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.coalesced += 1
+        # Shielded so one caller giving up doesn't cancel the completion others are waiting on
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self.set(key, task.result())
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "size": len(self._entries),
+                "saves": self.saves}
+
+    def load(self):
+        """Loads unexpired analyses from `path`; a missing or corrupt file just means a cold cache."""
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable analysis cache {self.path}: {e}")
+            return
+        now = time.time()
+        with self._lock:
+            for key, created_at, analysis in stored.get("entries", []):
+                if now - created_at <= self.max_age:
+                    self._entries[key] = (created_at, analysis)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def save(self):
+        """Writes the cache to `path` atomically (temp file + rename)."""
+        with self._lock:
+            entries = [[key, created_at, analysis] for key, (created_at, analysis) in self._entries.items()]
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({"entries": entries}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self.saves += 1
+        except OSError as e:
+            print(f"Error saving analysis cache to {self.path}: {e}")
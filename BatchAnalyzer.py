@@ -0,0 +1,227 @@
+import asyncio
+import json
+import time
+import openai
+from OpenAIHandler import NARRATIVE_PROMPT, estimate_tokens
+from Metrics import ERRORS, LLM_SECONDS, RETRIES
+
+DEFAULT_PROMPT_BUDGET = 1500       # estimated prompt tokens per batched request
+DEFAULT_COMPLETION_BUDGET = 250    # completion tokens reserved per day in a batch
+DEFAULT_MAX_DAYS_PER_REQUEST = 7   # days packed into one request at most
+DEFAULT_CONCURRENCY = 2            # batched requests in flight at once
+DEFAULT_MAX_ATTEMPTS = 3           # tries per day before leaving it to on-demand analysis
+DEFAULT_RETRY_DELAY = 1.0          # seconds before the first retry round, doubled each round
+DEFAULT_FAILURE_BACKOFF = 30 * 60  # seconds a day that failed every attempt is left alone, doubled per failure
+MAX_FAILURE_BACKOFF = 12 * 60 * 60
+
+BATCH_PROMPT = (NARRATIVE_PROMPT + " Several workout days follow, each headed by its ID in square brackets."
+                " Reply with a JSON object mapping every ID to that day's advice as a string.")
+BATCH_INSTRUCTIONS = ("Give short strategy and pacing advice for each day, and a time estimate for a beginner,"
+                      " intermediate and advanced athlete where a day asks for one.")
+
+
+class _Day:
+    """One day waiting for its narrative: where to store it and what to send."""
+
+    __slots__ = ("date", "key", "section", "tokens")
+
+    def __init__(self, date, key, section):
+        self.date = date
+        self.key = key
+        self.section = section
+        self.tokens = estimate_tokens([{"content": section}])
+
+
+def _parse_reply(content):
+    """Reads the {ID: advice} object, tolerating a Markdown code fence around it."""
+    text = content.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0]
+    reply = json.loads(text)
+    if not isinstance(reply, dict):
+        raise ValueError("batch reply is not a JSON object")
+    return reply
+
+
+class BatchAnalyzer:
+    """Pre-computes a whole week's analyses in a few packed LLM requests.
+
+    Each day goes through the same `OpenAIHandler` planning as
+    /analyze_workout. Days the rule-based path answers, or whose narrative
+    is already cached, cost nothing. The rest are packed, in date order, into
+    requests that stay under `prompt_budget` estimated prompt tokens, so the
+    system prompt is sent once per request instead of once per day. Each
+    reply is a JSON object split back into per-day narratives. Every
+    narrative is stored in the handler's `AnalysisCache` under the key an
+    on-demand request would use, so the later /analyze_workout is a cache
+    hit.
+
+    A failed request or a reply missing some days only retries those days,
+    in smaller batches each round, up to `max_attempts`. Days still missing
+    after that are left to the normal on-demand path, and later calls skip
+    them for `failure_backoff` seconds, doubled after each further failure,
+    so the scheduler's periodic runs don't resend a day the LLM keeps failing.
+    An edited day has a new cache key and is tried again right away.
+
+    Args:
+        openai_handler (OpenAIHandler): Supplies the model settings, planning and cache.
+        prompt_budget (int, optional): Estimated prompt tokens allowed per request.
+        completion_budget (int, optional): Completion tokens reserved per day in a request.
+        max_days_per_request (int, optional): Days packed into one request at most.
+        concurrency (int, optional): Batched requests in flight at once.
+        max_attempts (int, optional): Tries per day.
+        retry_delay (float, optional): Seconds before the first retry round.
+        failure_backoff (float, optional): Seconds a day is skipped after it failed every attempt.
+    """
+
+    def __init__(self, openai_handler, prompt_budget=DEFAULT_PROMPT_BUDGET,
+                 completion_budget=DEFAULT_COMPLETION_BUDGET, max_days_per_request=DEFAULT_MAX_DAYS_PER_REQUEST,
+                 concurrency=DEFAULT_CONCURRENCY, max_attempts=DEFAULT_MAX_ATTEMPTS, retry_delay=DEFAULT_RETRY_DELAY,
+                 failure_backoff=DEFAULT_FAILURE_BACKOFF):
+        self.openai_handler = openai_handler
+        self.prompt_budget = prompt_budget
+        self.completion_budget = completion_budget
+        self.max_days_per_request = max_days_per_request
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.failure_backoff = failure_backoff
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.requests = 0
+        self.days_analyzed = 0
+        self.days_skipped = 0    # rule-based or already cached
+        self.days_retried = 0
+        self.days_failed = 0
+        self.days_backed_off = 0    # skipped because they failed recently
+        self._failures = {}         # cache key -> (failed runs in a row, monotonic time it may be retried)
+        self.prompt_tokens = 0      # as reported by the API
+        self.completion_tokens = 0  # as reported by the API
+
+    async def analyze_range(self, workout_api_handler, start_str=None, days=DEFAULT_MAX_DAYS_PER_REQUEST):
+        """Analyzes `days` days from `start_str` (today if None) of one box's programming.
+
+        Returns:
+            int: Days whose narrative was computed and cached by this call
+        """
+        by_date = await workout_api_handler.get_workouts_for_range(start_str, days)
+        return await self.analyze_days(by_date)
+
+    async def analyze_days(self, workouts_by_date):
+        """Analyzes every day of {date: [workouts]} that still needs the LLM.
+
+        Returns:
+            int: Days whose narrative was computed and cached by this call
+        """
+        pending = []
+        for date, workouts in workouts_by_date.items():
+            if not workouts:
+                continue
+            parsed, _, _, messages = self.openai_handler.prepare(workouts)
+            if messages is None:
+                self.days_skipped += 1
+                continue
+            key = self.openai_handler.cache_key(messages)
+            if self.openai_handler.cache.peek(key) is not None:
+                self.days_skipped += 1
+                continue
+            if self._failures.get(key, (0, 0.0))[1] > time.monotonic():
+                self.days_backed_off += 1
+                continue
+            sections = "\n\n".join(p.summary() for p in parsed)
+            if not all(p.complete for p in parsed):
+                # No rule-based time is shown for these (see format_estimate)
+                sections += "\n(needs a time estimate)"
+            pending.append(_Day(date, key, f"[{date}]\n{sections}"))
+
+        analyzed = 0
+        # A few days still fill every concurrent slot rather than queueing in one long completion
+        max_days = min(self.max_days_per_request, -(-len(pending) // self.concurrency)) if pending else 1
+        for attempt in range(self.max_attempts):
+            if not pending:
+                break
+            if attempt:
+                self.days_retried += len(pending)
+                RETRIES.inc(len(pending), reason="batch_analysis")
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+                # Smaller batches each round, so one day that breaks the reply can't sink the others
+                max_days = max(1, max_days // 2)
+            batches = self._pack(pending, max_days)
+            results = await asyncio.gather(*(self._run_batch(batch) for batch in batches))
+            pending = [day for missing in results for day in missing]
+            analyzed += sum(len(batch) for batch in batches) - len(pending)
+
+        if pending:
+            self.days_failed += len(pending)
+            for day in pending:
+                failures = self._failures.get(day.key, (0, 0.0))[0] + 1
+                delay = min(self.failure_backoff * 2 ** (failures - 1), MAX_FAILURE_BACKOFF)
+                self._failures[day.key] = (failures, time.monotonic() + delay)
+            print(f"Batch analysis gave up on {', '.join(day.date for day in pending)}; left for on-demand analysis")
+        self.days_analyzed += analyzed
+        return analyzed
+
+    def _pack(self, days, max_days):
+        """Greedily fills requests in date order up to the prompt budget; an oversized day goes alone."""
+        overhead = estimate_tokens([{"content": BATCH_PROMPT}, {"content": BATCH_INSTRUCTIONS}])
+        batches, batch, tokens = [], [], overhead
+        for day in days:
+            if batch and (tokens + day.tokens > self.prompt_budget or len(batch) >= max_days):
+                batches.append(batch)
+                batch, tokens = [], overhead
+            batch.append(day)
+            tokens += day.tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def _run_batch(self, batch):
+        """Sends one packed request and caches what came back; returns the days still missing."""
+        handler = self.openai_handler
+        messages = [
+            {"role": "system", "content": BATCH_PROMPT},
+            {"role": "user", "content": "\n\n".join(day.section for day in batch) + "\n\n" + BATCH_INSTRUCTIONS},
+        ]
+        try:
+            async with self._semaphore:
+                self.requests += 1
+                start = time.perf_counter()
+                response = await openai.ChatCompletion.acreate(
+                    model=handler.model,
+                    messages=messages,
+                    temperature=handler.temperature,
+                    max_tokens=self.completion_budget * len(batch),
+                    response_format={"type": "json_object"},
+                )
+                LLM_SECONDS.observe(time.perf_counter() - start, mode="batch")
+            usage = response.get("usage") or {}
+            self.prompt_tokens += usage.get("prompt_tokens", 0)
+            self.completion_tokens += usage.get("completion_tokens", 0)
+            reply = _parse_reply(response.choices[0].message.content)
+        except Exception as e:
+            print(f"Error in batch analysis of {len(batch)} days: {e}")
+            ERRORS.inc(stage="llm_batch")
+            return batch
+
+        missing = []
+        for day in batch:
+            narrative = reply.get(day.date)
+            if isinstance(narrative, str) and narrative.strip():
+                handler.cache.set(day.key, narrative.strip())
+                self._failures.pop(day.key, None)
+            else:
+                missing.append(day)
+        return missing
+
+    def stats(self):
+        """Requests sent, days analyzed/skipped/retried/failed/backed off and API-reported tokens."""
+        return {
+            "requests": self.requests,
+            "days_analyzed": self.days_analyzed,
+            "days_skipped": self.days_skipped,
+            "days_retried": self.days_retried,
+            "days_failed": self.days_failed,
+            "days_backed_off": self.days_backed_off,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
@@ -0,0 +1,204 @@
+import asyncio
+import json
+import os
+import re
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from BroadcastHandler import DEFAULT_GLOBAL_RATE, TokenBucket, deliver_workouts
+from DeliveryLog import content_hash
+from SubscriberStore import SQLiteSubscriberStore
+from TelegramHandler import DEFAULT_BOX_NAME
+from WorkoutAPI_Handler import (AsyncWorkoutAPI_Handler, DEFAULT_MAX_CONCURRENCY, DEFAULT_MAX_CONNECTIONS,
+                                DEFAULT_TIMEZONE)
+from WorkoutCache import WorkoutCache
+
+DEFAULT_SUGARWOD_API_URL = "https://api.sugarwod.com/v2"
+
+
+def _slugify(name):
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-") or "box"
+
+
+class Box:
+    """One affiliate served by the bot: its SugarWOD client, channel and subscribers.
+
+    Args:
+        slug (str): Short identifier, used in `/start <slug>` and broadcast IDs.
+        name (str): Display name shown in the message header.
+        workout_api_handler (AsyncWorkoutAPI_Handler): The box's own SugarWOD client and connection pool.
+        subscriber_store (SubscriberStore): The box's subscribers.
+        channel_id (str, optional): Channel that always gets the box's delivery.
+        broadcast_rate (float, optional): The box's share of the bot's messages per second.
+        timezone (str, optional): IANA name of the box's local time, used for subscribers without their own.
+    """
+
+    def __init__(self, slug, name, workout_api_handler, subscriber_store, channel_id=None,
+                 broadcast_rate=DEFAULT_GLOBAL_RATE, timezone=DEFAULT_TIMEZONE):
+        self.slug = slug
+        self.name = name
+        self.workout_api_handler = workout_api_handler
+        self.subscriber_store = subscriber_store
+        self.channel_id = channel_id
+        self.broadcast_rate = broadcast_rate
+        self.timezone = ZoneInfo(timezone)
+
+    def timezone_for(self, chat_id):
+        """The chat's own timezone if it set one, otherwise the box's."""
+        timezone, _ = self.subscriber_store.get_preferences(str(chat_id))
+        return ZoneInfo(timezone) if timezone else self.timezone
+
+    def __repr__(self):
+        return f"Box({self.slug!r}, {self.name!r})"
+
+
+class BoxRegistry:
+    """The boxes one deployment serves, in configuration order; the first is the default.
+
+    Every box has its own SugarWOD client (connection pool, concurrency
+    limit and API key) while sharing one `WorkoutCache`, whose entries are
+    namespaced by each client's `box_id`.
+    """
+
+    def __init__(self, boxes):
+        if not boxes:
+            raise ValueError("A box registry needs at least one box")
+        self._boxes = {}
+        for box in boxes:
+            if box.slug in self._boxes:
+                raise ValueError(f"Duplicate box slug: {box.slug}")
+            self._boxes[box.slug] = box
+
+    @classmethod
+    def from_config(cls, entries, base_url=DEFAULT_SUGARWOD_API_URL, cache=None):
+        """Builds the registry from a list of box settings (see `load_box_registry`)."""
+        cache = cache if cache is not None else WorkoutCache()
+        boxes = []
+        for entry in entries:
+            name = entry.get("name", DEFAULT_BOX_NAME)
+            slug = entry.get("slug") or _slugify(name)
+            api_key = entry.get("api_key") or os.environ[entry["api_key_env"]]
+            timezone = entry.get("timezone", DEFAULT_TIMEZONE)
+            handler = AsyncWorkoutAPI_Handler(
+                entry.get("api_url", base_url),
+                api_key,
+                max_connections=entry.get("max_connections", DEFAULT_MAX_CONNECTIONS),
+                max_concurrency=entry.get("max_concurrency", DEFAULT_MAX_CONCURRENCY),
+                cache=cache,
+                box_id=slug,
+                timezone=timezone,
+            )
+            store = SQLiteSubscriberStore(entry.get("subscribers_db", f"subscribers-{slug}.db"),
+                                          migrate_from=entry.get("migrate_from"))
+            boxes.append(Box(slug, name, handler, store, channel_id=entry.get("channel_id"),
+                             broadcast_rate=entry.get("broadcast_rate", DEFAULT_GLOBAL_RATE),
+                             timezone=timezone))
+        return cls(boxes)
+
+    @property
+    def default(self):
+        return next(iter(self._boxes.values()))
+
+    def get(self, slug):
+        return self._boxes.get(slug)
+
+    def box_for_chat(self, chat_id):
+        """Returns the box `chat_id` is subscribed to, or the default box."""
+        for box in self._boxes.values():
+            if chat_id in box.subscriber_store:
+                return box
+        return self.default
+
+    def __iter__(self):
+        return iter(self._boxes.values())
+
+    def __len__(self):
+        return len(self._boxes)
+
+    def stats(self):
+        """Per-box SugarWOD counters, including requests that actually reached the API."""
+        return {box.slug: box.workout_api_handler.stats() for box in self}
+
+    async def aclose(self):
+        for box in self:
+            await box.workout_api_handler.aclose()
+            box.subscriber_store.close()
+        # Boxes usually share one cache; its pending save is written off the event loop
+        for cache in {id(box.workout_api_handler.cache): box.workout_api_handler.cache for box in self}.values():
+            await asyncio.to_thread(cache.flush)
+
+
+def load_box_registry(path=None, default=None, base_url=DEFAULT_SUGARWOD_API_URL, cache=None):
+    """Loads the boxes from a JSON file, or builds a single box from `default` when there is none.
+
+    The file holds a list of objects with `name`, `slug`, `api_key_env` (the
+    environment variable holding the SugarWOD key; `api_key` also works),
+    `channel_id`, `subscribers_db` and optionally `broadcast_rate`,
+    `max_concurrency`, `max_connections`, `api_url` and `timezone`.
+    """
+    if path:
+        with open(path) as f:
+            entries = json.load(f)
+    else:
+        entries = [default or {}]
+    return BoxRegistry.from_config(entries, base_url=base_url, cache=cache)
+
+
+async def deliver_boxes(telegram_handler, boxes, date_str, direct_chat_ids=(), broadcast_id=None,
+                        checkpoint_dir=None, global_rate=DEFAULT_GLOBAL_RATE, delivery_log=None, subscribers=True):
+    """Delivers each box's workouts to its channel and subscribers, all boxes in parallel.
+
+    Every box broadcasts at its own `broadcast_rate` while a shared bucket
+    keeps the total within `global_rate`, the bot-wide Telegram limit. With
+    a `delivery_log`, the messages each chat got are recorded so
+    `WorkoutWatcher` can later edit them when the workouts change.
+
+    Args:
+        telegram_handler (TelegramHandler): Renders and sends the messages.
+        boxes (iterable): `Box` objects to deliver for.
+        date_str (str): Day to deliver (YYYY-MM-DD); tomorrow is included. If None, each box's own today.
+        direct_chat_ids (iterable, optional): Chats that get every box's message (e.g. the owner's chat).
+        broadcast_id (str, optional): Checkpoint name prefix; each box appends its slug.
+        checkpoint_dir (str, optional): Where broadcast checkpoints live.
+        global_rate (float, optional): Messages per second across all boxes.
+        delivery_log (SQLiteDeliveryLog, optional): Where to record the delivered message IDs.
+        subscribers (bool, optional): Also broadcast to each box's subscribers; if False only the channels
+            and `direct_chat_ids` get the message (the subscribers are then the bot host's to deliver to).
+
+    Returns:
+        dict: Broadcast stats per box slug
+    """
+    global_bucket = TokenBucket(global_rate)
+
+    async def deliver(box):
+        today = datetime.strptime(date_str, "%Y-%m-%d").date() if date_str else datetime.now(box.timezone).date()
+        box_date_str = today.strftime("%Y-%m-%d")
+        dates = [box_date_str, (today + timedelta(days=1)).strftime("%Y-%m-%d")]
+        workouts = await box.workout_api_handler.get_workouts_for_date(box_date_str, include_tomorrow=True)
+        sent_messages = {}
+        try:
+            return await deliver_workouts(
+                telegram_handler,
+                workouts,
+                box.subscriber_store if subscribers else None,
+                direct_chat_ids=(box.channel_id, *direct_chat_ids),
+                broadcast_id=f"{broadcast_id}-{box.slug}" if broadcast_id else None,
+                checkpoint_dir=checkpoint_dir,
+                rate=min(box.broadcast_rate, global_rate),
+                box_name=box.name,
+                global_bucket=global_bucket,
+                sent_messages=sent_messages,
+                today=today,
+            )
+        finally:
+            if delivery_log is not None:
+                delivery_log.record(box.slug, box_date_str, sent_messages, content_hash(workouts, dates))
+
+    boxes = list(boxes)
+    results = await asyncio.gather(*(deliver(box) for box in boxes), return_exceptions=True)
+    stats = {}
+    for box, result in zip(boxes, results):
+        if isinstance(result, Exception):
+            print(f"Error delivering workouts for {box.name}: {result}")
+            result = None
+        stats[box.slug] = result
+    return stats
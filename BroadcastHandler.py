@@ -0,0 +1,340 @@
+import asyncio
+import os
+import time
+from telegram.error import BadRequest, Forbidden, RetryAfter, TimedOut, NetworkError, TelegramError
+from Metrics import ERRORS, MESSAGES_DELIVERED, RETRIES, TELEGRAM_SEND_SECONDS
+from TelegramHandler import ENTITY_PARSE_ERROR, send_message
+
+# Telegram allows roughly 30 messages/second across all chats and about one
+# message/second inside a single chat.
+DEFAULT_GLOBAL_RATE = 30.0
+DEFAULT_PER_CHAT_INTERVAL = 1.0
+DEFAULT_CONCURRENCY = 30
+DEFAULT_MAX_RETRIES = 3
+
+# BadRequest messages that mean the chat is gone for good
+PERMANENT_BAD_REQUESTS = ("chat not found", "user is deactivated", "bot was kicked", "group chat was deactivated")
+# BadRequest messages that mean a delivered message can't be edited in place; a new one is sent instead
+UNEDITABLE_BAD_REQUESTS = ("message to edit not found", "message can't be edited")
+
+
+class TokenBucket:
+    """Async token bucket: `acquire()` waits until a send is allowed.
+
+    The default capacity of one token spreads sends evenly instead of letting
+    a full second's worth out at once, which Telegram also counts against us.
+    `pause(seconds)` stops all senders, which is what a flood-wait asks for.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+
+class BroadcastCheckpoint:
+    """Append-only record of chats that already got a broadcast.
+
+    One chat ID per line, flushed after every delivery, so a crashed run can
+    be restarted with the same broadcast ID without double-sending. Once the
+    broadcast has reached every chat, `remove()` deletes the file.
+    """
+
+    def __init__(self, directory, broadcast_id):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{broadcast_id}.done")
+        try:
+            with open(self.path) as f:
+                self.delivered = set(f.read().split())
+        except FileNotFoundError:
+            self.delivered = set()
+        self._file = open(self.path, 'a')
+
+    def record(self, chat_id):
+        self.delivered.add(chat_id)
+        self._file.write(f"{chat_id}\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    @staticmethod
+    def remove(directory, broadcast_id):
+        """Deletes the checkpoint of a finished broadcast; a missing one is fine."""
+        try:
+            os.remove(os.path.join(directory, f"{broadcast_id}.done"))
+        except FileNotFoundError:
+            pass
+
+
+class Broadcaster:
+    """Sends one message to many chats concurrently within Telegram's rate limits.
+
+    Sends are paced by a global token bucket plus a minimum interval per chat.
+    `RetryAfter` pauses every sender for the requested time and retries the
+    message; chats that blocked the bot or no longer exist are removed from
+    `subscriber_store`. Broadcasts running side by side (one per box) pass
+    the same `global_bucket` so together they stay within the bot's limit.
+    The message IDs each chat ends up showing are kept in `sent_messages`,
+    so a later broadcast can edit them in place (`edit_messages`).
+
+    Args:
+        telegram_handler (TelegramHandler): Provides the `Bot` used to send.
+        subscriber_store (SubscriberStore, optional): Store to unsubscribe dead chats from and mark deliveries in.
+        rate (float, optional): Global messages per second.
+        per_chat_interval (float, optional): Minimum seconds between messages to the same chat.
+        concurrency (int, optional): Number of concurrent senders.
+        max_retries (int, optional): Attempts per chat after flood-waits or network errors.
+        checkpoint_dir (str, optional): Directory for resumable progress files; no checkpointing if None.
+        global_bucket (TokenBucket, optional): Bucket shared with other broadcasts of the same bot.
+    """
+
+    def __init__(self, telegram_handler, subscriber_store=None, rate=DEFAULT_GLOBAL_RATE,
+                 per_chat_interval=DEFAULT_PER_CHAT_INTERVAL, concurrency=DEFAULT_CONCURRENCY,
+                 max_retries=DEFAULT_MAX_RETRIES, checkpoint_dir=None, global_bucket=None):
+        self.bot = telegram_handler.bot
+        self.subscriber_store = subscriber_store
+        self.bucket = TokenBucket(rate)
+        self.global_bucket = global_bucket
+        self.per_chat_interval = per_chat_interval
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.checkpoint_dir = checkpoint_dir
+        self._next_send = {}  # chat_id -> monotonic time the chat may be messaged again
+        self.sent_messages = {}  # chat_id -> message IDs delivered to it, one per chunk
+        self.removed_chats = []
+
+    async def broadcast(self, chat_ids, text, broadcast_id=None, parse_mode='Markdown', edit_messages=None):
+        """Delivers `text` to every chat in `chat_ids`.
+
+        `text` is either one message or a sequence of pre-split chunks (see
+        `TelegramHandler.render_workout_message`) sent in order to each chat.
+        Chats in `edit_messages` ({chat_id: [message_id, ...]} from an earlier
+        delivery) get those messages edited instead of new ones.
+
+        Returns:
+            dict: Counts of sent, skipped (already delivered), failed and removed chats, edited
+                messages, retries and elapsed seconds
+        """
+        start = time.perf_counter()
+        chunks = (text,) if isinstance(text, str) else tuple(text)
+        checkpoint = None
+        if self.checkpoint_dir and broadcast_id:
+            checkpoint = BroadcastCheckpoint(self.checkpoint_dir, broadcast_id)
+
+        stats = {"sent": 0, "skipped": 0, "failed": 0, "removed": 0, "edits": 0, "retries": 0}
+        edit_messages = {str(c): ids for c, ids in (edit_messages or {}).items()}
+        queue = asyncio.Queue()
+        for chat_id in dict.fromkeys(str(c) for c in chat_ids):
+            if checkpoint and chat_id in checkpoint.delivered:
+                stats["skipped"] += 1
+            else:
+                queue.put_nowait(chat_id)
+
+        delivered = []
+
+        async def worker():
+            while True:
+                try:
+                    chat_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                outcome = await self._send(chat_id, chunks, parse_mode, stats, edit_messages.get(chat_id, ()))
+                stats[outcome] += 1
+                if outcome == "sent":
+                    delivered.append(chat_id)
+                    if checkpoint:
+                        checkpoint.record(chat_id)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, queue.qsize()))))
+        finally:
+            if checkpoint:
+                checkpoint.close()
+            if self.subscriber_store is not None and delivered:
+                self.subscriber_store.mark_delivered(delivered)
+
+        stats["elapsed"] = round(time.perf_counter() - start, 3)
+        print(f"Broadcast {broadcast_id or ''} finished: {stats}")
+        return stats
+
+    async def _send(self, chat_id, chunks, parse_mode, stats, edit_ids=()):
+        """Sends every chunk to one chat, returning "sent", "failed" or "removed".
+
+        With `edit_ids`, chunk i replaces the chat's message i in place; extra
+        chunks are sent as new messages and leftover old messages deleted. A
+        retry resumes from the chunk that failed, so no chunk is sent twice.
+        """
+        next_chunk = 0
+        edit_ids = list(edit_ids)
+        message_ids = []
+        leftover_ids = []  # old messages replaced by new ones, deleted at the end
+        for attempt in range(self.max_retries + 1):
+            try:
+                while next_chunk < len(chunks):
+                    wait = self._next_send.get(chat_id, 0) - time.monotonic()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    await self.bucket.acquire()
+                    if self.global_bucket is not None:
+                        await self.global_bucket.acquire()
+                    self._next_send[chat_id] = time.monotonic() + self.per_chat_interval
+                    if next_chunk < len(edit_ids):
+                        if not await self._edit(chat_id, edit_ids[next_chunk], chunks[next_chunk], parse_mode):
+                            # Too old or deleted: this chunk and the rest go out as new messages
+                            leftover_ids.extend(edit_ids[next_chunk + 1:])
+                            del edit_ids[next_chunk:]
+                            continue
+                        stats["edits"] += 1
+                        message_ids.append(edit_ids[next_chunk])
+                    else:
+                        with TELEGRAM_SEND_SECONDS.time(method="sendMessage"):
+                            message = await send_message(self.bot, chat_id, chunks[next_chunk], parse_mode)
+                        MESSAGES_DELIVERED.inc(kind="broadcast")
+                        message_ids.append(message.message_id)
+                    next_chunk += 1
+                for message_id in leftover_ids + edit_ids[len(chunks):]:
+                    await self._delete(chat_id, message_id)
+                self.sent_messages[chat_id] = message_ids
+                return "sent"
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+                print(f"Flood wait {retry_after}s while sending to chat_id {chat_id}")
+                self.bucket.pause(retry_after)
+                if self.global_bucket is not None:
+                    self.global_bucket.pause(retry_after)
+                retry_reason = "flood_wait"
+            except Forbidden as e:
+                return self._remove(chat_id, e)
+            except BadRequest as e:
+                if any(reason in str(e).lower() for reason in PERMANENT_BAD_REQUESTS):
+                    return self._remove(chat_id, e)
+                print(f"Error sending message to chat_id {chat_id}: {e}")
+                ERRORS.inc(stage="broadcast_send")
+                return "failed"
+            except (TimedOut, NetworkError) as e:
+                print(f"Network error sending to chat_id {chat_id} (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(2 ** attempt)
+                retry_reason = "network"
+            if attempt < self.max_retries:
+                stats["retries"] += 1
+                RETRIES.inc(reason=retry_reason)
+        ERRORS.inc(stage="broadcast_send")
+        return "failed"
+
+    async def _edit(self, chat_id, message_id, text, parse_mode):
+        """Replaces a delivered message's text; returns False if Telegram won't edit it any more."""
+        try:
+            with TELEGRAM_SEND_SECONDS.time(method="editMessageText"):
+                await self.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text,
+                                                 parse_mode=parse_mode)
+        except BadRequest as e:
+            reason = str(e).lower()
+            if "not modified" in reason:
+                return True
+            if parse_mode is not None and ENTITY_PARSE_ERROR in reason:
+                # Keep the text rather than lose the chunk to its formatting
+                return await self._edit(chat_id, message_id, text, None)
+            if any(r in reason for r in UNEDITABLE_BAD_REQUESTS):
+                print(f"Can't edit message {message_id} in chat_id {chat_id}, sending a new one: {e}")
+                return False
+            raise
+        MESSAGES_DELIVERED.inc(kind="edit")
+        return True
+
+    async def _delete(self, chat_id, message_id):
+        try:
+            await self.bot.delete_message(chat_id=chat_id, message_id=message_id)
+        except TelegramError as e:
+            print(f"Error deleting message {message_id} in chat_id {chat_id}: {e}")
+
+    def _remove(self, chat_id, error):
+        print(f"Removing chat_id {chat_id}: {error}")
+        self.removed_chats.append(chat_id)
+        if self.subscriber_store is not None:
+            self.subscriber_store.unsubscribe(chat_id)
+        return "removed"
+
+
+async def deliver_workouts(telegram_handler, workouts, subscriber_store=None, direct_chat_ids=(),
+                           broadcast_id=None, checkpoint_dir=None, rate=DEFAULT_GLOBAL_RATE,
+                           box_name=None, global_bucket=None, sent_messages=None, chat_ids=None, today=None):
+    """Sends the today + tomorrow workout message to fixed chats and then to every subscriber.
+
+    Used by both get_wod.py and the bot's own scheduler so the two delivery
+    paths behave the same.
+
+    Args:
+        telegram_handler (TelegramHandler): Renders and sends the message.
+        workouts (list): Today's and tomorrow's workouts.
+        subscriber_store (SubscriberStore, optional): Subscribers to broadcast to.
+        direct_chat_ids (iterable, optional): Chats (e.g. the channel) sent to first; never unsubscribed.
+        broadcast_id (str, optional): Checkpoint name so a re-run resumes instead of resending; the checkpoint
+            is deleted once every chat was reached.
+        checkpoint_dir (str, optional): Where broadcast checkpoints live.
+        rate (float, optional): Global messages per second for the broadcast.
+        box_name (str, optional): Box shown in the message header; the handler's default if None.
+        global_bucket (TokenBucket, optional): Rate budget shared with concurrent broadcasts.
+        sent_messages (dict, optional): Filled with {chat_id: [message_id, ...]} for every chat delivered to.
+        chat_ids (iterable, optional): Subscribers to broadcast to; every subscriber in the store if None.
+        today (date, optional): Day the message calls today; today in Israel time if None.
+
+    Returns:
+        dict: Subscriber broadcast stats (the direct chats' if there are no subscribers), or None if there was
+            nobody to send to
+    """
+    # Rendered once for every recipient
+    chunks = telegram_handler.render_workout_message(workouts, include_tomorrow_check=True, box_name=box_name,
+                                                     today=today)
+    direct_chat_ids = [str(c) for c in direct_chat_ids if c]
+    stats = None
+    failed = 0
+    if direct_chat_ids:
+        # Same checkpoint and pacing as the subscribers, but a failing channel isn't a subscriber to drop
+        direct = Broadcaster(telegram_handler, rate=rate, checkpoint_dir=checkpoint_dir, global_bucket=global_bucket)
+        try:
+            stats = await direct.broadcast(direct_chat_ids, chunks, broadcast_id=broadcast_id)
+            failed += stats["failed"]
+        finally:
+            if sent_messages is not None:
+                sent_messages.update(direct.sent_messages)
+
+    chat_ids = () if subscriber_store is None else subscriber_store.all() if chat_ids is None else chat_ids
+    subscribers = [c for c in chat_ids if c not in direct_chat_ids]
+    if subscribers:
+        broadcaster = Broadcaster(telegram_handler, subscriber_store, rate=rate, checkpoint_dir=checkpoint_dir,
+                                  global_bucket=global_bucket)
+        try:
+            stats = await broadcaster.broadcast(subscribers, chunks, broadcast_id=broadcast_id)
+            failed += stats["failed"]
+        finally:
+            if sent_messages is not None:
+                sent_messages.update(broadcaster.sent_messages)
+    elif subscriber_store is not None:
+        print("No subscribers to broadcast to.")
+
+    if checkpoint_dir and broadcast_id and not failed:
+        # Everyone was reached; only an interrupted or partly failed broadcast keeps its checkpoint to resume
+        BroadcastCheckpoint.remove(checkpoint_dir, broadcast_id)
+    return stats
@@ -0,0 +1,317 @@
+import asyncio
+import heapq
+import json
+import os
+import re
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+from BroadcastHandler import DEFAULT_GLOBAL_RATE, TokenBucket, deliver_workouts
+from DeliveryLog import content_hash
+from Metrics import ERRORS
+
+DEFAULT_TICK = 30                        # seconds between looks at the earliest bucket
+DEFAULT_CATCH_UP_WINDOW = 6 * 60 * 60    # a bucket missed by more than this waits for its next day
+DEFAULT_PREFETCH_LEAD = 15 * 60          # seconds before a bucket's time to re-warm its box
+
+
+def parse_hhmm(value):
+    """Parses "HH:MM" into a naive `time`; raises ValueError if it isn't a valid time of day."""
+    if not re.fullmatch(r"\d{1,2}:\d{2}", value or ""):
+        raise ValueError(f"Not a time of day: {value!r}")
+    hour, minute = value.split(":")
+    return time(int(hour), int(minute))
+
+
+def next_occurrence(tz, hhmm, after):
+    """The first `hhmm` local time in `tz` strictly after the aware datetime `after`."""
+    local = after.astimezone(tz)
+    at = parse_hhmm(hhmm)
+    candidate = datetime.combine(local.date(), at, tzinfo=tz)
+    if candidate <= local:
+        candidate = datetime.combine(local.date() + timedelta(days=1), at, tzinfo=tz)
+    return candidate
+
+
+class BucketScheduler:
+    """Delivers the daily WOD at each subscriber's local time, one batched send per time bucket.
+
+    Subscribers are grouped into buckets keyed by (box, timezone, "HH:MM").
+    Chats without preferences of their own fall into the box's default
+    buckets: its timezone at each of `default_times`, together with its
+    channel and `direct_chat_ids`. A timezone without a time means the
+    default times in that timezone, and a time without a timezone means the
+    box's. The members of a default bucket are worked out when it fires,
+    which costs nothing extra because the send is per member anyway.
+
+    Each bucket has one entry on a min-heap ordered by its next delivery in
+    UTC. A tick only peeks at the top, and a due bucket costs one pop and
+    one push whatever its size, so scheduling overhead grows with the number
+    of buckets and not with subscribers. When a bucket fires, the box's
+    workouts for the bucket's local date are fetched and rendered once and
+    sent to every member in a single `Broadcaster` fan-out. Buckets sharing
+    a box and local date reuse the fetch and the render through the workout
+    cache and `MessageRenderer`. Broadcast IDs name the bucket and local
+    date, and the last date each bucket was delivered is kept in
+    `state_file`, so a restart catches up on missed buckets without
+    resending.
+
+    `prefetch_lead` seconds before a bucket is due, `prefetch(box)` (e.g.
+    `DailyScheduler.prefetch_box`) re-warms the box's workouts, message and
+    analyses, so the delivery and the replies to it are served from cache.
+    A second heap holds those warm-ups, one per bucket. A box is prefetched
+    once however many of its buckets come up, in a background task that a
+    due delivery never waits for.
+
+    Args:
+        box_registry (BoxRegistry): Boxes to deliver for.
+        telegram_handler (TelegramHandler): Renders and sends the messages.
+        default_times (iterable): "HH:MM" strings or `time`s, in each box's timezone, for chats without their own.
+        direct_chat_ids (iterable, optional): Chats that get every box's default deliveries.
+        checkpoint_dir (str, optional): Broadcast checkpoint directory.
+        delivery_log (SQLiteDeliveryLog, optional): Records delivered messages for `WorkoutWatcher`.
+        state_file (str, optional): JSON file with the last local date each bucket was delivered.
+        global_rate (float, optional): Messages per second across all buckets firing together.
+        catch_up_window (int, optional): Seconds after its time that a missed bucket is still delivered.
+        prefetch (callable, optional): Coroutine function taking a `Box`, started before its buckets are due.
+        prefetch_lead (int, optional): Seconds before a bucket's time that `prefetch` runs.
+    """
+
+    def __init__(self, box_registry, telegram_handler, default_times, direct_chat_ids=(), checkpoint_dir=None,
+                 delivery_log=None, state_file=None, global_rate=DEFAULT_GLOBAL_RATE,
+                 catch_up_window=DEFAULT_CATCH_UP_WINDOW, prefetch=None, prefetch_lead=DEFAULT_PREFETCH_LEAD):
+        self.box_registry = box_registry
+        self.telegram_handler = telegram_handler
+        self.default_times = [t if isinstance(t, str) else t.strftime("%H:%M") for t in default_times]
+        self.direct_chat_ids = [c for c in direct_chat_ids if c]
+        self.checkpoint_dir = checkpoint_dir
+        self.delivery_log = delivery_log
+        self.state_file = state_file
+        self.global_bucket = TokenBucket(global_rate)
+        self.global_rate = global_rate
+        self.catch_up_window = timedelta(seconds=catch_up_window)
+        self.prefetch = prefetch
+        self.prefetch_lead = prefetch_lead
+        self.prefetches = 0
+        self.fired = 0
+        self.skipped_late = 0
+        self.max_lag = 0.0
+        self._buckets = {}       # (slug, timezone, "HH:MM") -> chats with their own preferences
+        self._defaults = set()   # bucket keys that also take the box's chats without preferences
+        self._memberships = {}   # (slug, chat_id) -> bucket keys the chat is in
+        self._heap = []          # (next delivery as a UTC timestamp, bucket key)
+        self._queued = set()     # bucket keys with an entry on the heap
+        self._lead_heap = []     # (prefetch time as a UTC timestamp, bucket key)
+        self._prefetching = {}   # box slug -> running prefetch task
+        self._last_runs = self._load_state()
+
+    def register(self, job_queue, tick=DEFAULT_TICK):
+        """Builds the buckets and checks the earliest one every `tick` seconds on `job_queue`."""
+        self.rebuild()
+        job_queue.run_repeating(self._tick_job, interval=tick, first=5, name="bucket-delivery")
+
+    def rebuild(self, now=None):
+        """Groups every box's subscribers into buckets and schedules each bucket's next delivery.
+
+        A bucket whose time passed less than `catch_up_window` ago without a
+        delivery today is scheduled at once.
+        """
+        now = now or datetime.now(timezone.utc)
+        self._buckets, self._defaults, self._memberships = {}, set(), {}
+        self._heap, self._queued, self._lead_heap = [], set(), []
+        for box in self.box_registry:
+            for hhmm in self.default_times:
+                key = (box.slug, box.timezone.key, hhmm)
+                self._defaults.add(key)
+                self._buckets.setdefault(key, set())
+                self._schedule(key, now, catch_up=True)
+            for chat_id, preferences in box.subscriber_store.preferences().items():
+                self._join(box, chat_id, preferences, now, catch_up=True)
+
+    def update(self, box, chat_id, now=None):
+        """Moves `chat_id` to the buckets of its current preferences, e.g. after /timezone or /stop."""
+        now = now or datetime.now(timezone.utc)
+        chat_id = str(chat_id)
+        for key in self._memberships.pop((box.slug, chat_id), ()):
+            self._buckets.get(key, set()).discard(chat_id)
+        if box.subscriber_store.is_subscribed(chat_id):
+            # A chat joining a bucket mid-day waits for its next time rather than triggering a catch-up
+            self._join(box, chat_id, box.subscriber_store.get_preferences(chat_id), now, catch_up=False)
+
+    def _join(self, box, chat_id, preferences, now, catch_up):
+        tz_name, hhmm = preferences
+        if tz_name is None and hhmm is None:
+            return
+        keys = [(box.slug, tz_name or box.timezone.key, t) for t in ([hhmm] if hhmm else self.default_times)]
+        for key in keys:
+            self._buckets.setdefault(key, set()).add(chat_id)
+            self._schedule(key, now, catch_up)
+        self._memberships[(box.slug, chat_id)] = keys
+
+    def _schedule(self, key, now, catch_up):
+        if key in self._queued:
+            return
+        _, tz_name, hhmm = key
+        tz = ZoneInfo(tz_name)
+        today_at = datetime.combine(now.astimezone(tz).date(), parse_hhmm(hhmm), tzinfo=tz)
+        if catch_up and today_at <= now <= today_at + self.catch_up_window \
+                and self._last_runs.get(self._state_key(key)) != today_at.strftime("%Y-%m-%d"):
+            due = today_at
+        else:
+            due = next_occurrence(tz, hhmm, now)
+        self._push(key, due.timestamp(), now.timestamp())
+
+    def _push(self, key, due, now):
+        heapq.heappush(self._heap, (due, key))
+        self._queued.add(key)
+        if self.prefetch is not None and due - self.prefetch_lead > now:
+            # A catch-up that is due at once has nothing to warm up ahead of
+            heapq.heappush(self._lead_heap, (due - self.prefetch_lead, key))
+
+    def next_due(self):
+        """UTC timestamp of the earliest scheduled bucket, or None."""
+        return self._heap[0][0] if self._heap else None
+
+    async def tick(self, now=None):
+        """Delivers every bucket that is due, all in parallel; returns their broadcast stats by bucket key."""
+        now = now or datetime.now(timezone.utc)
+        # In the background: a slow warm-up (e.g. a batched LLM call) must not hold up a due delivery
+        self._start_prefetches(now)
+        due = []
+        while self._heap and self._heap[0][0] <= now.timestamp():
+            due_at, key = heapq.heappop(self._heap)
+            self._queued.discard(key)
+            if not self._buckets.get(key) and key not in self._defaults:
+                # Its last member moved away; dropped until someone joins again
+                self._buckets.pop(key, None)
+                continue
+            due_at = datetime.fromtimestamp(due_at, timezone.utc)
+            # The next delivery is queued before this one runs, so a failure can't stall the bucket
+            self._push(key, next_occurrence(ZoneInfo(key[1]), key[2], due_at).timestamp(), now.timestamp())
+            if now - due_at > self.catch_up_window:
+                self.skipped_late += 1
+                continue
+            self.max_lag = max(self.max_lag, (now - due_at).total_seconds())
+            due.append((key, due_at))
+
+        results = await asyncio.gather(*(self._fire(key, due_at) for key, due_at in due), return_exceptions=True)
+        stats = {}
+        for (key, _), result in zip(due, results):
+            if isinstance(result, Exception):
+                print(f"Error delivering bucket {'/'.join(key)}: {result}")
+                ERRORS.inc(stage="bucket_delivery")
+                result = None
+            stats[key] = result
+        return stats
+
+    def _start_prefetches(self, now):
+        """Starts a prefetch task for every box with a bucket coming up, unless one is already running."""
+        slugs = set()
+        while self._lead_heap and self._lead_heap[0][0] <= now.timestamp():
+            _, key = heapq.heappop(self._lead_heap)
+            if self._buckets.get(key) or key in self._defaults:
+                slugs.add(key[0])
+        for slug in sorted(slugs):
+            box = self.box_registry.get(slug)
+            if box is None or slug in self._prefetching:
+                continue
+            task = asyncio.ensure_future(self._prefetch_box(box))
+            self._prefetching[slug] = task
+            task.add_done_callback(lambda t, slug=slug: self._prefetching.pop(slug, None))
+
+    async def _prefetch_box(self, box):
+        try:
+            await self.prefetch(box)
+        except Exception as e:
+            print(f"Error prefetching workouts for {box.name}: {e}")
+            ERRORS.inc(stage="bucket_prefetch")
+        else:
+            self.prefetches += 1
+
+    async def _fire(self, key, due_at):
+        slug, tz_name, hhmm = key
+        box = self.box_registry.get(slug)
+        if box is None:
+            return None
+        local_date = due_at.astimezone(ZoneInfo(tz_name)).date()
+        date_str = local_date.strftime("%Y-%m-%d")
+        members = set(self._buckets.get(key, ()))
+        direct_chat_ids = ()
+        if key in self._defaults:
+            preferences = box.subscriber_store.preferences()
+            members.update(c for c in box.subscriber_store.all() if c not in preferences)
+            direct_chat_ids = (box.channel_id, *self.direct_chat_ids)
+        members = [c for c in members if box.subscriber_store.is_subscribed(c)]
+
+        workouts = await box.workout_api_handler.get_workouts_for_date(date_str, include_tomorrow=True)
+        dates = [date_str, (local_date + timedelta(days=1)).strftime("%Y-%m-%d")]
+        sent_messages = {}
+        try:
+            stats = await deliver_workouts(
+                self.telegram_handler,
+                workouts,
+                box.subscriber_store,
+                direct_chat_ids=direct_chat_ids,
+                broadcast_id=f"wod-{date_str}-{self._state_key(key).replace('/', '-').replace(':', '')}",
+                checkpoint_dir=self.checkpoint_dir,
+                rate=min(box.broadcast_rate, self.global_rate),
+                box_name=box.name,
+                global_bucket=self.global_bucket,
+                sent_messages=sent_messages,
+                chat_ids=members,
+                today=local_date,
+            )
+        finally:
+            if self.delivery_log is not None and sent_messages:
+                self.delivery_log.record(slug, date_str, sent_messages, content_hash(workouts, dates))
+        self.fired += 1
+        self._record_run(key, date_str)
+        return stats
+
+    async def _tick_job(self, context):
+        try:
+            await self.tick()
+        except Exception as e:
+            print(f"Error delivering workouts: {e}")
+
+    def stats(self):
+        """Buckets and the chats with their own schedule in them, warm-ups, deliveries, late skips and the worst lag."""
+        return {
+            "buckets": len(self._buckets),
+            "scheduled": len(self._heap),
+            "custom_subscribers": len(self._memberships),
+            "prefetches": self.prefetches,
+            "fired": self.fired,
+            "skipped_late": self.skipped_late,
+            "max_lag_seconds": round(self.max_lag, 1),
+        }
+
+    @staticmethod
+    def _state_key(key):
+        return "/".join(key)
+
+    def _load_state(self):
+        if not self.state_file:
+            return {}
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable delivery state {self.state_file}: {e}")
+            return {}
+
+    def _record_run(self, key, date_str):
+        self._last_runs[self._state_key(key)] = date_str
+        # Buckets nobody is in any more are forgotten
+        current = {self._state_key(k) for k in self._buckets}
+        self._last_runs = {k: v for k, v in self._last_runs.items() if k in current}
+        if not self.state_file:
+            return
+        tmp_path = f"{self.state_file}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self._last_runs, f)
+            os.replace(tmp_path, self.state_file)
+        except OSError as e:
+            print(f"Error saving delivery state to {self.state_file}: {e}")
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+DEFAULT_KEEP_DAYS = 3  # Telegram only lets bots edit messages for 48 hours
+
+
+def content_hash(workouts, dates):
+    """Fingerprints the visible content of each of `dates` in `workouts`, e.g. "3f2a…:e0b4…".
+
+    One short hash per date, joined in order, so comparing two fingerprints
+    also tells which day changed (see `changed_dates`). An unpublished day
+    has a hash too, so publishing it counts as a change.
+    """
+    parts = []
+    for date in dates:
+        content = [
+            (attr.get("title", "N/A"), attr.get("description", "N/A"))
+            for attr in (w.get("attributes", {}) for w in workouts)
+            if attr.get("scheduled_date", "").startswith(date)
+        ]
+        parts.append(hashlib.sha1(json.dumps(content).encode()).hexdigest()[:12])
+    return ":".join(parts)
+
+
+def changed_dates(old_hash, new_hash, dates):
+    """The `dates` whose part of two `content_hash` fingerprints differs."""
+    old_parts = (old_hash or "").split(":")
+    new_parts = new_hash.split(":")
+    return [date for i, date in enumerate(dates)
+            if i >= len(old_parts) or i >= len(new_parts) or old_parts[i] != new_parts[i]]
+
+
+class SQLiteDeliveryLog:
+    """The messages each chat was sent for a box's delivery of a day, and what they showed.
+
+    Written by `deliver_boxes` and `WorkoutWatcher`, read by the watcher to
+    edit delivered messages in place when the workouts change. One row per
+    (box, date, chat) holds the chat's message IDs (one per chunk) and the
+    `content_hash` they were rendered from. Days older than `keep_days` are
+    pruned on every write.
+
+    Args:
+        path (str): SQLite database file.
+        keep_days (int, optional): Days of deliveries kept.
+    """
+
+    def __init__(self, path, keep_days=DEFAULT_KEEP_DAYS):
+        self.path = path
+        self.keep_days = keep_days
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS deliveries ("
+            " box TEXT NOT NULL,"
+            " date TEXT NOT NULL,"
+            " chat_id TEXT NOT NULL,"
+            " message_ids TEXT NOT NULL,"
+            " content_hash TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (box, date, chat_id))"
+        )
+
+    def record(self, box, date, sent_messages, content_hash):
+        """Stores the message IDs each chat in `sent_messages` ({chat_id: [message_id, ...]}) now shows."""
+        if not sent_messages:
+            return
+        now = time.time()
+        cutoff = (datetime.strptime(date, "%Y-%m-%d") - timedelta(days=self.keep_days)).strftime("%Y-%m-%d")
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO deliveries (box, date, chat_id, message_ids, content_hash, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [(box, date, str(chat_id), json.dumps(list(ids)), content_hash, now)
+                 for chat_id, ids in sent_messages.items()],
+            )
+            self._conn.execute("DELETE FROM deliveries WHERE date < ?", (cutoff,))
+            self._conn.execute("COMMIT")
+
+    def messages(self, box, date):
+        """Returns {chat_id: (message_ids, content_hash)} for the box's delivery of `date`."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chat_id, message_ids, content_hash FROM deliveries WHERE box = ? AND date = ?", (box, date)
+            ).fetchall()
+        return {chat_id: (json.loads(ids), digest) for chat_id, ids, digest in rows}
+
+    def forget(self, box, date, chat_ids):
+        """Drops chats whose messages can't be updated any more (e.g. they blocked the bot)."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("DELETE FROM deliveries WHERE box = ? AND date = ? AND chat_id = ?",
+                                   [(box, date, str(chat_id)) for chat_id in chat_ids])
+            self._conn.execute("COMMIT")
+
+    def stats(self):
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM deliveries").fetchone()[0]
+        return {"tracked_messages": count}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
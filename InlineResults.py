@@ -0,0 +1,168 @@
+import asyncio
+from datetime import datetime, timedelta
+from telegram import InlineQueryResultArticle, InputTextMessageContent
+from DeliveryLog import content_hash
+from Metrics import CACHE_REQUESTS, ERRORS
+
+DEFAULT_CACHE_TIME = 300              # seconds Telegram may reuse an inline answer
+DEFAULT_UNPUBLISHED_CACHE_TIME = 60   # ...while one of the days in it has no workouts yet
+MIN_CACHE_TIME = 5                    # for answers given before the results are ready
+DAYS = ("today", "tomorrow")
+MAX_DESCRIPTION_LENGTH = 100
+
+
+def _seconds_until_midnight(now):
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=now.tzinfo)
+    return int((midnight - now).total_seconds())
+
+
+class InlineResultCache:
+    """Ready-made answers to inline queries like "@bot today" and "@bot tomorrow", per box.
+
+    `refresh_box()` reads the box's workouts, from the workout cache unless
+    the scheduler passes fresh ones. When a day's content has changed, it
+    rebuilds that day's `InlineQueryResultArticle`s with the box's
+    `MessageRenderer`: one article with the whole day, then one per workout.
+    `lookup()` only reads what was built, so an inline query never waits on
+    SugarWOD or OpenAI. Before a box's results exist, or after midnight
+    until they are rebuilt, a query gets an empty answer with a short
+    `cache_time`. A rebuild is then started in the background.
+
+    Telegram may reuse an answer for `cache_time` seconds. That drops to
+    `unpublished_cache_time` while a day in the answer is still empty, and
+    an answer never outlives midnight in the box's timezone, when "today"
+    changes.
+
+    Args:
+        box_registry (BoxRegistry): Boxes whose WODs are offered.
+        telegram_handler (TelegramHandler): Provides each box's renderer.
+        cache_time (int, optional): Seconds Telegram may cache an answer.
+        unpublished_cache_time (int, optional): Same, for answers with a day not published yet.
+    """
+
+    def __init__(self, box_registry, telegram_handler, cache_time=DEFAULT_CACHE_TIME,
+                 unpublished_cache_time=DEFAULT_UNPUBLISHED_CACHE_TIME):
+        self.box_registry = box_registry
+        self.telegram_handler = telegram_handler
+        self.cache_time = cache_time
+        self.unpublished_cache_time = unpublished_cache_time
+        self.answers = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self._entries = {}  # box slug -> {"today"/"tomorrow": (date, content hash, results, published)}
+        self._refreshing = {}  # box slug -> background refresh task
+
+    async def refresh(self):
+        """Rebuilds whatever changed for every box."""
+        for box in self.box_registry:
+            await self.refresh_box(box)
+
+    async def refresh_box(self, box, workouts=None, today=None):
+        """Rebuilds the box's results for days whose workouts changed.
+
+        Args:
+            box (Box): The box.
+            workouts (list, optional): Today's and tomorrow's workouts if already fetched; read from the cache if None.
+            today (date, optional): The day `workouts` were fetched for; today in the box's timezone if None.
+        """
+        today = today or datetime.now(box.timezone).date()
+        dates = {"today": today.strftime("%Y-%m-%d"), "tomorrow": (today + timedelta(days=1)).strftime("%Y-%m-%d")}
+        if workouts is None:
+            workouts = await box.workout_api_handler.get_workouts_for_date(dates["today"], include_tomorrow=True)
+        entries = self._entries.setdefault(box.slug, {})
+        if not workouts and any(entries.get(day, (None,))[0] == dates[day] and entries[day][3] for day in DAYS):
+            # An empty answer for days that had workouts is a failed fetch, not a coach deleting them
+            return
+        renderer = self.telegram_handler.renderer_for(box.name)
+        for day, date_str in dates.items():
+            digest = content_hash(workouts, [date_str])
+            current = entries.get(day)
+            if current is not None and current[0] == date_str and current[1] == digest:
+                continue
+            day_workouts = [w for w in workouts if w.get("attributes", {}).get("scheduled_date", "").startswith(date_str)]
+            entries[day] = (date_str, digest, self._build(renderer, day_workouts, day, date_str, digest),
+                            bool(day_workouts))
+            self.rebuilds += 1
+
+    @staticmethod
+    def _build(renderer, workouts, day, date_str, digest):
+        label = day.capitalize()
+        if not workouts:
+            if day == "tomorrow":
+                text = f"⚠️ _Sorry… Tomorrow's WOD ({date_str}) hasn't been published yet._"
+            else:
+                text = f"_No workouts found for today ({date_str})._"
+            return [InlineQueryResultArticle(
+                id=f"{date_str}-{digest}-none", title=f"{label}'s WOD ({date_str})", description="Not published yet",
+                input_message_content=InputTextMessageContent(text, parse_mode='Markdown'))]
+
+        titles = [w.get("attributes", {}).get("title", "N/A") for w in workouts]
+        results = [InlineQueryResultArticle(
+            id=f"{date_str}-{digest}-all", title=f"{label}'s WOD ({date_str})",
+            description=", ".join(titles)[:MAX_DESCRIPTION_LENGTH],
+            input_message_content=InputTextMessageContent(renderer.render_day(workouts, date_str, label),
+                                                          parse_mode='Markdown'))]
+        if len(workouts) > 1:
+            for i, (workout, title) in enumerate(zip(workouts, titles)):
+                description = workout.get("attributes", {}).get("description", "").strip().split("\n", 1)[0]
+                results.append(InlineQueryResultArticle(
+                    id=f"{date_str}-{digest}-{i}", title=f"{label}: {title}",
+                    description=description[:MAX_DESCRIPTION_LENGTH],
+                    input_message_content=InputTextMessageContent(renderer.render_day([workout], date_str, label),
+                                                                  parse_mode='Markdown')))
+        return results
+
+    def lookup(self, query, user_id=None):
+        """Answers an inline query from the built results, without any I/O.
+
+        "today" or "tomorrow" (or a prefix such as "tom") picks the day;
+        anything else offers both.
+
+        Returns:
+            tuple: (results, cache_time, is_personal) for `InlineQuery.answer`
+        """
+        box = self.box_registry.box_for_chat(str(user_id)) if user_id is not None else self.box_registry.default
+        # With several boxes the answer depends on who asks, so Telegram must not share it
+        is_personal = len(self.box_registry) > 1
+        now = datetime.now(box.timezone)
+        entries = self._entries.get(box.slug, {})
+        if entries.get("today", (None,))[0] != now.strftime("%Y-%m-%d"):
+            self.misses += 1
+            CACHE_REQUESTS.inc(cache="inline", result="miss")
+            self._refresh_in_background(box)
+            return [], MIN_CACHE_TIME, is_personal
+
+        words = query.lower().split()
+        days = [day for day in DAYS if any(day.startswith(word) for word in words)] or list(DAYS)
+        results = [result for day in days for result in entries[day][2]]
+        published = all(entries[day][3] for day in days)
+        cache_time = min(self.cache_time if published else self.unpublished_cache_time, _seconds_until_midnight(now))
+        self.answers += 1
+        CACHE_REQUESTS.inc(cache="inline", result="hit")
+        return results, max(MIN_CACHE_TIME, cache_time), is_personal
+
+    def _refresh_in_background(self, box):
+        task = self._refreshing.get(box.slug)
+        if task is None or task.done():
+            self._refreshing[box.slug] = asyncio.ensure_future(self._safe_refresh(box))
+
+    async def _safe_refresh(self, box):
+        try:
+            await self.refresh_box(box)
+        except Exception as e:
+            print(f"Error building inline results for {box.name}: {e}")
+            ERRORS.inc(stage="inline_refresh")
+
+    async def refresh_job(self, context):
+        """Job-queue callback: rebuilds changed results for every box."""
+        for box in self.box_registry:
+            await self._safe_refresh(box)
+
+    def stats(self):
+        """Answers served from the built results, misses, rebuilds and boxes with results ready."""
+        return {
+            "answers": self.answers,
+            "misses": self.misses,
+            "rebuilds": self.rebuilds,
+            "boxes_ready": len(self._entries),
+        }
@@ -0,0 +1,258 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency buckets; covers a cache hit up to a slow LLM call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DEFAULT_DUMP_INTERVAL = 30.0  # seconds between periodic dumps
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """Monotonic count per label set, e.g. errors by stage."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """Latency distribution per label set, in fixed cumulative buckets.
+
+    `observe()` is a bisect and three additions under a lock, cheap enough
+    to leave on for every request.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._values = {}  # label key -> [per-bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += seconds
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the duration of the `with` block, including when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        entry = self._values.get(_label_key(labels))
+        return entry[2] if entry else 0
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    samples.append((f"{self.name}_bucket", key + (("le", le),), cumulative))
+                samples.append((f"{self.name}_sum", key, round(total, 6)))
+                samples.append((f"{self.name}_count", key, count))
+        return samples
+
+
+class MetricsRegistry:
+    """Holds every metric and renders them in the Prometheus text format.
+
+    Components that already keep counters (the caches' `stats()`) are
+    registered as collectors and read only when metrics are scraped, so
+    they cost nothing on the request path.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = {}  # prefix -> (stats callable, help)
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text):
+        return self._get_or_create(Counter, name, help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, buckets)
+
+    def _get_or_create(self, cls, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args)
+            return metric
+
+    def register_stats(self, prefix, stats, help_text=""):
+        """Exposes every numeric value of `stats()` as a gauge named `{prefix}_{key}`."""
+        self._collectors[prefix] = (stats, help_text)
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, value in metric.samples():
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        for prefix, (stats, help_text) in list(self._collectors.items()):
+            try:
+                values = stats()
+            except Exception as e:
+                print(f"Error collecting {prefix} metrics: {e}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"# HELP {prefix}_{key} {help_text}".rstrip())
+                    lines.append(f"# TYPE {prefix}_{key} gauge")
+                    lines.append(f"{prefix}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry used by every handler
+REGISTRY = MetricsRegistry()
+
+UPSTREAM_FETCH_SECONDS = REGISTRY.histogram("wod_upstream_fetch_seconds", "SugarWOD request latency")
+RENDER_SECONDS = REGISTRY.histogram("wod_render_seconds", "Workout message rendering time")
+TELEGRAM_SEND_SECONDS = REGISTRY.histogram("wod_telegram_send_seconds", "Telegram send/edit latency per message")
+LLM_SECONDS = REGISTRY.histogram("wod_llm_seconds", "OpenAI completion time")
+LLM_FIRST_TOKEN_SECONDS = REGISTRY.histogram("wod_llm_first_token_seconds", "Time until a streamed completion's first token")
+COMMAND_SECONDS = REGISTRY.histogram("wod_command_seconds", "Bot command handling time")
+CACHE_REQUESTS = REGISTRY.counter("wod_cache_requests_total", "Cache lookups by cache and result")
+ERRORS = REGISTRY.counter("wod_errors_total", "Errors by stage")
+RETRIES = REGISTRY.counter("wod_retries_total", "Retried sends by reason")
+MESSAGES_DELIVERED = REGISTRY.counter("wod_messages_delivered_total", "Messages delivered to Telegram by kind")
+ANALYSES = REGISTRY.counter("wod_analyses_total", "Workout analyses by path (rule_based or llm)")
+UPLOAD_SECONDS = REGISTRY.histogram("wod_upload_seconds", "Upload handling time by stage (queued, download, parse)")
+UPLOADS = REGISTRY.counter("wod_uploads_total", "Uploads by outcome")
+ADMISSIONS = REGISTRY.counter("wod_admissions_total", "Coalesced commands by command and verdict (admitted, coalesced, debounced)")
+WATCH_POLLS = REGISTRY.counter("wod_watch_polls_total", "Change-detection polls by outcome (idle, unchanged, updated)")
+PROMPT_TOKENS = REGISTRY.counter("wod_prompt_tokens_total", "Estimated prompt tokens: raw description vs structured prompt")
+
+
+def timed_command(name, handler):
+    """Wraps a bot command handler so its duration and failures are recorded."""
+    async def wrapper(update, context):
+        start = time.perf_counter()
+        try:
+            return await handler(update, context)
+        except Exception:
+            ERRORS.inc(stage=f"command_{name}")
+            raise
+        finally:
+            COMMAND_SECONDS.observe(time.perf_counter() - start, command=name)
+    wrapper.__name__ = getattr(handler, "__name__", name)
+    wrapper.__doc__ = handler.__doc__
+    return wrapper
+
+
+def _serve_metrics(handler):
+    if handler.path.split("?")[0] != "/metrics":
+        handler.send_error(404)
+        return
+    body = handler.registry.render().encode()
+    handler.send_response(200)
+    handler.send_header("Content-Type", CONTENT_TYPE)
+    handler.send_header("Content-Length", str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+def start_metrics_server(port, host="127.0.0.1", registry=REGISTRY):
+    """Serves `GET /metrics` from a daemon thread; returns the server (call `shutdown()` to stop it)."""
+    # Imported here so one-shot runs that never serve metrics don't load the HTTP server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    handler = type("MetricsRequestHandler", (BaseHTTPRequestHandler,), {
+        "registry": registry,
+        "do_GET": _serve_metrics,
+        "log_message": lambda self, format, *args: None,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def dump_metrics(path, registry=REGISTRY):
+    """Writes the current metrics to `path` atomically (temp file + rename)."""
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write(registry.render())
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Error writing metrics to {path}: {e}")
+
+
+class PeriodicDump:
+    """Dumps metrics to a file every `interval` seconds and once more on `stop()`.
+
+    For one-shot runs like get_wod.py that exit before anything could scrape them.
+    """
+
+    def __init__(self, path, interval=DEFAULT_DUMP_INTERVAL, registry=REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-dump", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            dump_metrics(self.path, self.registry)
+
+    def stop(self):
+        self._stopped.set()
+        dump_metrics(self.path, self.registry)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -1,60 +1,347 @@
+import asyncio
 import os
+import time
 import openai
-from dotenv import load_dotenv
-from WorkoutAPI_Handler import WorkoutAPI_Handler
+from AnalysisCache import AnalysisCache, analysis_key
+from Metrics import ANALYSES, ERRORS, LLM_FIRST_TOKEN_SECONDS, LLM_SECONDS, PROMPT_TOKENS
+from WorkoutParser import format_estimate, format_pacing, parse_workout
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
 
-class OpenAIHandler:
+SYSTEM_PROMPT = "You are a CrossFit coach and workout analyst. Analyze the workout and provide insights about the workout type, difficulty, target areas, and any tips for scaling or modifications."
+DEFAULT_MODEL = "gpt-4o"
+DEFAULT_TEMPERATURE = 0.7
+DEFAULT_MAX_TOKENS = 500
+# Used when scaling (and, for fully parsed workouts, the time estimate) is already worked out locally
+NARRATIVE_PROMPT = "You are a CrossFit coach. Scaling options and any time estimates already worked out are given to the athlete; reply briefly with only what is asked."
+# Used for files the athlete uploads: recorded sessions, logged results or a photographed workout
+UPLOAD_PROMPT = ("You are a CrossFit coach reviewing a workout the athlete uploaded: a recorded session, their logged"
+                 " results or a photographed workout. Scaling options and any time estimates already worked out are"
+                 " given; reply briefly with feedback on what the data shows (effort, pacing, what to work on next),"
+                 " then anything else that is asked.")
+FALLBACK_MESSAGE = "Sorry, I couldn't analyze the workout at this time."
+# "auto": skip the LLM when every workout is fully parsed; "always": always add an LLM narrative
+DEFAULT_LLM_MODE = "auto"
+
+
+def estimate_tokens(messages):
+    """Rough prompt size of `messages` (4 characters per token); only used to compare and budget prompts."""
+    return sum(len(m["content"]) for m in messages) // 4
+
+
+def _normalize_text(text):
+    """Normalizes line endings and stray whitespace so cosmetic edits don't miss the cache."""
+    lines = str(text).replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+class _SharedStream:
+    """Replays one streaming completion to any number of readers, including late joiners."""
+
     def __init__(self):
-        load_dotenv()
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._changed = asyncio.Event()
+
+    def push(self, chunk):
+        self.chunks.append(chunk)
+        self._wake()
+
+    def finish(self, error=None):
+        self.error = error
+        self.done = True
+        self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def __aiter__(self):
+        index = 0
+        while True:
+            changed = self._changed
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
+
+
+class OpenAIHandler:
+    """Workout analysis: a rule-based estimate first, the LLM only for what rules can't cover.
+
+    Each workout is parsed into a structured form (see WorkoutParser). The
+    time estimate and scaling options always come from the parser. When
+    every workout is fully understood (and `llm_mode` is "auto") template
+    pacing advice completes the answer without an API call; otherwise the
+    LLM writes the pacing narrative from the compact structured summary
+    rather than the raw description.
+    """
+
+    def __init__(self, cache=None, model=DEFAULT_MODEL, temperature=DEFAULT_TEMPERATURE, max_tokens=DEFAULT_MAX_TOKENS,
+                 llm_mode=DEFAULT_LLM_MODE):
+        # The environment (and .env) is loaded by the entry point: bot.py, cli.py or the example below
         openai.api_key = os.getenv('OPENAI_API_KEY')
-        
+        self.cache = cache if cache is not None else AnalysisCache()
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.llm_mode = llm_mode
+        self.analyses = 0
+        self.rule_based = 0
+        self.raw_prompt_tokens = 0   # estimated tokens of the raw-description prompt
+        self.prompt_tokens = 0       # estimated tokens of the prompt actually needed
+        self._streams = {}  # cache key -> _SharedStream of the completion in flight
+
     def analyze_workout(self, workout_data):
-        """Analyzes workout data using OpenAI's API and returns insights."""
+        """Analyzes workout data and returns insights.
+
+        Identical workouts (after normalization) with the same prompt and
+        settings are answered from the cache without calling the API.
+        """
         try:
-            # Format the workout data into a prompt
-            prompt = self._format_workout_prompt(workout_data)
-            
-            # Call OpenAI API
-            response = openai.ChatCompletion.create(
-                model="gpt-4o",  # Using GPT-4
-                messages=[
-                    {"role": "system", "content": "You are a CrossFit coach and workout analyst. Analyze the workout and provide insights about the workout type, difficulty, target areas, and any tips for scaling or modifications."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=500
-            )
-            
-            return response.choices[0].message.content
-            
+            estimate, narrative, messages = self._plan(workout_data)
+            if messages is not None:
+                narrative = self.cache.get_or_compute(self.cache_key(messages), lambda: self._complete(messages))
+            return self._join(estimate, narrative)
+
         except Exception as e:
             print(f"Error analyzing workout with OpenAI: {e}")
-            return "Sorry, I couldn't analyze the workout at this time."
-    
+            ERRORS.inc(stage="llm")
+            return FALLBACK_MESSAGE
+
+    async def analyze_workout_async(self, workout_data):
+        """Non-blocking `analyze_workout` for use inside the bot's event loop."""
+        try:
+            estimate, narrative, messages = self._plan(workout_data)
+            if messages is not None:
+                narrative = await self.cache.aget_or_compute(self.cache_key(messages),
+                                                             lambda: self._acomplete(messages))
+            return self._join(estimate, narrative)
+
+        except Exception as e:
+            print(f"Error analyzing workout with OpenAI: {e}")
+            ERRORS.inc(stage="llm")
+            return FALLBACK_MESSAGE
+
+    async def stream_analysis(self, workout_data, prompt=None):
+        """Yields the analysis as it is generated, without blocking the event loop.
+
+        The rule-based estimate is yielded first, immediately. A cached
+        narrative is yielded in one piece. Callers asking about the same
+        workout while a completion is streaming share that stream rather than
+        starting another one. On failure the fallback message is yielded if
+        nothing was produced yet. `prompt` is as in `prepare`.
+        """
+        produced = False
+        try:
+            estimate, narrative, messages = self._plan(workout_data, prompt)
+            if estimate:
+                yield estimate + "\n\n"
+            if messages is None:
+                yield narrative
+                return
+            key = self.cache_key(messages)
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+
+            shared = self._streams.get(key)
+            if shared is None:
+                shared = _SharedStream()
+                self._streams[key] = shared
+                asyncio.ensure_future(self._produce_stream(key, messages, shared))
+            else:
+                self.cache.coalesced += 1
+
+            async for chunk in shared:
+                produced = True
+                yield chunk
+
+        except Exception as e:
+            print(f"Error streaming workout analysis from OpenAI: {e}")
+            ERRORS.inc(stage="llm")
+            if not produced:
+                yield FALLBACK_MESSAGE
+
+    def needs_llm(self, workout_data, prompt=None):
+        """True if analyzing `workout_data` now would start a new completion.
+
+        False when rules cover it, the narrative is cached or the same
+        completion is already streaming. Nothing is counted in `stats()`.
+        """
+        messages = self.prepare(workout_data, prompt)[3]
+        if messages is None:
+            return False
+        key = self.cache_key(messages)
+        return key not in self._streams and self.cache.peek(key) is None
+
+    async def _produce_stream(self, key, messages, shared):
+        start = time.perf_counter()
+        try:
+            response = await openai.ChatCompletion.acreate(
+                model=self.model,
+                messages=messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                stream=True
+            )
+            async for part in response:
+                delta = part.choices[0].delta.get("content")
+                if delta:
+                    if not shared.chunks:
+                        LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start)
+                    shared.push(delta)
+            LLM_SECONDS.observe(time.perf_counter() - start, mode="stream")
+            self.cache.set(key, "".join(shared.chunks))
+            shared.finish()
+        except Exception as e:
+            shared.finish(e)
+        finally:
+            self._streams.pop(key, None)
+
+    def _build_messages(self, workout_data):
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": self._format_workout_prompt(workout_data)}
+        ]
+
+    def prepare(self, workout_data, prompt=None):
+        """Parses the workouts and decides whether the LLM is needed, without recording stats.
+
+        Also used by `BatchAnalyzer`, so batched narratives land under the on-demand cache key.
+
+        Args:
+            workout_data (list): SugarWOD-shaped workouts.
+            prompt (str, optional): System prompt replacing NARRATIVE_PROMPT, e.g. UPLOAD_PROMPT. The
+                template pacing only suits the day's programming, so such a narrative always comes from the LLM.
+
+        Returns:
+            tuple: (parsed workouts, rule-based estimate text, template narrative, LLM messages or None)
+        """
+        parsed = [self._parse(workout) for workout in workout_data]
+        estimate = format_estimate(parsed)
+        needs_llm = (prompt is not None or self.llm_mode == "always" or not parsed
+                     or not all(p.complete for p in parsed))
+        messages = None
+        if needs_llm:
+            messages = [
+                {"role": "system", "content": prompt or NARRATIVE_PROMPT},
+                {"role": "user", "content": self._format_structured_prompt(parsed)}
+            ]
+        return parsed, estimate, format_pacing(parsed), messages
+
+    def _plan(self, workout_data, prompt=None):
+        """`prepare` for an analysis a user asked for; counts it in `stats()`.
+
+        Returns:
+            tuple: (rule-based estimate text, template narrative, LLM messages or None)
+        """
+        parsed, estimate, narrative, messages = self.prepare(workout_data, prompt)
+        needs_llm = messages is not None
+
+        self.analyses += 1
+        raw_tokens = estimate_tokens(self._build_messages(workout_data))
+        sent_tokens = estimate_tokens(messages) if messages else 0
+        self.raw_prompt_tokens += raw_tokens
+        self.prompt_tokens += sent_tokens
+        PROMPT_TOKENS.inc(raw_tokens, kind="raw")
+        PROMPT_TOKENS.inc(sent_tokens, kind="sent")
+        if messages is None:
+            self.rule_based += 1
+        ANALYSES.inc(path="llm" if needs_llm else "rule_based")
+        return estimate, narrative, messages
+
+    @staticmethod
+    def _parse(workout):
+        attributes = workout.get("attributes", {})
+        return parse_workout(_normalize_text(attributes.get("title", "N/A")),
+                             _normalize_text(attributes.get("description", "N/A")))
+
+    @staticmethod
+    def _join(estimate, narrative):
+        return "\n\n".join(part for part in (estimate, narrative) if part)
+
+    def stats(self):
+        """Share of analyses answered without the LLM and the estimated prompt-token saving."""
+        return {
+            "analyses": self.analyses,
+            "rule_based": self.rule_based,
+            "rule_based_pct": round(100 * self.rule_based / self.analyses, 1) if self.analyses else 0.0,
+            "raw_prompt_tokens": self.raw_prompt_tokens,
+            "prompt_tokens": self.prompt_tokens,
+            "prompt_token_reduction_pct": round(100 * (1 - self.prompt_tokens / self.raw_prompt_tokens), 1)
+            if self.raw_prompt_tokens else 0.0,
+        }
+
+    def cache_key(self, messages):
+        """The `AnalysisCache` key of the completion for `messages` with this handler's model settings."""
+        return analysis_key(model=self.model, temperature=self.temperature, max_tokens=self.max_tokens, messages=messages)
+
+    def _complete(self, messages):
+        # Call OpenAI API
+        with LLM_SECONDS.time(mode="sync"):
+            response = openai.ChatCompletion.create(
+                model=self.model,
+                messages=messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens
+            )
+        return response.choices[0].message.content
+
+    async def _acomplete(self, messages):
+        with LLM_SECONDS.time(mode="async"):
+            response = await openai.ChatCompletion.acreate(
+                model=self.model,
+                messages=messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens
+            )
+        return response.choices[0].message.content
+
+    @staticmethod
+    def _format_structured_prompt(parsed_workouts):
+        """The compact prompt: parsed structure plus any lines the parser couldn't place."""
+        summaries = "\n\n".join(p.summary() for p in parsed_workouts)
+        ask = "Give short strategy and pacing advice."
+        missing = [p.title for p in parsed_workouts if not p.complete]
+        if missing:
+            # No rule-based time was shown for these, so the narrative has to give it
+            ask = (f"Estimate the time for a beginner, intermediate and advanced athlete for: {', '.join(missing)}. "
+                   f"Then {ask[0].lower()}{ask[1:]}")
+        return f"Workout(s):\n{summaries}\n\n{ask}"
+
     def _format_workout_prompt(self, workout_data):
-        """Formats workout data into a prompt for OpenAI."""
+        """Formats workout data into the full raw-description prompt (the baseline for prompt size)."""
         prompt = "Please analyze the following CrossFit workout(s):\n\n"
-        
+
         for workout in workout_data:
-            title = workout.get("attributes", {}).get("title", "N/A")
-            description = workout.get("attributes", {}).get("description", "N/A")
+            title = _normalize_text(workout.get("attributes", {}).get("title", "N/A"))
+            description = _normalize_text(workout.get("attributes", {}).get("description", "N/A"))
             prompt += f"Title: {title}\n"
             prompt += f"Description: {description}\n"
             prompt += "---\n"
-            
+
         prompt += "\nPlease provide a short and short concise analysis of the workout:\n"
         prompt += "1. Estimated time to complete the workout for a beginner, intermediate and advanced\n"
         prompt += "2. Recomended strategies and pacing for the workout\n"
         prompt += "3. Scaling options for different fitness levels\n"
 
-        
+
         return prompt
 
 # Example usage
 if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from WorkoutAPI_Handler import WorkoutAPI_Handler
+
+    load_dotenv()
     handler = OpenAIHandler()
     test_workout = [{
         "attributes": {
@@ -65,10 +352,8 @@ if __name__ == "__main__":
     
     # analysis = handler.analyze_workout(test_workout)
 
-    load_dotenv()
-
     SUGARWOD_API_KEY = os.environ['SUGARWOD_API_KEY']
-    SUGARWOD_API_URL = "https://api.sugarwod.com/v2"
+    SUGARWOD_API_URL = os.getenv("SUGARWOD_API_URL", "https://api.sugarwod.com/v2")
     today_str = datetime.now(ZoneInfo("Asia/Jerusalem")).strftime("%Y-%m-%d")
 
     wod_handler = WorkoutAPI_Handler(SUGARWOD_API_URL, SUGARWOD_API_KEY)
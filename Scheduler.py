@@ -0,0 +1,82 @@
+import asyncio
+from datetime import datetime, time
+from WorkoutAPI_Handler import DEFAULT_BATCH_DAYS
+
+DEFAULT_REFRESH_INTERVAL = 30 * 60  # seconds; shorter than WorkoutCache's TTL so it never goes cold
+
+
+def parse_delivery_times(value, tz=None):
+    """Parses "07:00,14:00" into `time` objects, naive (each box's local time) unless `tz` is given."""
+    times = []
+    for part in (value or "").split(","):
+        part = part.strip()
+        if part:
+            hour, minute = part.split(":")
+            times.append(time(int(hour), int(minute), tzinfo=tz))
+    return times
+
+
+class DailyScheduler:
+    """Keeps the day's WOD warm inside the bot process.
+
+    Registered on the Application's job queue, it periodically re-fetches
+    the week's workouts of every box, pre-renders the message, rebuilds the
+    inline answers and pre-computes today's analysis (the whole week's, in
+    packed requests, when a `batch_analyzer` is given), so /get_wod and
+    /analyze_workout are served from cache. Delivering is `BucketScheduler`'s
+    job, which calls `prefetch_box` shortly before each of its buckets.
+
+    Args:
+        box_registry (BoxRegistry): Boxes to prefetch for.
+        telegram_handler (TelegramHandler): Renders the messages.
+        openai_handler (OpenAIHandler): Pre-computes the analysis.
+        refresh_interval (int, optional): Seconds between prefetches of every box.
+        batch_analyzer (BatchAnalyzer, optional): Pre-computes `batch_days` days of analyses per box at once.
+        batch_days (int, optional): Days ahead analyzed by `batch_analyzer`.
+        inline_results (InlineResultCache, optional): Rebuilt from each prefetch's fresh workouts.
+    """
+
+    def __init__(self, box_registry, telegram_handler, openai_handler, refresh_interval=DEFAULT_REFRESH_INTERVAL,
+                 batch_analyzer=None, batch_days=DEFAULT_BATCH_DAYS, inline_results=None):
+        self.box_registry = box_registry
+        self.telegram_handler = telegram_handler
+        self.openai_handler = openai_handler
+        self.batch_analyzer = batch_analyzer
+        self.batch_days = batch_days
+        self.refresh_interval = refresh_interval
+        self.inline_results = inline_results
+
+    def register(self, job_queue):
+        """Schedules the periodic prefetch on `job_queue`."""
+        job_queue.run_repeating(self._prefetch_job, interval=self.refresh_interval, first=1, name="prefetch")
+
+    async def prefetch(self):
+        """Refreshes every box's workouts for the week, its rendered message and the analyses."""
+        await asyncio.gather(*(self.prefetch_box(box) for box in self.box_registry))
+
+    async def prefetch_box(self, box):
+        """Refreshes one box's workouts for the week, its rendered message, inline answers and analyses."""
+        # The box's own "today", so the message and inline answers match what its members see
+        today = datetime.now(box.timezone).date()
+        date_str = today.strftime("%Y-%m-%d")
+        # One batched request covers the whole week; today and tomorrow are returned
+        workouts = await box.workout_api_handler.refresh(date_str)
+        self.telegram_handler.render_workout_message(workouts, include_tomorrow_check=True, box_name=box.name,
+                                                     today=today)
+        if self.inline_results is not None:
+            await self.inline_results.refresh_box(box, workouts, today=today)
+        if self.batch_analyzer is not None:
+            # Days already analyzed are skipped, so re-running every refresh only costs new or edited days
+            await self.batch_analyzer.analyze_range(box.workout_api_handler, date_str, days=self.batch_days)
+        else:
+            # Same call bot.analyze_workout makes, so the analysis lands under the same cache key
+            today_workouts = await box.workout_api_handler.get_workouts_for_date(date_str, include_tomorrow=False)
+            if today_workouts:
+                await self.openai_handler.analyze_workout_async(today_workouts)
+        print(f"Prefetched {len(workouts)} workouts for today and tomorrow at {box.name}")
+
+    async def _prefetch_job(self, context):
+        try:
+            await self.prefetch()
+        except Exception as e:
+            print(f"Error prefetching workouts: {e}")
@@ -0,0 +1,225 @@
+import sqlite3
+import threading
+import time
+
+DEFAULT_COMPACT_EVERY = 1000  # writes between WAL checkpoints
+
+
+class SubscriberStore:
+    """Interface for where the bot keeps its subscribed chats.
+
+    Chat IDs are strings, as the bot has always stored them. Implementations
+    must make subscribe/unsubscribe atomic and keep membership checks O(1).
+    """
+
+    def subscribe(self, chat_id):
+        """Adds `chat_id`; returns False if it was already subscribed."""
+        raise NotImplementedError
+
+    def unsubscribe(self, chat_id):
+        """Removes `chat_id`; returns False if it wasn't subscribed."""
+        raise NotImplementedError
+
+    def is_subscribed(self, chat_id):
+        raise NotImplementedError
+
+    def all(self):
+        """Returns every subscribed chat ID."""
+        raise NotImplementedError
+
+    def get(self, chat_id):
+        """Returns the chat's metadata dict, or None if it isn't subscribed."""
+        raise NotImplementedError
+
+    def mark_delivered(self, chat_ids, when=None):
+        """Records a successful delivery to each of `chat_ids`."""
+        raise NotImplementedError
+
+    def set_preferences(self, chat_id, timezone=None, delivery_time=None):
+        """Sets the chat's own timezone (IANA name) and delivery time ("HH:MM"); None means the box's default.
+
+        Returns False if the chat isn't subscribed.
+        """
+        raise NotImplementedError
+
+    def get_preferences(self, chat_id):
+        """Returns the chat's (timezone, delivery_time), each None if it uses the default."""
+        return self.preferences().get(str(chat_id), (None, None))
+
+    def preferences(self):
+        """Returns {chat_id: (timezone, delivery_time)} for every chat with a preference of its own."""
+        return {}
+
+    def compact(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __len__(self):
+        return len(self.all())
+
+    def __contains__(self, chat_id):
+        return self.is_subscribed(str(chat_id))
+
+
+class SQLiteSubscriberStore(SubscriberStore):
+    """Subscriber store backed by SQLite in WAL mode, with an in-memory set in front.
+
+    Membership checks and `all()` never touch the disk. Each write is a single
+    committed statement, so concurrent /start commands can't lose each other
+    and a crash never leaves a half-written file. Every `compact_every`
+    writes the WAL is checkpointed back into the main database file.
+
+    Args:
+        path (str): SQLite database file.
+        migrate_from (str, optional): Legacy subscribers.txt to import the first time the database is created.
+        compact_every (int, optional): Writes between automatic compactions.
+    """
+
+    def __init__(self, path, migrate_from=None, compact_every=DEFAULT_COMPACT_EVERY):
+        self.path = path
+        self.compact_every = compact_every
+        self._writes_since_compact = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS subscribers ("
+            " chat_id TEXT PRIMARY KEY,"
+            " subscribed_at REAL NOT NULL,"
+            " last_delivery REAL)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(subscribers)")}
+        for column in ("timezone", "delivery_time"):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE subscribers ADD COLUMN {column} TEXT")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._chat_ids = {row[0] for row in self._conn.execute("SELECT chat_id FROM subscribers")}
+        # Only chats with a preference of their own, so the scheduler never reads the disk
+        self._preferences = {
+            row[0]: (row[1], row[2]) for row in self._conn.execute(
+                "SELECT chat_id, timezone, delivery_time FROM subscribers"
+                " WHERE timezone IS NOT NULL OR delivery_time IS NOT NULL")
+        }
+        if migrate_from:
+            self._migrate_text_file(migrate_from)
+
+    def _migrate_text_file(self, text_path):
+        """Imports a legacy whitespace-separated subscribers.txt once."""
+        if self._conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_from'").fetchone():
+            return
+        try:
+            with open(text_path) as f:
+                chat_ids = set(f.read().split())
+        except FileNotFoundError:
+            chat_ids = set()
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO subscribers (chat_id, subscribed_at) VALUES (?, ?)",
+                [(chat_id, now) for chat_id in chat_ids],
+            )
+            self._conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_from', ?)", (text_path,))
+            self._conn.execute("COMMIT")
+            self._chat_ids |= chat_ids
+        if chat_ids:
+            print(f"Migrated {len(chat_ids)} subscribers from {text_path}")
+
+    def _count_write(self):
+        # Called with the lock held; returns True when a compaction is due
+        self._writes_since_compact += 1
+        return self._writes_since_compact >= self.compact_every
+
+    def subscribe(self, chat_id):
+        chat_id = str(chat_id)
+        with self._lock:
+            if chat_id in self._chat_ids:
+                return False
+            self._conn.execute(
+                "INSERT OR IGNORE INTO subscribers (chat_id, subscribed_at) VALUES (?, ?)", (chat_id, time.time())
+            )
+            self._chat_ids.add(chat_id)
+            due = self._count_write()
+        if due:
+            self.compact()
+        return True
+
+    def unsubscribe(self, chat_id):
+        chat_id = str(chat_id)
+        with self._lock:
+            if chat_id not in self._chat_ids:
+                return False
+            self._conn.execute("DELETE FROM subscribers WHERE chat_id = ?", (chat_id,))
+            self._chat_ids.discard(chat_id)
+            self._preferences.pop(chat_id, None)
+            due = self._count_write()
+        if due:
+            self.compact()
+        return True
+
+    def is_subscribed(self, chat_id):
+        return str(chat_id) in self._chat_ids
+
+    def all(self):
+        return list(self._chat_ids)
+
+    def get(self, chat_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT chat_id, subscribed_at, last_delivery, timezone, delivery_time FROM subscribers"
+                " WHERE chat_id = ?", (str(chat_id),)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"chat_id": row[0], "subscribed_at": row[1], "last_delivery": row[2], "timezone": row[3],
+                "delivery_time": row[4]}
+
+    def set_preferences(self, chat_id, timezone=None, delivery_time=None):
+        chat_id = str(chat_id)
+        with self._lock:
+            if chat_id not in self._chat_ids:
+                return False
+            self._conn.execute(
+                "UPDATE subscribers SET timezone = ?, delivery_time = ? WHERE chat_id = ?",
+                (timezone, delivery_time, chat_id),
+            )
+            if timezone is None and delivery_time is None:
+                self._preferences.pop(chat_id, None)
+            else:
+                self._preferences[chat_id] = (timezone, delivery_time)
+            due = self._count_write()
+        if due:
+            self.compact()
+        return True
+
+    def get_preferences(self, chat_id):
+        return self._preferences.get(str(chat_id), (None, None))
+
+    def preferences(self):
+        return dict(self._preferences)
+
+    def mark_delivered(self, chat_ids, when=None):
+        when = when or time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "UPDATE subscribers SET last_delivery = ? WHERE chat_id = ?",
+                [(when, str(chat_id)) for chat_id in chat_ids],
+            )
+            self._conn.execute("COMMIT")
+
+    def compact(self):
+        """Checkpoints the WAL into the database file and truncates it."""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._writes_since_compact = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self):
+        return len(self._chat_ids)
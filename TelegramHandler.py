@@ -1,65 +1,343 @@
 from telegram import Bot
+from telegram.request import HTTPXRequest
+from telegram.error import BadRequest, RetryAfter
+import asyncio
 import os
+import time
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
+from collections import OrderedDict, deque
+from Metrics import CACHE_REQUESTS, ERRORS, MESSAGES_DELIVERED, RENDER_SECONDS, TELEGRAM_SEND_SECONDS
 
-class TelegramHandler:
-    def __init__(self, bot_token):
-        self.bot = Bot(token=bot_token)
+# Bot's default request object has a single pooled connection, which
+# serializes every concurrent send; broadcasts need more than that.
+DEFAULT_CONNECTION_POOL_SIZE = 32
+TELEGRAM_API_BASE_URL = "https://api.telegram.org/bot"
+# Telegram rejects messages longer than this (counted in UTF-16 code units)
+MAX_MESSAGE_LENGTH = 4096
+DEFAULT_BOX_NAME = "CrossFit Hatira"
+# Seconds between progressive edits of one message while streaming
+DEFAULT_MIN_EDIT_INTERVAL = 1.0
+SEPARATOR = "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+# BadRequest text for Markdown Telegram can't parse, e.g. an entity left open
+ENTITY_PARSE_ERROR = "can't parse entities"
+
+
+def _utf16_len(text):
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _truncate_utf16(text, limit=MAX_MESSAGE_LENGTH):
+    """The longest prefix of `text` within `limit` UTF-16 units, never splitting a surrogate pair."""
+    encoded = text.encode("utf-16-le")
+    if len(encoded) <= limit * 2:
+        return text
+    return encoded[:limit * 2].decode("utf-16-le", errors="ignore")
+
+
+def _safe_cut(text, limit):
+    """Index to cut an overlong `text` at: within `limit` UTF-16 units, outside Markdown entities if possible.
+
+    Prefers the last whitespace with no `*bold*`, `_italic_`, `code` or
+    [link](url) open, then any point with none open, then the hard limit.
+    """
+    closers = {"*": "*", "_": "_", "`": "`", "[": "]", "(": ")"}
+    open_marker = None
+    length = 0
+    balanced = space = None
+    i = 0
+    while i < len(text):
+        # A backslash and the character it escapes are kept together
+        step = 2 if text[i] == "\\" and open_marker != "`" else 1
+        length += _utf16_len(text[i:i + step])
+        if length > limit:
+            break
+        char = text[i]
+        if step == 1:
+            if open_marker is None and char in "*_`[":
+                open_marker = char
+            elif open_marker is not None and char == closers[open_marker]:
+                # "[text]" goes on to "(url)" when one follows
+                open_marker = "(" if char == "]" and text[i + 1:i + 2] == "(" else None
+        i += step
+        if open_marker is None:
+            balanced = i
+            if char.isspace():
+                space = i
+    return space or balanced or max(i, 1)
+
+
+def split_message(text, limit=MAX_MESSAGE_LENGTH):
+    """Splits `text` into chunks Telegram accepts, breaking between lines where possible.
+
+    A line too long for one chunk is cut outside Markdown entities where it
+    can be (see `_safe_cut`), so each piece still parses.
+    """
+    if _utf16_len(text) <= limit:
+        return [text]
+
+    chunks = []
+    current = []
+    current_len = 0
+    for line in text.splitlines(keepends=True):
+        line_len = _utf16_len(line)
+        if current and current_len + line_len > limit:
+            chunks.append("".join(current))
+            current, current_len = [], 0
+        while line_len > limit:
+            cut = _safe_cut(line, limit)
+            chunks.append(line[:cut])
+            line = line[cut:]
+            line_len = _utf16_len(line)
+        current.append(line)
+        current_len += line_len
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+async def send_message(bot, chat_id, text, parse_mode='Markdown'):
+    """`bot.send_message`, resent as plain text if Telegram can't parse the Markdown, so the text isn't lost."""
+    try:
+        return await bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+    except BadRequest as e:
+        if parse_mode is None or ENTITY_PARSE_ERROR not in str(e).lower():
+            raise
+        print(f"Sending as plain text to chat_id {chat_id}: {e}")
+        return await bot.send_message(chat_id=chat_id, text=text)
+
+
+def _content_key(workouts):
+    """Identifies the workouts' visible content; changes whenever a title or description does."""
+    return tuple(
+        (attr.get("scheduled_date", ""), attr.get("title", "N/A"), attr.get("description", "N/A"))
+        for attr in (w.get("attributes", {}) for w in workouts)
+    )
+
+
+class MessageRenderer:
+    """Builds workout messages once and reuses them for every recipient.
+
+    Rendered messages are cached per (date, include_tomorrow, content), so a
+    broadcast to N chats formats the message once. Each entry is already
+    split into chunks that fit Telegram's message length limit.
+    """
+
+    def __init__(self, box_name=DEFAULT_BOX_NAME, max_entries=32):
+        self.box_name = box_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def render(self, workouts, include_tomorrow_check=False, today=None):
+        """Returns the message for `workouts` as a tuple of chunks.
+
+        Args:
+            workouts (list): Workouts as returned by WorkoutAPI_Handler.
+            include_tomorrow_check (bool, optional): Add the tomorrow section. Defaults to False.
+            today (date, optional): Day treated as today. Defaults to today in Israel time.
+        """
+        today = today or datetime.now(ZoneInfo("Asia/Jerusalem")).date()
+        key = (today, include_tomorrow_check, _content_key(workouts))
+        chunks = self._cache.get(key)
+        if chunks is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            CACHE_REQUESTS.inc(cache="render", result="hit")
+            return chunks
 
-    async def send_workout_message(self, chat_id, workouts, include_tomorrow_check=False):
-        """Sends formatted workout message to the specified chat ID."""
-        today_date_str_compare = datetime.now(ZoneInfo("Asia/Jerusalem")).strftime("%Y-%m-%d")
-        tomorrow_date_str_compare = (datetime.now(ZoneInfo("Asia/Jerusalem")) + timedelta(days=1)).strftime("%Y-%m-%d")
+        self.misses += 1
+        CACHE_REQUESTS.inc(cache="render", result="miss")
+        with RENDER_SECONDS.time():
+            chunks = tuple(split_message(self._build(key[2], today, include_tomorrow_check)))
+        self._cache[key] = chunks
+        if len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return chunks
 
-        today_workouts = [w for w in workouts if w.get("attributes", {}).get("scheduled_date", "").startswith(today_date_str_compare)]
-        tomorrow_workouts = [w for w in workouts if w.get("attributes", {}).get("scheduled_date", "").startswith(tomorrow_date_str_compare)]
+    def _build(self, content, today, include_tomorrow_check):
+        today_str = today.strftime("%Y-%m-%d")
+        tomorrow_str = (today + timedelta(days=1)).strftime("%Y-%m-%d")
 
-        message = "🏋️‍♂️ *CrossFit Hatira WODs* 🏋️‍♀️\n\n"
+        parts = [f"🏋️‍♂️ *{self.box_name} WODs* 🏋️‍♀️\n\n"]
 
         # Add Today's Workouts
-        message += "📅 *Today's Workouts: ({})*\n\n".format(today_date_str_compare)
+        parts.append(f"📅 *Today's Workouts: ({today_str})*\n\n")
+        today_workouts = [(title, description) for date, title, description in content if date.startswith(today_str)]
         if not today_workouts:
-            message += "_No workouts found for today._\n"
-        else:
-            for w in today_workouts:
-                attr = w.get("attributes", {})
-                title = attr.get("title", "N/A")
-                description = attr.get("description", "N/A")
-
-                message += (
-                    "🔹 *Title*: " + title + "\n" +
-                    "📝 *Description*: " + description + "\n" +
-                    "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-                )
+            parts.append("_No workouts found for today._\n")
+        parts.extend(self._workout_block(title, description) for title, description in today_workouts)
 
         # Only add Tomorrow's Workouts section if include_tomorrow_check is True
         if include_tomorrow_check:
-            message += "\n📅 *Tomorrow's Workouts: ({})*\n\n".format(tomorrow_date_str_compare)
+            parts.append(f"\n📅 *Tomorrow's Workouts: ({tomorrow_str})*\n\n")
+            tomorrow_workouts = [(title, description) for date, title, description in content if date.startswith(tomorrow_str)]
             if not tomorrow_workouts:
-                message += "⚠️ _Sorry… Tomorrow's WOD hasn't been published yet._\n"
-            else:
-                for w in tomorrow_workouts:
-                    attr = w.get("attributes", {})
-                    title = attr.get("title", "N/A")
-                    description = attr.get("description", "N/A")
-
-                    message += (
-                        "🔹 *Title*: " + title + "\n" +
-                        "📝 *Description*: " + description + "\n" +
-                        "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-                    )
+                parts.append("⚠️ _Sorry… Tomorrow's WOD hasn't been published yet._\n")
+            parts.extend(self._workout_block(title, description) for title, description in tomorrow_workouts)
 
+        return "".join(parts)
+
+    def render_day(self, workouts, date_str, label):
+        """One day's workouts as a single message, e.g. for an inline answer; cut to the length limit.
+
+        Args:
+            workouts (list): Workouts as returned by WorkoutAPI_Handler; other days are ignored.
+            date_str (str): The day (YYYY-MM-DD).
+            label (str): How the day is named in the heading, e.g. "Today".
+        """
+        day = [(title, description) for date, title, description in _content_key(workouts) if date.startswith(date_str)]
+        parts = [f"🏋️‍♂️ *{self.box_name} WODs* 🏋️‍♀️\n\n", f"📅 *{label}'s Workouts: ({date_str})*\n\n"]
+        if not day:
+            parts.append(f"_No workouts found for {label.lower()}._\n")
+        parts.extend(self._workout_block(title, description) for title, description in day)
+        return split_message("".join(parts))[0]
+
+    @staticmethod
+    def _workout_block(title, description):
+        return f"🔹 *Title*: {title}\n📝 *Description*: {description}\n{SEPARATOR}"
+
+
+class TelegramHandler:
+    def __init__(self, bot_token, base_url=None, connection_pool_size=DEFAULT_CONNECTION_POOL_SIZE,
+                 box_name=DEFAULT_BOX_NAME):
+        self.bot = Bot(
+            token=bot_token,
+            base_url=base_url or TELEGRAM_API_BASE_URL,
+            request=HTTPXRequest(connection_pool_size=connection_pool_size),
+        )
+        self.renderer = MessageRenderer(box_name)
+        self._renderers = {box_name: self.renderer}  # one per box, so each keeps its own header
+        # Recent seconds from request to first visible streamed text (see stream_edit)
+        self.time_to_first_text = deque(maxlen=1000)
+
+    async def send_workout_message(self, chat_id, workouts, include_tomorrow_check=False, box_name=None, today=None):
+        """Sends formatted workout message to the specified chat ID.
+
+        Returns:
+            bool: True if every chunk of the message was sent
+        """
+        chunks = self.render_workout_message(workouts, include_tomorrow_check, box_name, today=today)
+        return await self.send_chunks(chat_id, chunks)
+
+    def render_workout_message(self, workouts, include_tomorrow_check=False, box_name=None, today=None):
+        """Returns the workout message as chunks ready to send (rendered once, then cached).
+
+        `box_name` picks the header; the handler's own box is used if None.
+        `today` is the day the message calls today (today in Israel time if None).
+        """
+        return self.renderer_for(box_name).render(workouts, include_tomorrow_check, today=today)
+
+    def renderer_for(self, box_name=None):
+        if box_name is None:
+            return self.renderer
+        renderer = self._renderers.get(box_name)
+        if renderer is None:
+            renderer = self._renderers[box_name] = MessageRenderer(box_name)
+        return renderer
+
+    async def send_chunks(self, chat_id, chunks, parse_mode='Markdown', sent_messages=None):
+        """Sends pre-rendered message chunks in order; returns True if all were sent.
+
+        If `sent_messages` is a dict, the chat's message IDs are stored in it once every chunk is sent.
+        """
         try:
-            await self.bot.send_message(chat_id=chat_id, text=message, parse_mode='Markdown')
+            message_ids = []
+            for chunk in chunks:
+                with TELEGRAM_SEND_SECONDS.time(method="sendMessage"):
+                    message = await send_message(self.bot, chat_id, chunk, parse_mode)
+                message_ids.append(message.message_id)
+                MESSAGES_DELIVERED.inc(kind="direct")
+            if sent_messages is not None:
+                sent_messages[str(chat_id)] = message_ids
             print(f"Workout message sent successfully to chat_id: {chat_id}")
+            return True
         except Exception as e:
             print(f"Error sending message to chat_id {chat_id}: {e}")
+            ERRORS.inc(stage="telegram_send")
+            return False
+
+    async def stream_edit(self, chat_id, message_id, text_stream, header="", started_at=None,
+                          min_edit_interval=DEFAULT_MIN_EDIT_INTERVAL):
+        """Progressively edits a placeholder message as `text_stream` yields text.
+
+        The first text is shown as soon as it arrives; later edits are
+        throttled to one per `min_edit_interval` seconds to stay inside
+        Telegram's edit limits. Intermediate edits are plain text (partial
+        Markdown may not parse); the final edit uses Markdown and falls back
+        to plain text. Anything beyond the length limit is sent as follow-up
+        messages once the stream ends.
+
+        Args:
+            chat_id: Chat of the placeholder message.
+            message_id: Placeholder message to edit.
+            text_stream: Async iterable of text pieces.
+            header (str, optional): Prefix shown above the streamed text.
+            started_at (float, optional): time.monotonic() the user asked; defaults to now.
+
+        Returns:
+            dict: Final text, seconds until the first text was visible, and the number of edits
+        """
+        started_at = started_at if started_at is not None else time.monotonic()
+        parts = []
+        first_visible = None
+        last_edit = 0.0
+        edits = 0
+
+        async for piece in text_stream:
+            parts.append(piece)
+            now = time.monotonic()
+            if first_visible is not None and now - last_edit < min_edit_interval:
+                continue
+            text = _truncate_utf16(header + "".join(parts))
+            if await self._edit(chat_id, message_id, text, None):
+                last_edit, edits = time.monotonic(), edits + 1
+                if first_visible is None:
+                    first_visible = last_edit - started_at
+                    self.time_to_first_text.append(first_visible)
+
+        # Final edit with formatting, then any overflow as new messages
+        chunks = split_message(header + "".join(parts))
+        if not await self._edit(chat_id, message_id, chunks[0], 'Markdown', wait_on_flood=True):
+            await self._edit(chat_id, message_id, chunks[0], None, wait_on_flood=True)
+        edits += 1
+        for chunk in chunks[1:]:
+            await self.bot.send_message(chat_id=chat_id, text=chunk)
+        if first_visible is None:
+            first_visible = time.monotonic() - started_at
+            self.time_to_first_text.append(first_visible)
+        return {"text": "".join(parts), "time_to_first_text": first_visible, "edits": edits}
+
+    async def _edit(self, chat_id, message_id, text, parse_mode, wait_on_flood=False):
+        """Edits the message; returns False if it failed.
+
+        A flood wait skips an intermediate edit, since a later one follows;
+        with `wait_on_flood` (the final edit) it waits `retry_after` and tries once more.
+        """
+        try:
+            with TELEGRAM_SEND_SECONDS.time(method="editMessageText"):
+                await self.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text,
+                                                 parse_mode=parse_mode)
+            return True
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                return True
+            print(f"Error editing message {message_id} in chat_id {chat_id}: {e}")
+            ERRORS.inc(stage="telegram_edit")
+            return False
+        except RetryAfter as e:
+            print(f"Edit rate limited in chat_id {chat_id}, retry after {e.retry_after}s")
+            ERRORS.inc(stage="telegram_edit_rate_limited")
+            if not wait_on_flood:
+                return False
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+            await asyncio.sleep(retry_after)
+            return await self._edit(chat_id, message_id, text, parse_mode)
 
 # Example usage (for testing this file individually)
 if __name__ == '__main__':
     # This part would typically be in your main script
-    import asyncio
     from dotenv import load_dotenv
     load_dotenv()
     bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
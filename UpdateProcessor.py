@@ -0,0 +1,96 @@
+import asyncio
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from AdmissionControl import ADMITTED, COALESCED
+
+DEFAULT_MAX_CONCURRENT_UPDATES = 16
+DEFAULT_MAX_PENDING_UPDATES = 256  # updates accepted at once, running or waiting for their chat's turn
+DEFAULT_DRAIN_TIMEOUT = 30.0  # seconds to wait for in-flight updates on shutdown
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently while keeping each chat's updates in order.
+
+    Updates from different chats run in parallel, up to
+    `max_concurrent_updates`; updates from the same chat wait for the previous
+    one to finish. The per-chat lock is taken before a concurrency slot, so a
+    single chat flooding the bot queues behind itself instead of occupying
+    every slot. On shutdown, in-flight updates get `drain_timeout` seconds to
+    finish.
+
+    PTB's `process_update` holds its own semaphore around
+    `do_process_update`, so that limit is set to `max_pending_updates` and
+    only caps how many updates are accepted at once. The handler limit is a
+    semaphore of this class, taken inside `do_process_update` after the
+    chat's lock. `max_concurrent_updates` of 1 keeps PTB's sequential path.
+
+    With a `coalescer` (`AdmissionControl.CommandCoalescer`), a repeat of a
+    command that chat already has queued or running is answered or dropped
+    on arrival, instead of waiting for the chat's lock and running again.
+    """
+
+    def __init__(self, max_concurrent_updates=DEFAULT_MAX_CONCURRENT_UPDATES, drain_timeout=DEFAULT_DRAIN_TIMEOUT,
+                 coalescer=None, max_pending_updates=DEFAULT_MAX_PENDING_UPDATES):
+        super().__init__(1 if max_concurrent_updates == 1 else max(max_pending_updates, max_concurrent_updates))
+        self.drain_timeout = drain_timeout
+        self.coalescer = coalescer
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._chat_locks = {}  # chat_id -> [lock, number of updates using it]
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    async def do_process_update(self, update, coroutine):
+        chat_id = None
+        if isinstance(update, Update) and update.effective_chat is not None:
+            chat_id = update.effective_chat.id
+
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            if chat_id is None:
+                async with self._slots:
+                    await coroutine
+                return
+
+            key = self.coalescer.key(update) if self.coalescer is not None else None
+            if key is not None:
+                verdict = self.coalescer.enter(key)
+                if verdict != ADMITTED:
+                    # The handler never runs; close its coroutine so it isn't reported as never awaited
+                    coroutine.close()
+                    if verdict == COALESCED:
+                        await self.coalescer.notify(update, key)
+                    return
+
+            entry = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+            entry[1] += 1
+            try:
+                async with entry[0]:
+                    async with self._slots:
+                        await coroutine
+            finally:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._chat_locks[chat_id]
+                if key is not None:
+                    self.coalescer.leave(key)
+        finally:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._idle.set()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self._in_flight:
+            print(f"Draining {self._in_flight} in-flight updates...")
+            try:
+                await asyncio.wait_for(self._idle.wait(), self.drain_timeout)
+            except asyncio.TimeoutError:
+                print(f"Gave up on {self._in_flight} updates after {self.drain_timeout}s")
@@ -0,0 +1,327 @@
+import csv
+import os
+import struct
+from datetime import datetime
+
+# Runs inside the upload process pool: keep this module free of bot, network and asyncio imports.
+
+MAX_CSV_WORKOUTS = 5       # most recent logged workouts sent on for analysis
+CSV_SNIFF_BYTES = 4096     # bytes read to guess the CSV delimiter
+MAX_TEXT_CHARS = 4000      # characters of a text upload kept
+
+KIND_BY_EXTENSION = {".csv": "csv", ".fit": "fit", ".txt": "text", ".jpg": "photo", ".jpeg": "photo", ".png": "photo"}
+
+# Header names used by SugarWOD and common logbook exports
+CSV_TITLE_COLUMNS = ("title", "workout", "workout name", "name")
+CSV_DESCRIPTION_COLUMNS = ("description", "workout description", "details")
+CSV_DATE_COLUMNS = ("date", "scheduled_date", "workout date")
+CSV_RESULT_COLUMNS = ("best_result_display", "result", "score")
+CSV_SCALING_COLUMNS = ("rx_or_scaled", "scaling")
+CSV_DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%d/%m/%Y", "%Y%m%d", "%d.%m.%Y")
+
+# FIT global message numbers and the fields read from them (field number -> (name, scale))
+FIT_SESSION = 18
+FIT_LAP = 19
+FIT_RECORD = 20
+FIT_SESSION_FIELDS = {5: ("sport", 1), 7: ("elapsed_s", 1000), 8: ("timer_s", 1000), 9: ("distance_m", 100),
+                      11: ("calories", 1), 16: ("avg_hr", 1), 17: ("max_hr", 1), 22: ("ascent_m", 1)}
+FIT_RECORD_HEART_RATE = 3
+FIT_RECORD_DISTANCE = 5
+FIT_SPORTS = {0: "Workout", 1: "Run", 2: "Ride", 4: "Cardio machine", 5: "Swim", 10: "Training", 11: "Walk",
+              15: "Row", 17: "Hike"}
+# Base type number -> (struct format, invalid value); strings and byte arrays are skipped
+FIT_BASE_TYPES = {0: ("B", 0xFF), 1: ("b", 0x7F), 2: ("B", 0xFF), 3: ("h", 0x7FFF), 4: ("H", 0xFFFF),
+                  5: ("i", 0x7FFFFFFF), 6: ("I", 0xFFFFFFFF), 8: ("f", None), 9: ("d", None), 10: ("B", 0),
+                  11: ("H", 0), 12: ("I", 0), 14: ("q", 0x7FFFFFFFFFFFFFFF), 15: ("Q", 0xFFFFFFFFFFFFFFFF),
+                  16: ("Q", 0)}
+
+
+class UploadError(ValueError):
+    """An upload that can't be used; the message is shown to the athlete."""
+
+
+def detect_kind(file_name=None, mime_type=None):
+    """Returns "csv", "fit", "text" or "photo" for an uploaded document, or None if unsupported."""
+    extension = os.path.splitext(file_name or "")[1].lower()
+    if extension in KIND_BY_EXTENSION:
+        return KIND_BY_EXTENSION[extension]
+    mime_type = (mime_type or "").lower()
+    if mime_type.startswith("image/"):
+        return "photo"
+    if mime_type in ("text/csv", "application/csv"):
+        return "csv"
+    if mime_type == "text/plain":
+        return "text"
+    return None
+
+
+def parse_upload(path, kind):
+    """Turns an uploaded file into workouts for OpenAIHandler plus extracted features.
+
+    Args:
+        path (str): Downloaded file.
+        kind (str): One of the values returned by `detect_kind`.
+
+    Returns:
+        dict: "kind", "workouts" (SugarWOD-shaped dicts), "features" and a one-line "summary"
+    """
+    parsers = {"csv": _parse_csv, "fit": _parse_fit, "text": _parse_text, "photo": _parse_photo}
+    if kind not in parsers:
+        raise UploadError("Unsupported file type; send a photo, a CSV or FIT export, or a text file.")
+    result = parsers[kind](path)
+    result["kind"] = kind
+    return result
+
+
+def _workout(title, description):
+    return {"attributes": {"title": title, "description": description}}
+
+
+def _column(fieldnames, candidates):
+    by_lower = {name.strip().lower(): name for name in fieldnames or ()}
+    return next((by_lower[c] for c in candidates if c in by_lower), None)
+
+
+def _sort_date(value):
+    """ISO form of a date in a common export format, so rows sort by date; unknown formats sort as given."""
+    for fmt in CSV_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return value
+
+
+def _number(value):
+    try:
+        return float(str(value).replace(",", ""))
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_csv(path):
+    """Reads a workout log export row by row, keeping only the latest workouts and column statistics."""
+    with open(path, newline="", encoding="utf-8-sig", errors="replace") as f:
+        sample = f.read(CSV_SNIFF_BYTES)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.DictReader(f, dialect=dialect)
+        fieldnames = reader.fieldnames or []
+        title_col = _column(fieldnames, CSV_TITLE_COLUMNS)
+        description_col = _column(fieldnames, CSV_DESCRIPTION_COLUMNS)
+        date_col = _column(fieldnames, CSV_DATE_COLUMNS)
+        result_col = _column(fieldnames, CSV_RESULT_COLUMNS)
+        scaling_col = _column(fieldnames, CSV_SCALING_COLUMNS)
+        text_cols = {title_col, description_col, date_col, result_col, scaling_col}
+
+        rows = 0
+        latest = []  # (sortable date, row index, date, row) of the most recent logged workouts
+        numeric = {}  # column -> [count, total, min, max]
+        for row in reader:
+            rows += 1
+            if title_col or description_col:
+                date = (row.get(date_col) or "").strip() if date_col else ""
+                latest.append((_sort_date(date), rows, date, row))
+                if len(latest) > 4 * MAX_CSV_WORKOUTS:
+                    latest = sorted(latest, key=lambda item: item[:2])[-MAX_CSV_WORKOUTS:]
+            for column, value in row.items():
+                if column in text_cols or column is None:
+                    continue
+                number = _number(value)
+                if number is None:
+                    continue
+                stats = numeric.get(column)
+                if stats is None:
+                    numeric[column] = [1, number, number, number]
+                else:
+                    stats[0] += 1
+                    stats[1] += number
+                    stats[2] = min(stats[2], number)
+                    stats[3] = max(stats[3], number)
+
+    if not rows:
+        raise UploadError("The CSV file has no rows.")
+    features = {"rows": rows, "columns": {column: {"mean": round(total / count, 2), "min": low, "max": high}
+                                          for column, (count, total, low, high) in numeric.items()}}
+    workouts = []
+    for _, _, date, row in sorted(latest, key=lambda item: item[:2])[-MAX_CSV_WORKOUTS:]:
+        lines = [row.get(description_col) or ""] if description_col else []
+        if result_col and row.get(result_col):
+            scaling = f" ({row[scaling_col]})" if scaling_col and row.get(scaling_col) else ""
+            lines.append(f"Result: {row[result_col]}{scaling}")
+        title = (row.get(title_col) or "Logged workout") if title_col else "Logged workout"
+        workouts.append(_workout(f"{title} ({date})" if date else title, "\n".join(lines).strip() or "N/A"))
+
+    if workouts:
+        summary = f"{rows} logged workouts; analyzing the latest {len(workouts)}"
+    else:
+        # A metrics table (rower, bike, ...) rather than a workout log: describe its columns
+        lines = [f"{column}: avg {s['mean']}, min {s['min']}, max {s['max']}"
+                 for column, s in list(features["columns"].items())[:10]]
+        if not lines:
+            raise UploadError("Couldn't find workouts or numbers in the CSV file.")
+        workouts.append(_workout(f"Logged sessions ({rows} rows)", "\n".join(lines)))
+        summary = f"{rows} rows, {len(features['columns'])} numeric columns"
+    return {"workouts": workouts, "features": features, "summary": summary}
+
+
+def _parse_text(path):
+    with open(path, encoding="utf-8", errors="replace") as f:
+        text = f.read(MAX_TEXT_CHARS).strip()
+    if not text:
+        raise UploadError("The text file is empty.")
+    title, _, rest = text.partition("\n")
+    return {"workouts": [_workout(title.strip(), rest.strip() or title.strip())], "features": {"chars": len(text)},
+            "summary": f"Workout \"{title.strip()[:60]}\""}
+
+
+def _parse_photo(path):
+    # Optional dependencies, only needed when photo uploads are used
+    try:
+        import pytesseract
+        from PIL import Image
+    except ImportError:
+        raise UploadError("Reading photos isn't available on this server; send the workout as text, "
+                          "or a CSV or FIT export.")
+    with Image.open(path) as image:
+        image.thumbnail((2000, 2000))
+        text = pytesseract.image_to_string(image.convert("L")).strip()
+    if not text:
+        raise UploadError("Couldn't read any text in the photo; try a sharper picture of the whiteboard.")
+    return {"workouts": [_workout("Workout from photo", text)], "features": {"chars": len(text)},
+            "summary": "Workout read from the photo"}
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) < size:
+        raise UploadError("The FIT file is corrupt (it ends mid-record).")
+    return data
+
+
+def _read_fit_messages(path, wanted):
+    """Yields (global message number, {field number: value}) for the `wanted` messages of a FIT file.
+
+    A minimal decoder for the binary FIT format: definition messages (with
+    either byte order and developer fields), normal and compressed-timestamp
+    data headers, and scalar fields. Arrays yield their first element;
+    strings and invalid values are skipped. Records are read one at a time
+    from the file, and unwanted ones are skipped with a seek.
+    """
+    with open(path, "rb") as f:
+        try:
+            yield from _decode_fit(f, wanted)
+        except (struct.error, IndexError) as e:
+            raise UploadError("The FIT file is corrupt.") from e
+
+
+def _decode_fit(f, wanted):
+    header = f.read(12)
+    if len(header) < 12 or header[8:12] != b".FIT":
+        raise UploadError("That doesn't look like a FIT file.")
+    header_size = header[0]
+    if header_size < 12:
+        raise UploadError("The FIT file is corrupt (bad header).")
+    f.seek(header_size)
+    end = header_size + struct.unpack_from("<I", header, 4)[0]
+    definitions = {}  # local message type -> (global number, endian, [(field, size, base type)], developer bytes)
+    while f.tell() < end:
+        header = f.read(1)
+        if not header:
+            break
+        header = header[0]
+        if header & 0x80:
+            local = (header >> 5) & 0x03
+        elif header & 0x40:
+            local = header & 0x0F
+            fixed = _read_exact(f, 5)
+            endian = ">" if fixed[1] else "<"
+            number = struct.unpack_from(endian + "H", fixed, 2)[0]
+            raw = _read_exact(f, 3 * fixed[4])
+            fields = [tuple(raw[3 * i:3 * i + 3]) for i in range(fixed[4])]
+            developer_bytes = 0
+            if header & 0x20:
+                developer_count = _read_exact(f, 1)[0]
+                raw = _read_exact(f, 3 * developer_count)
+                developer_bytes = sum(raw[3 * i + 1] for i in range(developer_count))
+            definitions[local] = (number, endian, fields, developer_bytes)
+            continue
+        else:
+            local = header & 0x0F
+
+        definition = definitions.get(local)
+        if definition is None:
+            raise UploadError("The FIT file is corrupt (data before its definition).")
+        number, endian, fields, developer_bytes = definition
+        if number not in wanted:
+            f.seek(sum(size for _, size, _ in fields) + developer_bytes, os.SEEK_CUR)
+            continue
+        record = _read_exact(f, sum(size for _, size, _ in fields))
+        values = {}
+        pos = 0
+        for field, size, base_type in fields:
+            fmt, invalid = FIT_BASE_TYPES.get(base_type & 0x1F, (None, None))
+            if fmt is not None and size >= struct.calcsize(fmt):
+                value = struct.unpack_from(endian + fmt, record, pos)[0]
+                if value != invalid:
+                    values[field] = value
+            pos += size
+        f.seek(developer_bytes, os.SEEK_CUR)
+        yield number, values
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+def _parse_fit(path):
+    """Extracts session totals (or totals computed from the records) from a Garmin/Wahoo/Concept2 FIT export."""
+    session = {}
+    laps = records = 0
+    heart_rates = []
+    distance = None
+    for number, values in _read_fit_messages(path, {FIT_SESSION, FIT_LAP, FIT_RECORD}):
+        if number == FIT_SESSION and not session:
+            session = {name: values[field] / scale for field, (name, scale) in FIT_SESSION_FIELDS.items()
+                       if field in values}
+        elif number == FIT_LAP:
+            laps += 1
+        else:
+            records += 1
+            if FIT_RECORD_HEART_RATE in values:
+                heart_rates.append(values[FIT_RECORD_HEART_RATE])
+            if FIT_RECORD_DISTANCE in values:
+                distance = values[FIT_RECORD_DISTANCE] / 100
+
+    if heart_rates:
+        session.setdefault("avg_hr", sum(heart_rates) / len(heart_rates))
+        session.setdefault("max_hr", max(heart_rates))
+    if distance is not None:
+        session.setdefault("distance_m", distance)
+    if not session:
+        raise UploadError("Couldn't find a session in the FIT file.")
+    features = {**session, "laps": laps, "records": records}
+
+    sport = FIT_SPORTS.get(int(session.get("sport", 0)), "Workout")
+    lines = []
+    if "timer_s" in session or "elapsed_s" in session:
+        lines.append(f"Time: {_format_duration(session.get('timer_s') or session['elapsed_s'])}")
+    if session.get("distance_m"):
+        lines.append(f"Distance: {session['distance_m'] / 1000:.2f} km")
+    if laps > 1:
+        lines.append(f"Laps: {laps}")
+    if "avg_hr" in session:
+        lines.append(f"Avg HR: {session['avg_hr']:.0f} bpm")
+    if "max_hr" in session:
+        lines.append(f"Max HR: {session['max_hr']:.0f} bpm")
+    if session.get("calories"):
+        lines.append(f"Calories: {session['calories']:.0f}")
+    if session.get("ascent_m"):
+        lines.append(f"Ascent: {session['ascent_m']:.0f} m")
+    return {"workouts": [_workout(f"{sport} session (FIT)", "\n".join(lines))], "features": features,
+            "summary": (f"{sport}: " + ", ".join(lines[:2])) if lines else sport}
@@ -0,0 +1,217 @@
+import asyncio
+import multiprocessing
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import httpx
+from Metrics import ERRORS, UPLOAD_SECONDS, UPLOADS
+from UploadParser import UploadError, parse_upload
+
+DEFAULT_UPLOAD_DIR = "uploads"
+DEFAULT_MAX_WORKERS = 2           # parser processes
+DEFAULT_MAX_PER_USER = 3          # uploads a user may have queued or processing
+DEFAULT_MAX_PENDING = 20          # uploads queued or processing across all users
+DEFAULT_MAX_DOWNLOADS = 4         # concurrent downloads from Telegram
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024  # the Bot API's download limit
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = 60.0           # seconds between bytes of a download
+
+
+class UploadRejected(Exception):
+    """An upload turned away by backpressure; the message is shown to the athlete."""
+
+
+class UploadPipeline:
+    """Downloads uploaded workout files and parses them off the event loop.
+
+    An accepted upload is streamed from Telegram to `upload_dir` in
+    `DOWNLOAD_CHUNK_SIZE` pieces, so a large export is never held in
+    memory. It is then parsed by `UploadParser.parse_upload` in a pool of
+    `max_workers` processes, so OCR and FIT/CSV decoding never block the
+    bot's commands. The file is deleted once parsed.
+
+    Backpressure happens at admission. A user may have `max_per_user` uploads
+    queued or processing, handled one at a time in arrival order, so one
+    user can't occupy every worker. All users together may have
+    `max_pending`. Beyond either limit `admit()` raises `UploadRejected`
+    instead of queueing more work.
+
+    Args:
+        upload_dir (str, optional): Where downloads are kept while being parsed.
+        max_workers (int, optional): Parser processes.
+        max_per_user (int, optional): Uploads one user may have in progress.
+        max_pending (int, optional): Uploads in progress across all users.
+        max_downloads (int, optional): Concurrent downloads from Telegram.
+        max_bytes (int, optional): Largest file accepted.
+    """
+
+    def __init__(self, upload_dir=DEFAULT_UPLOAD_DIR, max_workers=DEFAULT_MAX_WORKERS, max_per_user=DEFAULT_MAX_PER_USER,
+                 max_pending=DEFAULT_MAX_PENDING, max_downloads=DEFAULT_MAX_DOWNLOADS, max_bytes=MAX_UPLOAD_BYTES):
+        self.upload_dir = upload_dir
+        self.max_workers = max_workers
+        self.max_per_user = max_per_user
+        self.max_pending = max_pending
+        self.max_bytes = max_bytes
+        self.accepted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.bytes_downloaded = 0
+        self._users = {}  # user_id -> [lock serializing the user's uploads, uploads in progress]
+        self._pending = 0
+        self._download_slots = asyncio.Semaphore(max_downloads)
+        # Parse jobs wait here, not in the pool's unbounded internal queue
+        self._parse_slots = asyncio.Semaphore(max_workers)
+        self._pool = None
+        self._client = None
+        os.makedirs(upload_dir, exist_ok=True)
+
+    def in_progress(self, user_id):
+        entry = self._users.get(user_id)
+        return entry[1] if entry else 0
+
+    def admit(self, user_id):
+        """Reserves a slot for one upload by `user_id`; `process()` releases it.
+
+        Returns:
+            int: The user's uploads in progress, including this one
+
+        Raises:
+            UploadRejected: The user or the whole pipeline is at its limit
+        """
+        in_progress = self.in_progress(user_id)
+        if in_progress >= self.max_per_user:
+            self.rejected += 1
+            UPLOADS.inc(result="rejected_user")
+            raise UploadRejected(f"⏳ You have {in_progress} uploads processing; send more once they're done.")
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            UPLOADS.inc(result="rejected_busy")
+            raise UploadRejected("🚦 The analyzer is busy right now; please try again in a minute.")
+        entry = self._users.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        self._pending += 1
+        self.accepted += 1
+        UPLOADS.inc(result="accepted")
+        return entry[1]
+
+    async def process(self, bot, user_id, file_id, kind):
+        """Downloads and parses one admitted upload.
+
+        Args:
+            bot (telegram.Bot): Resolves `file_id` to a download.
+            user_id: The user `admit()` was called for.
+            file_id (str): Telegram file ID of the photo or document.
+            kind (str): Value of `UploadParser.detect_kind`.
+
+        Returns:
+            dict: The result of `UploadParser.parse_upload`
+
+        Raises:
+            UploadError: The file is too big or can't be parsed
+        """
+        queued_at = time.perf_counter()
+        entry = self._users[user_id]
+        path = None
+        try:
+            async with entry[0]:
+                UPLOAD_SECONDS.observe(time.perf_counter() - queued_at, stage="queued")
+                with UPLOAD_SECONDS.time(stage="download"):
+                    async with self._download_slots:
+                        path = await self._download(bot, file_id)
+                with UPLOAD_SECONDS.time(stage="parse"):
+                    async with self._parse_slots:
+                        result = await asyncio.get_running_loop().run_in_executor(
+                            self._get_pool(), parse_upload, path, kind)
+            self.completed += 1
+            UPLOADS.inc(result="completed")
+            return result
+        except UploadError:
+            self.failed += 1
+            UPLOADS.inc(result="unusable")
+            raise
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool for the next upload
+            self.failed += 1
+            ERRORS.inc(stage="upload")
+            self._pool = None
+            raise
+        except Exception:
+            self.failed += 1
+            ERRORS.inc(stage="upload")
+            raise
+        finally:
+            if path is not None:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._users[user_id]
+            self._pending -= 1
+
+    async def _download(self, bot, file_id):
+        telegram_file = await bot.get_file(file_id)
+        if telegram_file.file_size and telegram_file.file_size > self.max_bytes:
+            raise UploadError(f"That file is too big; the limit is {self.max_bytes // (1024 * 1024)} MB.")
+        path = os.path.join(self.upload_dir, f"{uuid.uuid4().hex}.upload")
+        source = telegram_file.file_path or ""
+        if not source.startswith(("http://", "https://")):
+            # A local Bot API server hands out paths on this machine
+            await asyncio.to_thread(shutil.copyfile, source, path)
+            return path
+
+        size = 0
+        try:
+            async with self._get_client().stream("GET", source) as response:
+                response.raise_for_status()
+                # File I/O runs in worker threads, so a slow disk never stalls the event loop
+                f = await asyncio.to_thread(open, path, "wb")
+                try:
+                    async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > self.max_bytes:
+                            raise UploadError(f"That file is too big; the limit is {self.max_bytes // (1024 * 1024)} MB.")
+                        await asyncio.to_thread(f.write, chunk)
+                finally:
+                    await asyncio.to_thread(f.close)
+        except BaseException:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            raise
+        self.bytes_downloaded += size
+        return path
+
+    def _get_client(self):
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(DOWNLOAD_TIMEOUT, connect=5.0))
+        return self._client
+
+    def _get_pool(self):
+        # Started on first use; "spawn" so workers don't inherit the bot's threads and sockets
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def stats(self):
+        """Accepted, rejected, completed and failed uploads, and how many are in progress."""
+        return {
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "failed": self.failed,
+            "in_progress": self._pending,
+            "bytes_downloaded": self.bytes_downloaded,
+        }
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
@@ -1,66 +1,294 @@
-import requests
+import asyncio
+import hashlib
+import threading
+import httpx
 from datetime import datetime, timedelta
 import os
 from zoneinfo import ZoneInfo
+from WorkoutCache import WorkoutCache
+from Metrics import ERRORS, UPSTREAM_FETCH_SECONDS
+
+# Connection settings of the SugarWOD client
+DEFAULT_TIMEOUT = 10.0          # seconds, per request
+DEFAULT_CONNECT_TIMEOUT = 5.0   # seconds, TCP + TLS handshake
+DEFAULT_MAX_CONNECTIONS = 10    # pooled connections to SugarWOD
+DEFAULT_KEEPALIVE_EXPIRY = 30.0 # seconds an idle connection is kept open
+DEFAULT_MAX_CONCURRENCY = 8     # in-flight requests allowed at once
+DEFAULT_BATCH_DAYS = 7          # days fetched together whenever any of them is missing
+DEFAULT_TIMEZONE = "Asia/Jerusalem"  # the box's local time, which decides what "today" is
+
+
+def _requested_dates(date_str=None, include_tomorrow=True, tz=None):
+    """Lists the dates (YYYY-MM-DD) a call asks for.
+
+    Args:
+        date_str (str, optional): Date in YYYY-MM-DD or YYYYMMDD format. Defaults to None (today).
+        include_tomorrow (bool, optional): Whether to add the following day. Defaults to True.
+        tz (ZoneInfo, optional): Timezone "today" is taken in. Defaults to DEFAULT_TIMEZONE.
+
+    Returns:
+        list: The requested date, followed by the next day if include_tomorrow is set
+    """
+    if date_str is None:
+        # Get today's date in the box's local time
+        input_date = datetime.now(tz or ZoneInfo(DEFAULT_TIMEZONE))
+    else:
+        # Accept both YYYY-MM-DD and YYYYMMDD
+        input_date = datetime.strptime(date_str.replace('-', ''), "%Y%m%d")
+
+    dates = [input_date.strftime("%Y-%m-%d")]
+    if include_tomorrow:
+        dates.append((input_date + timedelta(days=1)).strftime("%Y-%m-%d"))
+    return dates
+
+
+def _batch_window(dates, batch_days=DEFAULT_BATCH_DAYS):
+    """Widens `dates` to `batch_days` consecutive days from the earliest one, for a single `dates=` request."""
+    start = datetime.strptime(min(dates), "%Y-%m-%d")
+    window = {(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(batch_days)}
+    return sorted(window | set(dates))
+
+
+def _date_range(start_str=None, days=DEFAULT_BATCH_DAYS, tz=None):
+    """Lists `days` consecutive dates (YYYY-MM-DD) from `start_str` (today in `tz` if None)."""
+    start = datetime.strptime(_requested_dates(start_str, include_tomorrow=False, tz=tz)[0], "%Y-%m-%d")
+    return [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days)]
+
+
+def _workouts_url(base_url, dates):
+    return f"{base_url}/workouts?dates={','.join(d.replace('-', '') for d in dates)}"
+
+
+def _group_by_date(workouts_data, dates):
+    """Splits an API response into {date: [workouts]} for each requested date."""
+    by_date = {date: [] for date in dates}
+    for w in workouts_data.get("data", []):
+        scheduled = w.get("attributes", {}).get("scheduled_date", "")[:10]
+        if scheduled in by_date:
+            by_date[scheduled].append(w)
+    return by_date
+
+
+def _default_box_id(api_key):
+    # Namespace cache entries by API key without storing the key itself
+    return hashlib.sha256(api_key.encode()).hexdigest()[:12]
+
 
 class WorkoutAPI_Handler:
-    def __init__(self, base_url, api_key):
-        self.base_url = base_url
-        self.headers = {"Authorization": api_key}
+    """Blocking SugarWOD client for scripts, a thin wrapper over `AsyncWorkoutAPI_Handler`.
+
+    Each call runs the async client's coroutine on a private event loop in a
+    background thread and waits for the result. The caching, batching and
+    connection pooling are the async client's. Call `close()` when done.
+    """
+
+    def __init__(self, base_url, api_key, timeout=DEFAULT_TIMEOUT, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 cache=None, box_id=None, batch_days=DEFAULT_BATCH_DAYS, timezone=DEFAULT_TIMEZONE):
+        self._client = AsyncWorkoutAPI_Handler(base_url, api_key, timeout=timeout, max_connections=max_connections,
+                                               cache=cache, box_id=box_id, batch_days=batch_days, timezone=timezone)
+        self.cache = self._client.cache
+        self.box_id = self._client.box_id
+        self.timezone = self._client.timezone
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="workout-api", daemon=True)
+        self._thread.start()
+
+    def _run(self, coro):
+        # Also usable from inside another event loop, which it blocks like any synchronous call
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
 
     def get_workouts_for_date(self, date_str=None, include_tomorrow=True):
-        """Fetches workouts for a specific date or today (in Israel time) if none provided.
-        
+        """Fetches workouts for a specific date or today (in the box's timezone) if none provided.
+
         Args:
             date_str (str, optional): Date in YYYY-MM-DD or YYYYMMDD format. Defaults to None (today).
             include_tomorrow (bool, optional): Whether to include tomorrow's workouts. Defaults to True.
-            
+
         Returns:
             list: List of workout data dictionaries
         """
+        return self._run(self._client.get_workouts_for_date(date_str, include_tomorrow))
+
+    def get_workouts_for_range(self, start_str=None, days=DEFAULT_BATCH_DAYS):
+        """Fetches `days` consecutive days from `start_str` (today if None), missing ones in a single request.
+
+        Returns:
+            dict: {date: [workouts]} in date order; empty if the request failed
+        """
+        return self._run(self._client.get_workouts_for_range(start_str, days))
+
+    def fetch_dates(self, dates):
+        """Fetches exactly `dates` (YYYY-MM-DD) in one request, bypassing the cache; errors propagate.
+
+        Returns:
+            dict: {date: [workouts]} for every requested date
+        """
+        return self._run(self._client.fetch_dates(dates))
+
+    @property
+    def upstream_requests(self):
+        return self._client.upstream_requests
+
+    def stats(self):
+        """Cache hit/miss counters plus how many requests actually reached SugarWOD."""
+        return self._client.stats()
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+        self._run(self._client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+class AsyncWorkoutAPI_Handler:
+    """Non-blocking SugarWOD client for use inside the bot's event loop.
+
+    A single `httpx.AsyncClient` is shared by every call, so connections are
+    pooled and kept alive between updates. A semaphore bounds how many
+    requests are in flight at once, so a burst of commands cannot open an
+    unbounded number of sockets to SugarWOD.
+
+    Results go through a per-date `WorkoutCache`.
+    Concurrent misses for a date wait on the request already in flight for it
+    (single-flight), so a rush of users on a cold cache costs one API call.
+    A miss fetches `batch_days` days from the first missing date in a single
+    `dates=` request, so the rest of the week is answered from cache.
+    Calls without a date mean today in `timezone`, the box's local time.
+    """
+
+    def __init__(self, base_url, api_key, timeout=DEFAULT_TIMEOUT, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 cache=None, box_id=None, batch_days=DEFAULT_BATCH_DAYS, timezone=DEFAULT_TIMEZONE):
+        self.base_url = base_url
+        self.headers = {"Authorization": api_key}
+        self.timeout = httpx.Timeout(timeout, connect=DEFAULT_CONNECT_TIMEOUT)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.cache = cache if cache is not None else WorkoutCache()
+        self.box_id = box_id or _default_box_id(api_key)
+        self.batch_days = batch_days
+        self.timezone = ZoneInfo(timezone)
+        self.upstream_requests = 0
+        self.coalesced = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._inflight = {}  # date -> task fetching it
+        self._client = None
+
+    def _get_client(self):
+        # Created lazily so the client binds to the loop that actually runs it
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(headers=self.headers, timeout=self.timeout, limits=self.limits)
+        return self._client
+
+    async def get_workouts_for_date(self, date_str=None, include_tomorrow=True):
+        """Async version of `WorkoutAPI_Handler.get_workouts_for_date`, same arguments and result."""
+        try:
+            dates = _requested_dates(date_str, include_tomorrow, self.timezone)
+            by_date = {date: self.cache.get(self.box_id, date) for date in dates}
+            missing = [date for date, workouts in by_date.items() if workouts is None]
+            if missing:
+                by_date.update(await self._fetch_coalesced(_batch_window(missing, self.batch_days)))
+            return [w for date in dates for w in by_date[date]]
+
+        except Exception as e:
+            print(f"Error fetching workouts: {e}")
+            ERRORS.inc(stage="upstream_fetch")
+            return []
+
+    async def refresh(self, date_str=None, include_tomorrow=True):
+        """Re-fetches the dates (and the rest of their batch) from SugarWOD even if cached, so the cache stays warm.
+
+        Same arguments and result as `get_workouts_for_date`.
+        """
         try:
-            israel = ZoneInfo("Asia/Jerusalem")
-            israel_now = datetime.now(israel)
-            
-            if date_str is None:
-                # Get today's date
-                today_str = israel_now.strftime("%Y%m%d")
-                if include_tomorrow:
-                    # Get tomorrow's date
-                    tomorrow = israel_now + timedelta(days=1)
-                    tomorrow_str = tomorrow.strftime("%Y%m%d")
-                    date_str = f"{today_str},{tomorrow_str}"
-                else:
-                    date_str = today_str
+            dates = _requested_dates(date_str, include_tomorrow, self.timezone)
+            by_date = await self._fetch_coalesced(_batch_window(dates, self.batch_days))
+            return [w for date in dates for w in by_date[date]]
+
+        except Exception as e:
+            print(f"Error refreshing workouts: {e}")
+            ERRORS.inc(stage="upstream_fetch")
+            return []
+
+    async def _fetch_coalesced(self, dates):
+        """Fetches `dates`, joining requests already in flight instead of duplicating them."""
+        tasks = set()
+        to_fetch = []
+        for date in dates:
+            task = self._inflight.get(date)
+            if task is not None:
+                self.coalesced += 1
+                tasks.add(task)
             else:
-                # Convert YYYY-MM-DD to YYYYMMDD if needed
-                if '-' in date_str:
-                    date_str = date_str.replace('-', '')
-                if include_tomorrow:
-                    # Parse the input date and add tomorrow
-                    input_date = datetime.strptime(date_str, "%Y%m%d")
-                    tomorrow = input_date + timedelta(days=1)
-                    tomorrow_str = tomorrow.strftime("%Y%m%d")
-                    date_str = f"{date_str},{tomorrow_str}"
-
-            workouts_url = f"{self.base_url}/workouts?dates={date_str}"
-            print(f"Fetching workouts from: {workouts_url}")
-
-            workouts_response = requests.get(workouts_url, headers=self.headers)
-            workouts_response.raise_for_status()
-            workouts_data = workouts_response.json()
-            workouts = workouts_data.get("data", [])
-            
-            # If we're not including tomorrow, filter out tomorrow's workouts
-            if not include_tomorrow:
-                today_str = israel_now.strftime("%Y-%m-%d")
-                workouts = [w for w in workouts if w.get("attributes", {}).get("scheduled_date", "").startswith(today_str)]
-            
-            return workouts
-            
+                to_fetch.append(date)
+
+        if to_fetch:
+            task = asyncio.ensure_future(self._fetch(to_fetch))
+            for date in to_fetch:
+                self._inflight[date] = task
+            task.add_done_callback(lambda t, fetched=to_fetch: self._clear_inflight(t, fetched))
+            tasks.add(task)
+
+        by_date = {}
+        # Shielded so one caller giving up doesn't cancel the fetch others are waiting on
+        for result in await asyncio.gather(*(asyncio.shield(t) for t in tasks)):
+            by_date.update(result)
+        return {date: by_date[date] for date in dates}
+
+    async def get_workouts_for_range(self, start_str=None, days=DEFAULT_BATCH_DAYS):
+        """Async version of `WorkoutAPI_Handler.get_workouts_for_range`, same arguments and result."""
+        try:
+            dates = _date_range(start_str, days, self.timezone)
+            by_date = {date: self.cache.get(self.box_id, date) for date in dates}
+            missing = [date for date, workouts in by_date.items() if workouts is None]
+            if missing:
+                by_date.update(await self._fetch_coalesced(missing))
+            return by_date
+
         except Exception as e:
             print(f"Error fetching workouts: {e}")
-            return []
+            ERRORS.inc(stage="upstream_fetch")
+            return {}
+
+    def _clear_inflight(self, task, dates):
+        for date in dates:
+            if self._inflight.get(date) is task:
+                del self._inflight[date]
+
+    async def fetch_dates(self, dates, cache_results=False):
+        """Async `WorkoutAPI_Handler.fetch_dates`: one request for exactly `dates`, bypassing the cache.
+
+        With `cache_results` the fresh workouts also replace the cached ones.
+        """
+        return await self._fetch(list(dates), cache_results=cache_results)
+
+    async def _fetch(self, dates, cache_results=True):
+        workouts_url = _workouts_url(self.base_url, dates)
+        print(f"Fetching workouts from: {workouts_url}")
+
+        async with self._semaphore:
+            self.upstream_requests += 1
+            with UPSTREAM_FETCH_SECONDS.time(client="async"):
+                workouts_response = await self._get_client().get(workouts_url)
+        workouts_response.raise_for_status()
+        by_date = _group_by_date(workouts_response.json(), dates)
+        if cache_results:
+            self.cache.set_many(self.box_id, by_date, today=datetime.now(self.timezone).strftime("%Y-%m-%d"))
+        return by_date
+
+    def stats(self):
+        """Cache hit/miss counters, coalesced misses and requests that actually reached SugarWOD."""
+        return {**self.cache.stats(), "upstream_requests": self.upstream_requests, "coalesced": self.coalesced}
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
 # Example usage (for testing this file individually)
 if __name__ == '__main__':
@@ -68,13 +296,13 @@ if __name__ == '__main__':
     from dotenv import load_dotenv
     load_dotenv()
     sugar_wod_api_key = os.getenv("SUGARWOD_API_KEY")
-    base_url = "https://api.sugarwod.com/v2"
+    base_url = os.getenv("SUGARWOD_API_URL", "https://api.sugarwod.com/v2")
 
     if not sugar_wod_api_key:
         print("Error: SUGARWOD_API_KEY not found in environment variables.")
     else:
         handler = WorkoutAPI_Handler(base_url, sugar_wod_api_key)
-        
+
         # Test 1: Get both today and tomorrow's workouts (default behavior)
         print("\nTest 1: Today and Tomorrow's Workouts")
         all_workouts = handler.get_workouts_for_date()
@@ -83,7 +311,7 @@ if __name__ == '__main__':
             title = w.get("attributes", {}).get("title", "N/A")
             date = w.get("attributes", {}).get("scheduled_date", "N/A")
             print(f"- {date}: {title}")
-            
+
         # Test 2: Get only today's workouts
         print("\nTest 2: Today's Workouts Only")
         today_workouts = handler.get_workouts_for_date(include_tomorrow=False)
@@ -91,7 +319,7 @@ if __name__ == '__main__':
         for w in today_workouts:
             title = w.get("attributes", {}).get("title", "N/A")
             print(f"- {title}")
-            
+
         # Test 3: Get workouts for a specific date
         print("\nTest 3: Specific Date Workouts")
         specific_date = "2024-03-20"
@@ -99,4 +327,14 @@ if __name__ == '__main__':
         print(f"Found {len(specific_workouts)} workouts for {specific_date}.")
         for w in specific_workouts:
             title = w.get("attributes", {}).get("title", "N/A")
-            print(f"- {title}") 
\ No newline at end of file
+            print(f"- {title}")
+
+        # Test 4: Same request through the async client
+        print("\nTest 4: Async client")
+        async def _async_test():
+            async_handler = AsyncWorkoutAPI_Handler(base_url, sugar_wod_api_key)
+            try:
+                return await async_handler.get_workouts_for_date(include_tomorrow=False)
+            finally:
+                await async_handler.aclose()
+        print(f"Found {len(asyncio.run(_async_test()))} workouts.")
@@ -0,0 +1,320 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+import httpx
+
+DEFAULT_CHUNK_DAYS = 14        # dates per SugarWOD request while syncing
+DEFAULT_MIN_INTERVAL = 1.0     # seconds between sync requests, to stay well inside SugarWOD's rate limit
+DEFAULT_RECHECK_DAYS = 3       # past days re-fetched on every sync, since coaches still edit them
+DEFAULT_DAYS_AHEAD = 7         # future days kept in sync
+DEFAULT_MAX_RETRIES = 5
+
+
+def _day_hash(workouts):
+    """Fingerprint of a day's visible content, to skip rewriting unchanged days."""
+    content = [(w.get("id"), w.get("attributes", {}).get("title", ""), w.get("attributes", {}).get("description", ""))
+               for w in workouts]
+    return hashlib.sha256(json.dumps(content, ensure_ascii=False).encode()).hexdigest()
+
+
+def _fts_query(text):
+    """Turns free text into an FTS5 query matching every word, so user input can't be a syntax error."""
+    terms = [term.replace('"', '""') for term in text.split()]
+    return " ".join(f'"{term}"' for term in terms)
+
+
+def _date_range(start, end):
+    """Lists YYYY-MM-DD dates from `start` to `end`, inclusive."""
+    day = datetime.strptime(start, "%Y-%m-%d")
+    last = datetime.strptime(end, "%Y-%m-%d")
+    dates = []
+    while day <= last:
+        dates.append(day.strftime("%Y-%m-%d"))
+        day += timedelta(days=1)
+    return dates
+
+
+class WorkoutArchive:
+    """Local history of every box's workouts in SQLite, searchable through FTS5.
+
+    One row per workout plus one row per synced day (also for days without
+    workouts), so a sync knows which days it already has. Lookups by date,
+    full-text search and "last time we did this" never leave the process.
+
+    Args:
+        path (str): SQLite database file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS workouts (
+                id INTEGER PRIMARY KEY,
+                box TEXT NOT NULL,
+                date TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                workout_id TEXT,
+                title TEXT NOT NULL,
+                description TEXT NOT NULL,
+                UNIQUE (box, date, position));
+            CREATE INDEX IF NOT EXISTS workouts_title ON workouts (box, title COLLATE NOCASE, date);
+            CREATE VIRTUAL TABLE IF NOT EXISTS workouts_fts USING fts5(
+                title, description, content='workouts', content_rowid='id', tokenize='unicode61 remove_diacritics 2');
+            CREATE TRIGGER IF NOT EXISTS workouts_ai AFTER INSERT ON workouts BEGIN
+                INSERT INTO workouts_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+            END;
+            CREATE TRIGGER IF NOT EXISTS workouts_ad AFTER DELETE ON workouts BEGIN
+                INSERT INTO workouts_fts (workouts_fts, rowid, title, description)
+                VALUES ('delete', old.id, old.title, old.description);
+            END;
+            CREATE TABLE IF NOT EXISTS days (
+                box TEXT NOT NULL,
+                date TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                synced_at REAL NOT NULL,
+                PRIMARY KEY (box, date));
+            CREATE TABLE IF NOT EXISTS sync_state (
+                box TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT,
+                PRIMARY KEY (box, key));
+        """)
+
+    def store_days(self, box, workouts_by_date):
+        """Stores {date: [workouts]} for `box` in one transaction; returns how many days changed."""
+        now = time.time()
+        changed = 0
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for date, workouts in workouts_by_date.items():
+                    content_hash = _day_hash(workouts)
+                    row = self._conn.execute(
+                        "SELECT content_hash FROM days WHERE box = ? AND date = ?", (box, date)
+                    ).fetchone()
+                    if row is None or row[0] != content_hash:
+                        changed += 1
+                        self._conn.execute("DELETE FROM workouts WHERE box = ? AND date = ?", (box, date))
+                        self._conn.executemany(
+                            "INSERT INTO workouts (box, date, position, workout_id, title, description) "
+                            "VALUES (?, ?, ?, ?, ?, ?)",
+                            [(box, date, position, w.get("id"), w.get("attributes", {}).get("title", "N/A"),
+                              w.get("attributes", {}).get("description", "N/A"))
+                             for position, w in enumerate(workouts)],
+                        )
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO days (box, date, content_hash, synced_at) VALUES (?, ?, ?, ?)",
+                        (box, date, content_hash, now),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return changed
+
+    def get_day(self, box, date):
+        """Returns the day's workouts in SugarWOD's shape, or None if the day was never synced."""
+        with self._lock:
+            if not self._conn.execute("SELECT 1 FROM days WHERE box = ? AND date = ?", (box, date)).fetchone():
+                return None
+            rows = self._conn.execute(
+                "SELECT workout_id, title, description FROM workouts WHERE box = ? AND date = ? ORDER BY position",
+                (box, date),
+            ).fetchall()
+        return [{"id": workout_id, "attributes": {"title": title, "description": description,
+                                                  "scheduled_date": f"{date}T00:00:00.000Z"}}
+                for workout_id, title, description in rows]
+
+    def search(self, box, text, limit=10):
+        """Finds workouts mentioning every word of `text`, newest first.
+
+        Returns:
+            list: Dicts with date, title and a short snippet of the match
+        """
+        query = _fts_query(text)
+        if not query:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT w.date, w.title, snippet(workouts_fts, -1, '', '', '…', 12) "
+                "FROM workouts_fts JOIN workouts w ON w.id = workouts_fts.rowid "
+                "WHERE workouts_fts MATCH ? AND w.box = ? ORDER BY w.date DESC, w.position LIMIT ?",
+                (query, box, limit),
+            ).fetchall()
+        return [{"date": date, "title": title, "snippet": snippet} for date, title, snippet in rows]
+
+    def last_time(self, box, name, before=None):
+        """Returns the most recent workout titled `name` (or mentioning it in the title) before `before`.
+
+        Returns:
+            dict: date, title and description, or None if it was never programmed
+        """
+        before = before or "9999-12-31"
+        with self._lock:
+            rows = [self._conn.execute(
+                "SELECT date, title, description FROM workouts "
+                "WHERE box = ? AND title = ? COLLATE NOCASE AND date < ? ORDER BY date DESC LIMIT 1",
+                (box, name.strip(), before),
+            ).fetchone()]
+            if _fts_query(name):
+                rows.append(self._conn.execute(
+                    "SELECT w.date, w.title, w.description "
+                    "FROM workouts_fts JOIN workouts w ON w.id = workouts_fts.rowid "
+                    "WHERE workouts_fts MATCH ? AND w.box = ? AND w.date < ? ORDER BY w.date DESC LIMIT 1",
+                    (f"title : ({_fts_query(name)})", box, before),
+                ).fetchone())
+        rows = [row for row in rows if row is not None]
+        if not rows:
+            return None
+        row = max(rows, key=lambda r: r[0])
+        return {"date": row[0], "title": row[1], "description": row[2]}
+
+    def synced_dates(self, box, start, end):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT date FROM days WHERE box = ? AND date BETWEEN ? AND ?", (box, start, end)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def get_state(self, box, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM sync_state WHERE box = ? AND key = ?", (box, key)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, box, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO sync_state (box, key, value) VALUES (?, ?, ?)",
+                               (box, key, value))
+
+    def stats(self):
+        with self._lock:
+            workouts = self._conn.execute("SELECT COUNT(*) FROM workouts").fetchone()[0]
+            days = self._conn.execute("SELECT COUNT(*) FROM days").fetchone()[0]
+        return {"workouts": workouts, "days": days}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ArchiveSync:
+    """Fills a `WorkoutArchive` for one box through batched `dates=` requests.
+
+    Days already archived are not fetched again unless they are recent
+    (within `recheck_days`) or upcoming, which coaches may still edit; a
+    re-fetched day is only rewritten when its content changed. Requests are
+    spaced `min_interval` seconds apart, and a 429 or server error waits
+    (honouring Retry-After) and retries.
+
+    Args:
+        archive (WorkoutArchive): Where workouts are stored.
+        workout_api_handler (AsyncWorkoutAPI_Handler): The box's SugarWOD client.
+        box (str): Archive namespace of the box (its slug).
+    """
+
+    def __init__(self, archive, workout_api_handler, box, chunk_days=DEFAULT_CHUNK_DAYS,
+                 min_interval=DEFAULT_MIN_INTERVAL, recheck_days=DEFAULT_RECHECK_DAYS,
+                 days_ahead=DEFAULT_DAYS_AHEAD, max_retries=DEFAULT_MAX_RETRIES):
+        self.archive = archive
+        self.workout_api_handler = workout_api_handler
+        self.box = box
+        self.chunk_days = chunk_days
+        self.min_interval = min_interval
+        self.recheck_days = recheck_days
+        self.days_ahead = days_ahead
+        self.max_retries = max_retries
+        self.requests = 0
+        self._next_request = 0.0
+
+    def _today(self):
+        # The box's local date, from the timezone of its SugarWOD client
+        return datetime.now(self.workout_api_handler.timezone).strftime("%Y-%m-%d")
+
+    async def sync_recent(self):
+        """Syncs the last `recheck_days` days through `days_ahead` days from now."""
+        today = datetime.strptime(self._today(), "%Y-%m-%d")
+        start = (today - timedelta(days=self.recheck_days)).strftime("%Y-%m-%d")
+        end = (today + timedelta(days=self.days_ahead)).strftime("%Y-%m-%d")
+        return await self.sync_range(start, end)
+
+    async def sync_range(self, start, end):
+        """Fetches the days from `start` to `end` (YYYY-MM-DD) that are missing or may have changed.
+
+        Returns:
+            dict: Days fetched, days whose content changed, and requests made
+        """
+        dates = _date_range(start, end)
+        if not dates:
+            return {"fetched": 0, "changed": 0, "requests": 0}
+        recheck_from = (datetime.strptime(self._today(), "%Y-%m-%d")
+                        - timedelta(days=self.recheck_days)).strftime("%Y-%m-%d")
+        stored = self.archive.synced_dates(self.box, start, end)
+        to_fetch = [d for d in dates if d not in stored or d >= recheck_from]
+
+        stats = {"fetched": 0, "changed": 0, "requests": 0}
+        for i in range(0, len(to_fetch), self.chunk_days):
+            chunk = to_fetch[i:i + self.chunk_days]
+            by_date = await self._fetch(chunk)
+            stats["changed"] += self.archive.store_days(self.box, by_date)
+            stats["fetched"] += len(chunk)
+            stats["requests"] += 1
+        return stats
+
+    async def backfill(self, since):
+        """Archives every day from yesterday back to `since`, newest first; resumable.
+
+        Progress is saved after every request, so an interrupted backfill
+        (restart, crash, rate limiting) continues where it stopped.
+
+        Returns:
+            dict: Days fetched, days changed and requests made in this run
+        """
+        cursor = self.archive.get_state(self.box, "backfill_cursor")  # oldest date already covered
+        end_day = datetime.strptime(cursor or self._today(), "%Y-%m-%d") - timedelta(days=1)
+        since_day = datetime.strptime(since, "%Y-%m-%d")
+
+        stats = {"fetched": 0, "changed": 0, "requests": 0}
+        while end_day >= since_day:
+            start_day = max(since_day, end_day - timedelta(days=self.chunk_days - 1))
+            chunk = self.archive.synced_dates(self.box, f"{start_day:%Y-%m-%d}", f"{end_day:%Y-%m-%d}")
+            missing = [d for d in _date_range(f"{start_day:%Y-%m-%d}", f"{end_day:%Y-%m-%d}") if d not in chunk]
+            if missing:
+                by_date = await self._fetch(missing)
+                stats["changed"] += self.archive.store_days(self.box, by_date)
+                stats["fetched"] += len(missing)
+                stats["requests"] += 1
+            self.archive.set_state(self.box, "backfill_cursor", f"{start_day:%Y-%m-%d}")
+            end_day = start_day - timedelta(days=1)
+        print(f"Backfill of {self.box} back to {since} done: {stats}")
+        return stats
+
+    async def _fetch(self, dates):
+        for attempt in range(self.max_retries + 1):
+            wait = self._next_request - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._next_request = time.monotonic() + self.min_interval
+            self.requests += 1
+            try:
+                return await self.workout_api_handler.fetch_dates(dates)
+            except httpx.HTTPStatusError as e:
+                status = e.response.status_code
+                if status != 429 and status < 500 or attempt == self.max_retries:
+                    raise
+                retry_after = e.response.headers.get("Retry-After")
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt
+                print(f"SugarWOD answered {status} while syncing {self.box}, retrying in {delay}s")
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = 2 ** attempt
+                print(f"Network error while syncing {self.box} ({e}), retrying in {delay}s")
+            self._next_request = max(self._next_request, time.monotonic() + delay)
@@ -0,0 +1,155 @@
+import atexit
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from Metrics import CACHE_REQUESTS
+
+DEFAULT_MAX_ENTRIES = 256          # (box, date) pairs kept in memory
+DEFAULT_TTL = 60 * 60              # seconds a published day is trusted
+DEFAULT_UNPUBLISHED_TTL = 5 * 60   # seconds an empty future day is trusted
+DEFAULT_SAVE_DELAY = 2.0           # seconds writes are gathered before the file is rewritten
+# The earliest local time on Earth: before its midnight a date hasn't started anywhere
+EARLIEST_UTC_OFFSET = timedelta(hours=-12)
+
+
+class WorkoutCache:
+    """LRU + TTL cache of SugarWOD workouts, one entry per (box, date).
+
+    A day the coach hasn't published yet (a future date with no workouts) is
+    kept for `unpublished_ttl` only, so it is picked up soon after it appears.
+    When `path` is given the cache is loaded from and saved to that JSON file,
+    so a restarted bot or a cron run starts warm. Writes don't save on the
+    caller's thread (often the event loop): the file is rewritten on a timer
+    thread `save_delay` seconds after the first unsaved write, once for a
+    whole burst (a `save_delay` of 0 saves on every write instead).
+    `flush()`, which also runs at exit, saves what is pending.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL,
+                 unpublished_ttl=DEFAULT_UNPUBLISHED_TTL, path=None, save_delay=DEFAULT_SAVE_DELAY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.unpublished_ttl = unpublished_ttl
+        self.path = path
+        self.save_delay = save_delay
+        self.saves = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # (box, date) -> (expires_at, workouts)
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._save_timer = None
+        if path:
+            self.load()
+            atexit.register(self.flush)
+
+    def get(self, box, date):
+        """Returns the cached workouts for `date` (YYYY-MM-DD), or None if missing or expired."""
+        key = (box, date)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                CACHE_REQUESTS.inc(cache="workouts", result="miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            CACHE_REQUESTS.inc(cache="workouts", result="hit")
+            return entry[1]
+
+    def set_many(self, box, workouts_by_date, today=None):
+        """Stores the workouts of several dates for `box`; a disk-backed cache schedules a save.
+
+        `today` (YYYY-MM-DD) is the box's local date, after which an empty day
+        counts as unpublished. If None, any date that hasn't started
+        everywhere does, so no timezone's "today" is trusted for long.
+        """
+        now = time.time()
+        today = today or datetime.now(timezone(EARLIEST_UTC_OFFSET)).strftime("%Y-%m-%d")
+        with self._lock:
+            for date, workouts in workouts_by_date.items():
+                ttl = self.unpublished_ttl if not workouts and date > today else self.ttl
+                self._entries[(box, date)] = (now + ttl, workouts)
+                self._entries.move_to_end((box, date))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        if self.path:
+            self._schedule_save()
+
+    def _schedule_save(self):
+        with self._lock:
+            self._dirty = True
+            if self.save_delay > 0:
+                if self._save_timer is None:
+                    self._save_timer = threading.Timer(self.save_delay, self.flush)
+                    self._save_timer.daemon = True
+                    self._save_timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        """Saves pending writes to `path` now instead of waiting for the timer."""
+        with self._save_lock:
+            with self._lock:
+                if self._save_timer is not None:
+                    self._save_timer.cancel()
+                    self._save_timer = None
+                dirty, self._dirty = self._dirty, False
+            if dirty:
+                self.save()
+
+    def invalidate(self, box, date=None):
+        """Drops one date of `box`, or all of its dates when `date` is None."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == box and (date is None or k[1] == date)]:
+                del self._entries[key]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "saves": self.saves,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+    def load(self):
+        """Loads unexpired entries from `path`; a missing or corrupt file just means a cold cache."""
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable workout cache {self.path}: {e}")
+            return
+        now = time.time()
+        with self._lock:
+            for box, date, expires_at, workouts in stored.get("entries", []):
+                if expires_at > now:
+                    self._entries[(box, date)] = (expires_at, workouts)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def save(self):
+        """Writes the cache to `path` atomically (temp file + rename)."""
+        with self._lock:
+            entries = [[box, date, expires_at, workouts] for (box, date), (expires_at, workouts) in self._entries.items()]
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({"entries": entries}, f)
+            os.replace(tmp_path, self.path)
+            self.saves += 1
+        except OSError as e:
+            print(f"Error saving workout cache to {self.path}: {e}")
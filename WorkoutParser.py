@@ -0,0 +1,324 @@
+import re
+from functools import lru_cache
+
+# Seconds per rep (or per calorie / per 100 m) for an intermediate athlete, plus the usual scaling
+MOVEMENTS = {
+    "thruster": (("thruster",), 2.5, "Lighter barbell or dumbbell thrusters"),
+    "wall ball": (("wall ball", "wallball", "wb"), 2.5, "Lighter ball or lower target"),
+    "burpee": (("burpee",), 4.0, "Step back instead of jumping, or remove the push-up"),
+    "air squat": (("air squat", "squat"), 1.5, "Squat to a box or reduce depth"),
+    "pull-up": (("pull-up", "pull up", "pullup", "c2b", "chest to bar"), 2.5, "Banded pull-ups or ring rows"),
+    "push-up": (("push-up", "push up", "pushup", "hand release"), 2.0, "Elevated or knee push-ups"),
+    "sit-up": (("sit-up", "sit up", "situp", "abmat"), 2.0, "Reduce range or anchor the feet"),
+    "double under": (("double under", "double-under", "du"), 0.6, "Single unders at 2-3x the reps"),
+    "single under": (("single under", "single-under", "jump rope"), 0.4, "Line hops"),
+    "box jump": (("box jump", "box jump over", "bjo"), 3.0, "Step-ups or a lower box"),
+    "kettlebell swing": (("kettlebell swing", "kb swing", "kbs", "swing"), 2.0, "Lighter kettlebell or Russian swings"),
+    "deadlift": (("deadlift", "dl"), 3.0, "Lighter load; keep the back flat"),
+    "clean": (("power clean", "squat clean", "hang clean", "clean"), 4.0, "Lighter load or hang position"),
+    "snatch": (("power snatch", "squat snatch", "hang snatch", "snatch"), 4.0, "Dumbbell snatches or lighter bar"),
+    "clean and jerk": (("clean and jerk", "clean & jerk", "c&j"), 5.0, "Lighter load; split into clean and push press"),
+    "push press": (("push press",), 2.5, "Lighter load or strict dumbbell press"),
+    "shoulder to overhead": (("shoulder to overhead", "s2oh", "sto"), 2.5, "Lighter load or dumbbells"),
+    "front squat": (("front squat",), 3.0, "Lighter load or goblet squats"),
+    "back squat": (("back squat",), 3.0, "Lighter load or goblet squats"),
+    "overhead squat": (("overhead squat", "ohs"), 3.5, "PVC or lighter bar, or front squats"),
+    "lunge": (("lunge",), 2.0, "Bodyweight or shorter steps"),
+    "toes to bar": (("toes to bar", "toes-to-bar", "t2b", "ttb"), 2.5, "Hanging knee raises"),
+    "handstand push-up": (("handstand push-up", "handstand push up", "hspu"), 3.5, "Pike push-ups or box HSPU"),
+    "muscle-up": (("muscle-up", "muscle up", "mu"), 5.0, "Jumping muscle-ups or pull-ups + dips"),
+    "rope climb": (("rope climb",), 25.0, "Lying-to-standing rope pulls"),
+    "dumbbell snatch": (("dumbbell snatch", "db snatch"), 2.5, "Lighter dumbbell"),
+    "run": (("run",), 30.0, "Row or bike the same effort"),
+    "row": (("row",), 25.0, "Reduce the distance"),
+    "bike": (("bike", "assault bike", "echo bike"), 30.0, "Reduce the calories"),
+    "ski": (("ski", "skierg"), 27.0, "Reduce the distance"),
+}
+# Seconds per calorie on a machine, intermediate athlete
+CALORIE_SECONDS = 4.0
+# Multipliers on the intermediate pace for each level
+LEVEL_PACE = {"beginner": 1.5, "intermediate": 1.0, "advanced": 0.75}
+# Seconds per set of a strength lift, including rest
+STRENGTH_SET_SECONDS = 150
+# Distance units after a number, in meters
+DISTANCE_UNITS = {"m": 1, "meter": 1, "meters": 1, "metre": 1, "metres": 1, "k": 1000, "km": 1000,
+                  "mi": 1609, "mile": 1609, "miles": 1609, "ft": 0.3048, "feet": 0.3048, "foot": 0.3048,
+                  "yd": 0.9144, "yds": 0.9144, "yard": 0.9144, "yards": 0.9144}
+CALORIE_UNITS = ("cal", "cals", "calorie", "calories")
+# Units the estimate can't use (e.g. "1 min plank"), so the line is left to the LLM
+UNKNOWN_UNITS = ("s", "sec", "secs", "second", "seconds", "min", "mins", "minute", "minutes")
+# Letters right after a number that aren't a unit: "5x5", "95lb", "1RM"
+NOT_UNITS = ("x", "lb", "lbs", "kg", "rm", "rep", "reps")
+# Movements paced per 100 m; a distance given for any other (e.g. "50 ft lunges") isn't estimated
+DISTANCE_MOVEMENTS = ("run", "row", "bike", "ski")
+
+# Longest alias first, so "front squat" wins over "squat"; "s" and "es" plurals ("snatches") match too
+_ALIASES = [(re.compile(rf"(?<![a-z]){re.escape(alias)}(?:e?s)?(?![a-z])"), name) for alias, name in sorted(
+    ((alias, name) for name, (aliases, _, _) in MOVEMENTS.items() for alias in aliases), key=lambda pair: -len(pair[0]))]
+_AMRAP = re.compile(r"(\d+)\s*(?:min(?:ute)?s?|')?\s*amrap|amrap\s*(?:in\s*|of\s*)?(\d+)", re.I)
+_EMOM = re.compile(r"e(\d*)mom\s*(?:x\s*|for\s*)?(\d+)|(\d+)\s*(?:min(?:ute)?s?|')?\s*e(\d*)mom"
+                   r"|every\s*(\d+)\s*min(?:ute)?s?\s*(?:x|for)\s*(\d+)", re.I)
+_FOR_TIME = re.compile(r"for\s+time|\brft\b", re.I)
+_ROUNDS = re.compile(r"(\d+)\s*(?:rounds?|rds?|rft)\b", re.I)
+_TIME_CAP = re.compile(r"(?:time\s*cap|\bcap\b|\btc\b)\s*[:\-]?\s*(\d+)"
+                       r"|(\d+)\s*(?:min(?:ute)?s?|')?\s*(?:time\s*)?cap\b", re.I)
+_SETS_REPS = re.compile(r"(\d+)\s*[x×]\s*(\d+)", re.I)
+_REP_MAX = re.compile(r"(\d+)\s*rm\b|build\s+to", re.I)
+# A rep-scheme line, optionally followed by format words: "21-15-9", "21-15-9 reps for time:"
+_REP_SCHEME = re.compile(r"^\s*(\d+(?:\s*-\s*\d+)+)\s*(?:reps?\b)?\s*(?:(?:of|for\s+time|rft)\b\s*)*:?\s*$", re.I)
+_MOVEMENT = re.compile(r"^\s*(?:min(?:ute)?\s*\d+\s*[:.)\-]\s*)?(\d+(?:\.\d+)?)?(\s*)([a-z]+)?", re.I)
+_LOAD = re.compile(r"(\d+(?:\.\d+)?)\s*(?:/\s*(\d+(?:\.\d+)?))?\s*(lbs?|kg|#)|@\s*(\d+)\s*%", re.I)
+_NOTE = re.compile(r"^\s*(?:rest\b|then\b|score\b|notes?\b|scale\b|rx\b|\*|\(|warm[\s-]?up)", re.I)
+
+
+class Movement:
+    __slots__ = ("name", "reps", "unit", "load")
+
+    def __init__(self, name, reps=None, unit="reps", load=None):
+        self.name = name
+        self.reps = reps
+        self.unit = unit      # "reps", "cal" or "m"
+        self.load = load      # e.g. "95/65 lb" or "75%"
+
+    def __repr__(self):
+        return f"Movement({self.name!r}, {self.reps!r}, {self.unit!r}, {self.load!r})"
+
+    def describe(self):
+        amount = "" if self.reps is None else (f"{self.reps}m " if self.unit == "m" else
+                                                f"{self.reps} cal " if self.unit == "cal" else f"{self.reps} ")
+        return f"{amount}{self.name}" + (f" @ {self.load}" if self.load else "")
+
+
+class ParsedWorkout:
+    """Compact structured form of one SugarWOD workout.
+
+    `complete` is True when the format and every line were understood, i.e.
+    the rule-based estimate covers the whole workout.
+    """
+
+    __slots__ = ("title", "format", "minutes", "time_cap", "rounds", "rep_scheme", "sets", "movements",
+                 "unparsed", "complete")
+
+    def __init__(self, title, format="unknown", minutes=None, time_cap=None, rounds=1, rep_scheme=None,
+                 sets=None, movements=(), unparsed=(), complete=False):
+        self.title = title
+        self.format = format          # "amrap", "emom", "for_time", "strength" or "unknown"
+        self.minutes = minutes        # fixed time domain of AMRAP/EMOM
+        self.time_cap = time_cap
+        self.rounds = rounds
+        self.rep_scheme = rep_scheme  # e.g. (21, 15, 9)
+        self.sets = sets              # (sets, reps) of a strength piece
+        self.movements = tuple(movements)
+        self.unparsed = tuple(unparsed)
+        self.complete = complete
+
+    def summary(self):
+        """One compact line per part, used instead of the raw description in LLM prompts."""
+        head = {"amrap": f"AMRAP {self.minutes} min", "emom": f"EMOM {self.minutes} min",
+                "for_time": "For time", "strength": "Strength"}.get(self.format, "Format unclear")
+        if self.rounds and self.rounds > 1:
+            head += f", {self.rounds} rounds"
+        if self.rep_scheme:
+            head += f", reps {'-'.join(map(str, self.rep_scheme))}"
+        if self.sets:
+            head += f", {self.sets[0]}x{self.sets[1]}"
+        if self.time_cap:
+            head += f", cap {self.time_cap} min"
+        lines = [f"{self.title}: {head}"]
+        lines += [f"- {m.describe()}" for m in self.movements]
+        lines += [f"- {line}" for line in self.unparsed]
+        return "\n".join(lines)
+
+
+def _match_movement(text):
+    lowered = text.lower()
+    for pattern, name in _ALIASES:
+        if pattern.search(lowered):
+            return name
+    return None
+
+
+def _parse_load(text):
+    match = _LOAD.search(text)
+    if match is None:
+        return None
+    if match.group(4):
+        return f"{match.group(4)}%"
+    unit = "lb" if match.group(3).lower() in ("lb", "lbs", "#") else "kg"
+    return f"{match.group(1)}/{match.group(2)} {unit}" if match.group(2) else f"{match.group(1)} {unit}"
+
+
+def _parse_amount(line):
+    """The number a movement line starts with and its unit.
+
+    Returns:
+        tuple: (amount, unit) with unit "reps", "cal" or "m" (distances converted to meters);
+            unit is None when the number has a unit that can't be used, e.g. "30 sec" or "2hrs"
+    """
+    match = _MOVEMENT.match(line)
+    if match is None or match.group(1) is None:
+        return None, "reps"
+    amount = float(match.group(1))
+    word = (match.group(3) or "").lower()
+    if word in DISTANCE_UNITS:
+        return amount * DISTANCE_UNITS[word], "m"
+    if word in CALORIE_UNITS:
+        return amount, "cal"
+    if word in UNKNOWN_UNITS or (word and not match.group(2) and word not in NOT_UNITS):
+        # A time, or letters stuck to the number that aren't a known unit
+        return amount, None
+    return amount, "reps"
+
+
+@lru_cache(maxsize=512)
+def parse_workout(title, description):
+    """Parses a workout's title and free-text description into a `ParsedWorkout` (cached per workout)."""
+    text = f"{title}\n{description}"
+    workout_format, minutes, sets = "unknown", None, None
+
+    amrap = _AMRAP.search(text)
+    emom = _EMOM.search(text)
+    if amrap:
+        workout_format, minutes = "amrap", int(amrap.group(1) or amrap.group(2))
+    elif emom:
+        groups = emom.groups()
+        if groups[1]:
+            workout_format, minutes = "emom", int(groups[1]) * int(groups[0] or 1)
+        elif groups[2]:
+            workout_format, minutes = "emom", int(groups[2])
+        else:
+            workout_format, minutes = "emom", int(groups[4]) * int(groups[5])
+    elif _FOR_TIME.search(text):
+        workout_format = "for_time"
+    elif _SETS_REPS.search(text) or _REP_MAX.search(text):
+        workout_format = "strength"
+        sets_reps = _SETS_REPS.search(text)
+        sets = (int(sets_reps.group(1)), int(sets_reps.group(2))) if sets_reps else (5, 1)
+
+    rounds_match = _ROUNDS.search(text)
+    rounds = int(rounds_match.group(1)) if rounds_match else 1
+    if rounds > 1 and workout_format == "unknown":
+        workout_format = "for_time"
+    cap_match = _TIME_CAP.search(text)
+    time_cap = int(cap_match.group(1) or cap_match.group(2)) if cap_match else None
+
+    rep_scheme = None
+    movements, unparsed = [], []
+    uncertain = False  # a line's amount is in a unit the estimate can't use
+    for line in str(description).replace("\r", "").split("\n"):
+        line = line.strip(" -•*\t")
+        if not line:
+            continue
+        scheme = _REP_SCHEME.match(line)
+        if scheme:
+            rep_scheme = tuple(int(n) for n in re.split(r"\s*-\s*", scheme.group(1)))
+            continue
+        name = _match_movement(line)
+        if name is None:
+            # Format lines ("20 min AMRAP", "5 rounds for time") and notes are not movements
+            if (_AMRAP.search(line) or _EMOM.search(line) or _FOR_TIME.search(line) or _ROUNDS.search(line)
+                    or _TIME_CAP.search(line) or _NOTE.match(line)):
+                continue
+            unparsed.append(line)
+            continue
+        amount, unit = _parse_amount(line)
+        reps = None if amount is None else round(amount)
+        if unit is None:
+            uncertain = True
+            unit = "reps"
+        elif unit == "m" and name not in DISTANCE_MOVEMENTS:
+            uncertain = True
+        if workout_format == "strength" and sets and reps is None:
+            reps = sets[1]
+        movements.append(Movement(name, reps, unit, _parse_load(line)))
+
+    complete = (workout_format != "unknown" and bool(movements) and not unparsed and not uncertain
+                and all(m.reps is not None or rep_scheme for m in movements))
+    return ParsedWorkout(title, workout_format, minutes, time_cap, rounds, rep_scheme, sets, movements,
+                         unparsed, complete)
+
+
+def _round_seconds(parsed, pace):
+    total = 0.0
+    for movement in parsed.movements:
+        per_unit = MOVEMENTS[movement.name][1]
+        if movement.unit == "cal":
+            total += (movement.reps or 0) * CALORIE_SECONDS * pace
+        elif movement.unit == "m":
+            total += (movement.reps or 0) / 100 * per_unit * pace
+        else:
+            reps = sum(parsed.rep_scheme) if parsed.rep_scheme and movement.reps is None else (movement.reps or 0)
+            total += reps * per_unit * pace
+    return total
+
+
+def estimate(parsed):
+    """Deterministic time estimate per level for a parsed workout.
+
+    Returns:
+        dict: level -> {"minutes": float, "rounds": float or None}, or None when the format or reps are unknown
+    """
+    if parsed.format == "unknown" or not parsed.movements and parsed.format != "strength":
+        return None
+    result = {}
+    for level, pace in LEVEL_PACE.items():
+        round_seconds = _round_seconds(parsed, pace)
+        if parsed.format == "amrap":
+            rounds = parsed.minutes * 60 / round_seconds if round_seconds else None
+            result[level] = {"minutes": float(parsed.minutes), "rounds": round(rounds, 1) if rounds else None}
+        elif parsed.format == "emom":
+            result[level] = {"minutes": float(parsed.minutes), "rounds": None}
+        elif parsed.format == "strength":
+            sets = parsed.sets[0] if parsed.sets else 5
+            result[level] = {"minutes": round(sets * STRENGTH_SET_SECONDS / 60, 1), "rounds": None}
+        else:
+            if not round_seconds:
+                # No reps known (e.g. everything on one line): better no estimate than "~0 min"
+                return None
+            minutes = round_seconds * parsed.rounds / 60
+            if parsed.time_cap:
+                minutes = min(minutes, parsed.time_cap)
+            result[level] = {"minutes": round(minutes, 1), "rounds": None}
+    return result
+
+
+PACING = {
+    "amrap": "Pick a pace you can hold for all {minutes} minutes; break sets before you have to, and keep transitions short.",
+    "emom": "Finish each minute's work in about 40 seconds to keep some rest; cut reps if the rest disappears.",
+    "for_time": "Start around 80% effort, split the biggest sets from the first round, and push the last round.",
+    "strength": "Warm up in several ramping sets, rest 2-3 minutes between working sets, and keep form ahead of load.",
+}
+
+
+def format_estimate(parsed_workouts):
+    """Renders the rule-based estimate and scaling for `parsed_workouts` as Markdown text.
+
+    The time estimate is only shown for fully parsed workouts; for the rest it would
+    leave out whatever the parser skipped, so the time is left to the LLM narrative.
+    """
+    parts = []
+    for parsed in parsed_workouts:
+        times = estimate(parsed) if parsed.complete else None
+        if times is None and not parsed.movements:
+            continue
+        lines = [f"*{parsed.title}*"]
+        if times is not None:
+            estimate_line = ", ".join(f"{level} ~{values['minutes']:g} min" for level, values in times.items())
+            if parsed.format == "amrap" and times["intermediate"]["rounds"]:
+                estimate_line = ", ".join(f"{level} ~{values['rounds']:g} rounds" for level, values in times.items())
+                estimate_line = f"{parsed.minutes} min; " + estimate_line
+            lines.append(f"⏱ {estimate_line}")
+        scaling = {m.name: MOVEMENTS[m.name][2] for m in parsed.movements}
+        lines += [f"↘️ {name}: {tip}" for name, tip in scaling.items()]
+        parts.append("\n".join(lines))
+    return "\n\n".join(parts)
+
+
+def format_pacing(parsed_workouts):
+    """Template pacing advice for fully parsed workouts, used instead of an LLM narrative."""
+    lines = []
+    for parsed in parsed_workouts:
+        advice = PACING.get(parsed.format)
+        if advice:
+            lines.append(f"🎯 {parsed.title}: {advice.format(minutes=parsed.minutes)}")
+    return "\n".join(lines)
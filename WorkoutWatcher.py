@@ -0,0 +1,139 @@
+import asyncio
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from BroadcastHandler import DEFAULT_GLOBAL_RATE, Broadcaster, TokenBucket
+from DeliveryLog import changed_dates, content_hash
+from Metrics import ERRORS, WATCH_POLLS
+
+DEFAULT_WATCH_INTERVAL = 10 * 60  # seconds between polls
+
+
+class WorkoutWatcher:
+    """Updates the day's delivered WOD messages once the coach publishes or changes a workout.
+
+    Each box is checked for every date that is today somewhere its messages
+    go: in the box's timezone and in each timezone its subscribers picked.
+    A check costs one uncached SugarWOD request for that day and the next,
+    and nothing for a date with no delivery logged. The
+    result is fingerprinted per date (`DeliveryLog.content_hash`) and
+    compared with what each chat's messages show. Only chats whose
+    fingerprint differs are updated. Their messages are edited in place, or
+    re-sent if Telegram no longer allows editing them. Chats that subscribed
+    after the delivery are left alone. Edits are idempotent, so an
+    interrupted update is simply repeated on the next poll.
+
+    Args:
+        box_registry (BoxRegistry): Boxes to watch.
+        telegram_handler (TelegramHandler): Renders and edits the messages.
+        delivery_log (SQLiteDeliveryLog): Messages delivered per box, day and chat.
+        rate (float, optional): Edits per second across all boxes.
+        inline_results (InlineResultCache, optional): Rebuilt when a poll sees a change.
+    """
+
+    def __init__(self, box_registry, telegram_handler, delivery_log, rate=DEFAULT_GLOBAL_RATE, inline_results=None):
+        self.box_registry = box_registry
+        self.telegram_handler = telegram_handler
+        self.delivery_log = delivery_log
+        self.rate = rate
+        self.inline_results = inline_results
+        self.polls = 0
+        self.idle = 0
+        self.updates = 0
+        self.upstream_requests = 0
+        self.messages_edited = 0
+
+    def register(self, job_queue, interval=DEFAULT_WATCH_INTERVAL):
+        """Polls every `interval` seconds on `job_queue`."""
+        job_queue.run_repeating(self._poll_job, interval=interval, first=interval, name="watch")
+
+    async def poll(self, date_str=None):
+        """Checks every box once, all boxes and dates in parallel.
+
+        Args:
+            date_str (str, optional): Day whose delivery to update (YYYY-MM-DD). Defaults to each of the box's
+                local dates (see `local_dates`).
+
+        Returns:
+            dict: {box slug: {date: broadcast stats, or None if there was nothing to update}}
+        """
+        global_bucket = TokenBucket(self.rate)
+        checks = [(box, day) for box in self.box_registry
+                  for day in ([date_str] if date_str else self.local_dates(box))]
+        results = await asyncio.gather(*(self._poll_box(box, day, global_bucket) for box, day in checks),
+                                       return_exceptions=True)
+        stats = {}
+        for (box, day), result in zip(checks, results):
+            if isinstance(result, Exception):
+                print(f"Error checking workouts for {box.name} on {day}: {result}")
+                ERRORS.inc(stage="watch")
+                result = None
+            stats.setdefault(box.slug, {})[day] = result
+        return stats
+
+    @staticmethod
+    def local_dates(box, now=None):
+        """Today's date (YYYY-MM-DD) in the box's timezone and in every timezone its subscribers picked."""
+        now = now or datetime.now(box.timezone)
+        zones = {box.timezone.key}
+        zones.update(tz for tz, _ in box.subscriber_store.preferences().values() if tz)
+        dates = set()
+        for name in zones:
+            try:
+                dates.add(now.astimezone(ZoneInfo(name)).strftime("%Y-%m-%d"))
+            except ZoneInfoNotFoundError:
+                continue
+        return sorted(dates)
+
+    async def _poll_box(self, box, date_str, global_bucket):
+        self.polls += 1
+        delivered = self.delivery_log.messages(box.slug, date_str)
+        if not delivered:
+            self.idle += 1
+            WATCH_POLLS.inc(result="idle")
+            return None
+
+        dates = [date_str, (datetime.strptime(date_str, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")]
+        self.upstream_requests += 1
+        by_date = await box.workout_api_handler.fetch_dates(dates, cache_results=True)
+        workouts = [w for date in dates for w in by_date[date]]
+        digest = content_hash(workouts, dates)
+        stale = {chat_id: ids for chat_id, (ids, shown) in delivered.items() if shown != digest}
+        if not stale:
+            WATCH_POLLS.inc(result="unchanged")
+            return None
+
+        changed = changed_dates(delivered[next(iter(stale))][1], digest, dates)
+        print(f"Workouts for {', '.join(changed)} changed at {box.name}; updating {len(stale)} chats")
+        today = datetime.strptime(date_str, "%Y-%m-%d").date()
+        if self.inline_results is not None and today == datetime.now(box.timezone).date():
+            await self.inline_results.refresh_box(box, workouts, today=today)
+        chunks = self.telegram_handler.render_workout_message(workouts, include_tomorrow_check=True, box_name=box.name,
+                                                              today=today)
+        broadcaster = Broadcaster(self.telegram_handler, box.subscriber_store, rate=min(box.broadcast_rate, self.rate),
+                                  global_bucket=global_bucket)
+        try:
+            stats = await broadcaster.broadcast(list(stale), chunks, edit_messages=stale)
+        finally:
+            self.delivery_log.record(box.slug, date_str, broadcaster.sent_messages, digest)
+            if broadcaster.removed_chats:
+                self.delivery_log.forget(box.slug, date_str, broadcaster.removed_chats)
+        self.updates += 1
+        self.messages_edited += stats["edits"]
+        WATCH_POLLS.inc(result="updated")
+        return stats
+
+    async def _poll_job(self, context):
+        try:
+            await self.poll()
+        except Exception as e:
+            print(f"Error watching workouts: {e}")
+
+    def stats(self):
+        """Polls, polls skipped for lack of a delivery, updates pushed, SugarWOD requests and edited messages."""
+        return {
+            "polls": self.polls,
+            "idle": self.idle,
+            "updates": self.updates,
+            "upstream_requests": self.upstream_requests,
+            "messages_edited": self.messages_edited,
+        }
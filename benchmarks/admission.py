@@ -0,0 +1,180 @@
+"""Cost and latency during a button-mashing burst, with and without admission control.
+
+Part 1 drives the real bot.py Application against the fakes. Each of
+`--hammer-chats` chats presses /analyze_workout and /get_wod `--presses`
+times, `--press-interval` seconds apart. Meanwhile each of `--other-chats`
+chats presses /get_wod once. It counts the messages sent and edited and
+the SugarWOD and OpenAI requests, and measures the other chats' reply
+latency. This runs once with every update handled, and once with the
+bot's CommandCoalescer.
+
+Part 2 starts `--llm-burst` analyses of distinct workouts at once. Each
+needs its own completion. They run through the bot's LLM gate
+(MAX_LLM_CONCURRENCY, MAX_LLM_QUEUE) and then without a limit. The
+report shows peak concurrent completions, requests turned away, and
+completion latency.
+
+Run from the repository root:
+    python -m benchmarks.admission --hammer-chats 10 --presses 5 --other-chats 20
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from telegram import Update
+
+from AdmissionControl import ConcurrencyGate, Overloaded
+from AnalysisCache import AnalysisCache
+from benchmarks.common import summarize, write_results
+from benchmarks.fake_servers import FakeOpenAI, FakeSugarWOD, FakeTelegram, make_command_update
+from benchmarks.suite import _reset_bot_caches
+from benchmarks.update_load import load_bot
+
+HAMMER_BASE = 50_000
+OTHER_BASE = 60_000
+
+
+async def run_burst(bot, telegram, sugarwod, openai_server, args, coalesce):
+    _reset_bot_caches(bot)
+    bot.command_coalescer.counts.clear()
+    application = bot.build_application(coalescer=bot.command_coalescer if coalesce else None)
+    for job in application.job_queue.jobs():
+        job.schedule_removal()
+
+    first_index = len(telegram.sent)
+    before = (sum(telegram.calls.values()), sugarwod.request_count, len(openai_server.requests))
+    other_arrivals = {}
+    update_id = iter(range(1, 1_000_000))
+    async with application:
+        await application.start()
+
+        async def put(chat_id, command):
+            data = make_command_update(next(update_id), chat_id, command)
+            await application.update_queue.put(Update.de_json(data, application.bot))
+
+        for press in range(args.presses):
+            for chat in range(args.hammer_chats):
+                await put(HAMMER_BASE + chat, "/analyze_workout")
+                await put(HAMMER_BASE + chat, "/get_wod")
+            if press == 0:
+                for chat in range(args.other_chats):
+                    other_arrivals[str(OTHER_BASE + chat)] = time.monotonic()
+                    await put(OTHER_BASE + chat, "/get_wod")
+            await asyncio.sleep(args.press_interval)
+
+        # Done once nothing is being handled or streamed and the fake has been quiet for a moment
+        deadline = time.monotonic() + 120
+        quiet_since, seen = time.monotonic(), len(telegram.sent)
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            if len(telegram.sent) != seen:
+                quiet_since, seen = time.monotonic(), len(telegram.sent)
+            busy = application.update_processor.in_flight or bot.openai_handler._streams
+            if not busy and application.update_queue.empty() and time.monotonic() - quiet_since > 0.5:
+                break
+        await application.stop()
+
+    first_reply = {}
+    for chat_id, _, method, sent_at in telegram.sent[first_index:]:
+        if chat_id in other_arrivals and method == "sendMessage":
+            first_reply.setdefault(chat_id, sent_at)
+    latencies = [first_reply[chat] - arrived for chat, arrived in other_arrivals.items() if chat in first_reply]
+    return {
+        "telegram_calls": sum(telegram.calls.values()) - before[0],
+        "sugarwod_requests": sugarwod.request_count - before[1],
+        "openai_requests": len(openai_server.requests) - before[2],
+        "other_chats_get_wod": summarize(latencies),
+        "coalescing": bot.command_coalescer.stats() if coalesce else None,
+    }
+
+
+def distinct_workout(i):
+    # Free text the parser can't fully read, so every one needs its own completion
+    return [{"attributes": {"title": f"Coach's choice {i}", "scheduled_date": "2024-01-01T00:00:00.000Z",
+                            "description": f"Partner chipper variation {i}: flow as you feel, chat with your partner"}}]
+
+
+async def run_llm_burst(bot, args, gate):
+    bot.openai_handler.cache = AnalysisCache()
+    active = peak = 0
+    latencies, rejected = [], 0
+
+    async def one(i):
+        nonlocal active, peak, rejected
+        start = time.monotonic()
+        workouts = distinct_workout(i)
+        slot = gate.slot() if gate is not None else contextlib.nullcontext()
+        try:
+            async with slot:
+                active += 1
+                peak = max(peak, active)
+                try:
+                    async for _ in bot.openai_handler.stream_analysis(workouts):
+                        pass
+                finally:
+                    active -= 1
+        except Overloaded:
+            rejected += 1
+            return
+        latencies.append(time.monotonic() - start)
+
+    await asyncio.gather(*(one(i) for i in range(args.llm_burst)))
+    return {"peak_concurrent": peak, "rejected": rejected, "completed": summarize(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hammer-chats", type=int, default=10)
+    parser.add_argument("--presses", type=int, default=5, help="presses of each command per hammering chat")
+    parser.add_argument("--press-interval", type=float, default=0.1)
+    parser.add_argument("--other-chats", type=int, default=20)
+    parser.add_argument("--llm-burst", type=int, default=40, help="distinct analyses started at once in part 2")
+    parser.add_argument("--openai-latency", type=float, default=0.3)
+    parser.add_argument("--output", help="write JSON results to this path")
+    args = parser.parse_args()
+
+    os.environ["ANALYSIS_LLM"] = "always"
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, FakeTelegram(latency=0.02) as telegram, \
+            FakeSugarWOD(latency=0.05) as sugarwod, \
+            FakeOpenAI(latency=args.openai_latency, completion_tokens=60, token_interval=0.01) as openai_server:
+        with contextlib.redirect_stdout(io.StringIO()):
+            bot = load_bot(telegram, sugarwod, tmp, openai_server)
+
+        async def run_all():
+            for name, coalesce in (("every update", False), ("coalesced", True)):
+                results[name] = await run_burst(bot, telegram, sugarwod, openai_server, args, coalesce)
+            results["llm gate"] = await run_llm_burst(bot, args, ConcurrencyGate(bot.MAX_LLM_CONCURRENCY,
+                                                                                 bot.MAX_LLM_QUEUE))
+            results["no llm gate"] = await run_llm_burst(bot, args, None)
+            await bot.box_registry.aclose()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(run_all())
+
+    print(f"Part 1: {args.hammer_chats} chats x {args.presses} presses of /analyze_workout and /get_wod, "
+          f"{args.other_chats} other chats press /get_wod once")
+    for name in ("every update", "coalesced"):
+        r = results[name]
+        print(f"{name:<13} Telegram calls {r['telegram_calls']:>4}, SugarWOD {r['sugarwod_requests']:>2}, "
+              f"OpenAI {r['openai_requests']:>2}; other chats' /get_wod p50 {r['other_chats_get_wod']['p50_ms']:.0f}ms "
+              f"p99 {r['other_chats_get_wod']['p99_ms']:.0f}ms")
+    print(f"coalescing: {results['coalesced']['coalescing']}")
+    print(f"Part 2: {args.llm_burst} distinct analyses at once, gate {bot.MAX_LLM_CONCURRENCY} running "
+          f"+ {bot.MAX_LLM_QUEUE} queued")
+    for name in ("llm gate", "no llm gate"):
+        r = results[name]
+        print(f"{name:<13} peak concurrent completions {r['peak_concurrent']:>3}, turned away {r['rejected']:>3}, "
+              f"completed {r['completed']['count']:>3}: p50 {r['completed']['p50_ms']:.0f}ms "
+              f"p99 {r['completed']['p99_ms']:.0f}ms")
+
+    if args.output:
+        write_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Repeat /analyze_workout latency with the analysis cache, against a fake OpenAI endpoint.
+
+The first request pays the (simulated) completion latency; every repeat of
+the same workout is answered from the cache.
+
+Run from the repository root:
+    python -m benchmarks.analysis_cache --requests 50 --latency 2.0
+"""
+import argparse
+import contextlib
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+from AnalysisCache import AnalysisCache
+from OpenAIHandler import OpenAIHandler
+from benchmarks.common import print_summary, summarize, write_results
+from benchmarks.fake_servers import FakeOpenAI
+
+WORKOUT = [{"attributes": {"title": "Test Workout",
+                           "description": "20 min AMRAP\n10 burpees\n20 air squats\n30 double unders"}}]
+
+
+def _timed(handler):
+    start = time.perf_counter()
+    handler.analyze_workout(WORKOUT)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrent", type=int, default=10, help="simultaneous presses on a cold cache")
+    parser.add_argument("--latency", type=float, default=1.0, help="fake completion latency in seconds")
+    parser.add_argument("--output", help="write JSON results to this path")
+    args = parser.parse_args()
+
+    with FakeOpenAI(latency=args.latency) as server, contextlib.redirect_stdout(io.StringIO()):
+        handler = OpenAIHandler(cache=AnalysisCache(), llm_mode="always")
+        openai.api_base = server.api_url
+        openai.api_key = "sk-fake"
+        # Cold cache: simultaneous presses share one completion
+        with ThreadPoolExecutor(args.concurrent) as pool:
+            cold = list(pool.map(lambda _: _timed(handler), range(args.concurrent)))
+        warm = [_timed(handler) for _ in range(args.requests)]
+        completions = len(server.requests)
+
+    print(f"completion latency {args.latency * 1000:.0f}ms, {completions} completion(s) for "
+          f"{args.concurrent + args.requests} requests")
+    print_summary("cold (concurrent)", cold)
+    print_summary("warm (cached)", warm)
+    print(f"cache stats: {handler.cache.stats()}")
+
+    if args.output:
+        write_results(args.output, {"cold": summarize(cold), "warm": summarize(warm),
+                                    "completions": completions, "cache_stats": handler.cache.stats()})
+
+
+if __name__ == "__main__":
+    main()
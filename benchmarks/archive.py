@@ -0,0 +1,129 @@
+"""Backfill cost and query latency of the local workout archive.
+
+Backfills `--days` of history from a fake SugarWOD. The run is interrupted
+halfway and then resumed, to check that no day is fetched twice. A second
+sync must not fetch the old days again. Then /wod, /search and /last
+lookups are timed against the archive and compared with one live request.
+
+Run from the repository root:
+    python -m benchmarks.archive --days 730
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from WorkoutAPI_Handler import AsyncWorkoutAPI_Handler
+from WorkoutArchive import ArchiveSync, WorkoutArchive
+from benchmarks.common import print_summary, summarize, write_results
+from benchmarks.fake_servers import FakeSugarWOD
+
+
+class _Interrupted(Exception):
+    pass
+
+
+async def backfill(api_url, archive, since, interrupt_after=None, chunk_days=14):
+    handler = AsyncWorkoutAPI_Handler(api_url, "fake-key")
+    sync = ArchiveSync(archive, handler, "box", chunk_days=chunk_days, min_interval=0)
+    if interrupt_after is not None:
+        fetch = sync._fetch
+
+        async def fetch_then_fail(dates):
+            if sync.requests >= interrupt_after:
+                raise _Interrupted()
+            return await fetch(dates)
+        sync._fetch = fetch_then_fail
+    try:
+        return await sync.backfill(since)
+    except _Interrupted:
+        return None
+    finally:
+        await handler.aclose()
+
+
+async def live_lookups(api_url, dates):
+    handler = AsyncWorkoutAPI_Handler(api_url, "fake-key")
+    samples = []
+    for date in dates:
+        start = time.perf_counter()
+        await handler.fetch_dates([date])
+        samples.append(time.perf_counter() - start)
+    await handler.aclose()
+    return samples
+
+
+def _timed(fn, args_list):
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=730, help="days of history to backfill")
+    parser.add_argument("--lookups", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.1, help="fake SugarWOD response time in seconds")
+    parser.add_argument("--output", help="write JSON results to this path")
+    args = parser.parse_args()
+
+    today = datetime.now()
+    since = (today - timedelta(days=args.days)).strftime("%Y-%m-%d")
+    with tempfile.TemporaryDirectory() as tmp, FakeSugarWOD(latency=args.latency, description_size=300) as server:
+        archive = WorkoutArchive(os.path.join(tmp, "archive.db"))
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            total_requests = (args.days + 13) // 14
+            asyncio.run(backfill(server.api_url, archive, since, interrupt_after=total_requests // 2))
+            first_dates = len(server.requested_dates)
+            resumed = asyncio.run(backfill(server.api_url, archive, since))
+            backfill_s = time.perf_counter() - start
+            fetched_dates = len(server.requested_dates)
+            # Nothing left to do: the old days are stored and the cursor is at `since`
+            again = asyncio.run(backfill(server.api_url, archive, since))
+
+        dates = [(today - timedelta(days=random.randint(1, args.days))).strftime("%Y-%m-%d") for _ in range(args.lookups)]
+        words = ["burpees", "air squats", "double unders", "amrap", "workout 2"]
+        titles = [f"Workout 1 for {d}" for d in dates]
+        day_samples = _timed(archive.get_day, [("box", d) for d in dates])
+        search_samples = _timed(archive.search, [("box", random.choice(words)) for _ in dates])
+        last_samples = _timed(archive.last_time, [("box", t) for t in titles])
+        with contextlib.redirect_stdout(io.StringIO()):
+            live_samples = asyncio.run(live_lookups(server.api_url, dates[:20]))
+        stats = archive.stats()
+        archive.close()
+        db_bytes = sum(os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp))
+
+    print(f"backfill of {args.days} days: {server.request_count - 20} requests, {fetched_dates} dates fetched "
+          f"({first_dates} before the interruption), {backfill_s:.1f}s; resumed run: {resumed}")
+    print(f"re-run after completion: {again}")
+    print(f"archive: {stats}, {db_bytes / 1024:.0f} KiB on disk")
+    print_summary("/wod from archive", day_samples)
+    print_summary("/search from archive", search_samples)
+    print_summary("/last from archive", last_samples)
+    print_summary("live SugarWOD lookup", live_samples)
+
+    if args.output:
+        write_results(args.output, {
+            "days": args.days,
+            "dates_fetched": fetched_dates,
+            "resumed_run": resumed,
+            "rerun": again,
+            "archive": stats,
+            "archive_get_day": summarize(day_samples),
+            "archive_search": summarize(search_samples),
+            "archive_last_time": summarize(last_samples),
+            "live_lookup": summarize(live_samples),
+        })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Batched pre-analysis of the week vs one OpenAI request per day.
+
+Analyzes `--days` days of programming against a local fake OpenAI server
+twice: once with a request per day (the on-demand path, at the same
+concurrency) and once through BatchAnalyzer. It reports requests, prompt
+tokens (words, as the fake server counts them) and wall time per day. It
+then times /analyze_workout for every day after the batch run, which must
+be served from the cache without any new request. `--drop-rate` makes the
+fake leave days out of batch replies to exercise the retries.
+
+Run from the repository root:
+    python -m benchmarks.batch_analysis --days 28 --drop-rate 0.1
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+from datetime import datetime, timedelta
+
+import openai
+
+from AnalysisCache import AnalysisCache
+from BatchAnalyzer import DEFAULT_CONCURRENCY, BatchAnalyzer
+from OpenAIHandler import OpenAIHandler
+from benchmarks.common import print_summary, summarize, write_results
+from benchmarks.fake_servers import FakeOpenAI
+from benchmarks.rule_based import make_workouts
+
+
+def make_week(days):
+    start = datetime.now()
+    return {(start + timedelta(days=i)).strftime("%Y-%m-%d"): workouts
+            for i, workouts in enumerate(make_workouts(days))}
+
+
+async def per_day(handler, by_date, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def analyze(workouts):
+        async with semaphore:
+            await handler.analyze_workout_async(workouts)
+    await asyncio.gather(*(analyze(workouts) for workouts in by_date.values()))
+
+
+async def batched(analyzer, by_date):
+    analyzed = await analyzer.analyze_days(by_date)
+    samples = []
+    for workouts in by_date.values():
+        start = time.perf_counter()
+        await analyzer.openai_handler.analyze_workout_async(workouts)
+        samples.append(time.perf_counter() - start)
+    return analyzed, samples
+
+
+def run_against(server, fn):
+    requests_before, tokens_before = len(server.requests), server.prompt_tokens
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = asyncio.run(fn())
+    return result, time.perf_counter() - start, len(server.requests) - requests_before, server.prompt_tokens - tokens_before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=28)
+    parser.add_argument("--latency", type=float, default=0.3, help="fake OpenAI time to first token in seconds")
+    parser.add_argument("--token-interval", type=float, default=0.002)
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="chance a day is missing from a batch reply")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--analysis-llm", choices=("auto", "always"), default="always")
+    parser.add_argument("--output", help="write JSON results to this path")
+    args = parser.parse_args()
+
+    by_date = make_week(args.days)
+    with FakeOpenAI(latency=args.latency, token_interval=args.token_interval, drop_rate=args.drop_rate) as server:
+        separate = OpenAIHandler(cache=AnalysisCache(), llm_mode=args.analysis_llm)
+        handler = OpenAIHandler(cache=AnalysisCache(), llm_mode=args.analysis_llm)
+        # After the handlers, which load the key from the environment
+        openai.api_base = server.api_url
+        openai.api_key = "sk-fake"
+        _, separate_s, separate_requests, separate_tokens = run_against(
+            server, lambda: per_day(separate, by_date, args.concurrency))
+
+        analyzer = BatchAnalyzer(handler, concurrency=args.concurrency, retry_delay=0.05)
+        (analyzed, served), batch_s, batch_requests, batch_tokens = run_against(
+            server, lambda: batched(analyzer, by_date))
+        serve_requests = len(server.requests) - (separate_requests + batch_requests)
+    stats = analyzer.stats()
+    days_needing_llm = analyzed + stats["days_failed"]
+    # Serving after the batch run is cache hits only; its time is not part of the batch
+    batch_s -= sum(served)
+
+    print(f"{args.days} days, {days_needing_llm} needing the LLM")
+    print(f"separate: {separate_requests} requests, {separate_tokens} prompt tokens, {separate_s:.2f}s "
+          f"({1000 * separate_s / max(1, days_needing_llm):.0f}ms per day)")
+    print(f"batched:  {batch_requests} requests, {batch_tokens} prompt tokens, {batch_s:.2f}s "
+          f"({1000 * batch_s / max(1, days_needing_llm):.0f}ms per day); "
+          f"{stats['days_retried']} day retries, {stats['days_failed']} left to on-demand")
+    print(f"prompt tokens {100 * (1 - batch_tokens / max(1, separate_tokens)):.0f}% fewer, "
+          f"wall time {100 * (1 - batch_s / max(1e-9, separate_s)):.0f}% less")
+    print_summary("/analyze_workout after batch", served)
+    print(f"requests while serving after batch: {serve_requests} ({stats['days_failed']} expected)")
+
+    if args.output:
+        write_results(args.output, {
+            "days": args.days,
+            "days_needing_llm": days_needing_llm,
+            "separate": {"requests": separate_requests, "prompt_tokens": separate_tokens, "seconds": round(separate_s, 3)},
+            "batched": {"requests": batch_requests, "prompt_tokens": batch_tokens, "seconds": round(batch_s, 3)},
+            "batch_stats": stats,
+            "serve_after_batch": summarize(served),
+            "requests_while_serving": serve_requests,
+        })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Throughput of the daily WOD broadcast against a local fake Bot API.
+
+The fake enforces a global messages/second limit (answering 429 with
+retry_after when exceeded) and marks a fraction of chats as having blocked
+the bot. Total delivery time for larger audiences is projected from the
+measured throughput.
+
+Run from the repository root:
+    python -m benchmarks.broadcast --subscribers 1000 --rate 30
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import tempfile
+
+from BroadcastHandler import Broadcaster
+from SubscriberStore import SQLiteSubscriberStore
+from TelegramHandler import TelegramHandler
+from benchmarks.common import write_results
+from benchmarks.fake_servers import FakeTelegram
+
+
+async def run(api_url, store, rate, concurrency, checkpoint_dir, broadcast_id):
+    telegram_handler = TelegramHandler("123:fake", base_url=api_url, connection_pool_size=concurrency)
+    broadcaster = Broadcaster(telegram_handler, store, rate=rate, concurrency=concurrency,
+                              checkpoint_dir=checkpoint_dir)
+    return await broadcaster.broadcast(store.all(), "🏋️ *Today's WOD*\n20 min AMRAP", broadcast_id=broadcast_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=30, help="global msg/s, enforced by the fake and paced by the engine")
+    parser.add_argument("--concurrency", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake Bot API response time in seconds")
+    parser.add_argument("--blocked", type=float, default=0.01, help="fraction of chats that blocked the bot")
+    parser.add_argument("--output", help="write JSON results to this path")
+    args = parser.parse_args()
+
+    chat_ids = [str(1_000_000_000 + i) for i in range(args.subscribers)]
+    blocked = random.sample(chat_ids, int(len(chat_ids) * args.blocked))
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            FakeTelegram(latency=args.latency, rate_limit=int(args.rate), blocked_chats=blocked) as server:
+        store = SQLiteSubscriberStore(os.path.join(tmp, "subscribers.db"))
+        for chat_id in chat_ids:
+            store.subscribe(chat_id)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = asyncio.run(run(server.api_url, store, args.rate, args.concurrency, tmp, "bench"))
+            # Re-running the same broadcast must not send anything again
+            resumed = asyncio.run(run(server.api_url, store, args.rate, args.concurrency, tmp, "bench"))
+        remaining = len(store)
+        store.close()
+        rate_limited = server.rate_limited
+
+    throughput = stats["sent"] / stats["elapsed"] if stats["elapsed"] else 0.0
+    print(f"{args.subscribers} subscribers at {args.rate:g} msg/s, {len(blocked)} blocked")
+    print(f"first run:  {stats}")
+    print(f"re-run:     {resumed}")
+    print(f"throughput: {throughput:.1f} msg/s, 429 responses: {rate_limited}, subscribers left: {remaining}")
+    for audience in (10_000, 100_000):
+        print(f"projected delivery time for {audience}: {audience / throughput / 60:.1f} min" if throughput else "")
+
+    if args.output:
+        write_results(args.output, {
+            "subscribers": args.subscribers,
+            "rate": args.rate,
+            "first_run": stats,
+            "resumed_run": resumed,
+            "throughput_msg_s": round(throughput, 2),
+            "rate_limited_responses": rate_limited,
+        })
+
+
+if __name__ == "__main__":
+    main()
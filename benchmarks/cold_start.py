@@ -0,0 +1,114 @@
+"""Wall time of a complete `cli.py deliver` run in a fresh interpreter, against local fakes.
+
+Each run is a new `python cli.py deliver` process, like a scheduled
+workflow. It delivers to `--subscribers` chats through the fake Bot API,
+with workouts from the fake SugarWOD. The first run starts with an empty
+cache directory and later runs reuse it. The process's own timing line
+(imports, clients, run) is collected. One extra run under
+`python -X importtime` lists the slowest top-level imports. The median
+wall time is checked against `--target`.
+
+Run from the repository root:
+    python -m benchmarks.cold_start --runs 5 --target 1.5
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from SubscriberStore import SQLiteSubscriberStore
+from benchmarks.common import write_results
+from benchmarks.fake_servers import FakeSugarWOD, FakeTelegram
+
+TIMINGS_LINE = re.compile(r"⏱ deliver: (.*), total (\d+)ms")
+
+
+def run_deliver(env, importtime=False):
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["cli.py", "deliver"]
+    start = time.perf_counter()
+    completed = subprocess.run(command, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f"cli.py deliver failed:\n{completed.stdout}\n{completed.stderr}")
+    match = TIMINGS_LINE.search(completed.stdout)
+    phases = {}
+    if match:
+        for part in match.group(1).split(", "):
+            name, ms = part.rsplit(" ", 1)
+            phases[name] = int(ms[:-2])
+        phases["total"] = int(match.group(2))
+    return wall, phases, completed.stderr
+
+
+def slowest_imports(importtime_output, count=8):
+    """Top-level modules (nesting level 1) by cumulative import time, in ms."""
+    imports = []
+    for line in importtime_output.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].startswith(" ") and not parts[2].startswith("  "):
+            try:
+                imports.append((parts[2].strip(), int(parts[1]) / 1000))
+            except ValueError:
+                continue
+    return sorted(imports, key=lambda item: -item[1])[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--subscribers", type=int, default=50)
+    parser.add_argument("--target", type=float, default=1.5, help="seconds a complete delivery run may take")
+    parser.add_argument("--output", help="write JSON results to this path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, FakeTelegram(latency=0.01) as telegram, \
+            FakeSugarWOD(latency=0.05) as sugarwod:
+        store = SQLiteSubscriberStore(os.path.join(tmp, "subscribers.db"))
+        for i in range(args.subscribers):
+            store.subscribe(str(40_000_000 + i))
+        store.close()
+        env = {key: value for key, value in os.environ.items() if key not in ("TELEGRAM_CHAT_ID", "BOXES_FILE")}
+        env.update({
+            "TELEGRAM_BOT_TOKEN": "123:fake",
+            "SUGARWOD_API_KEY": "bench-key",
+            "SUGARWOD_API_URL": sugarwod.api_url,
+            "TELEGRAM_API_BASE_URL": telegram.api_url,
+            "TELEGRAM_CHANNEL_ID": "@bench_channel",
+            "SUBSCRIBERS_DB": os.path.join(tmp, "subscribers.db"),
+            "CACHE_DIR": os.path.join(tmp, "cache"),
+            "BROADCAST_CHECKPOINT_DIR": os.path.join(tmp, "checkpoints"),
+            "BROADCAST_RATE": "1000",
+        })
+
+        runs = []
+        for i in range(args.runs):
+            env["BROADCAST_ID"] = f"cold-start-{i}"
+            sent_before, fetches_before = len(telegram.sent), sugarwod.request_count
+            wall, phases, _ = run_deliver(env)
+            runs.append({"wall": wall, "phases": phases, "messages": len(telegram.sent) - sent_before,
+                         "sugarwod_requests": sugarwod.request_count - fetches_before})
+        env["BROADCAST_ID"] = "cold-start-importtime"
+        _, _, importtime_output = run_deliver(env, importtime=True)
+
+    for i, run in enumerate(runs):
+        label = "cold cache" if i == 0 else "warm cache"
+        phases = ", ".join(f"{name} {ms}ms" for name, ms in run["phases"].items())
+        print(f"run {i + 1} ({label}): {run['wall'] * 1000:.0f}ms wall; {phases}; "
+              f"{run['messages']} messages, {run['sugarwod_requests']} SugarWOD requests")
+    print("slowest imports: " + ", ".join(f"{name} {ms:.0f}ms" for name, ms in slowest_imports(importtime_output)))
+    median = statistics.median(run["wall"] for run in runs)
+    verdict = "within" if median <= args.target else "OVER"
+    print(f"median wall time {median:.2f}s, {verdict} the {args.target:.2f}s target")
+
+    if args.output:
+        write_results(args.output, {"runs": runs, "median_wall_s": round(median, 3), "target_s": args.target,
+                                    "slowest_imports": slowest_imports(importtime_output)})
+    return 0 if median <= args.target else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
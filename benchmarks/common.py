@@ -0,0 +1,38 @@
+"""Small helpers shared by the benchmark scripts."""
+import json
+import math
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of `samples` (pct in 0-100)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(samples):
+    """Returns count/mean/p50/p95/p99/max of a list of latencies in seconds, reported in ms."""
+    if not samples:
+        return {"count": 0, "mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+    return {
+        "count": len(samples),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 2),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 95) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        "max_ms": round(max(samples) * 1000, 2),
+    }
+
+
+def print_summary(label, samples):
+    s = summarize(samples)
+    print(f"{label:<28} n={s['count']:<6} p50={s['p50_ms']:>8.2f}ms  p95={s['p95_ms']:>8.2f}ms  "
+          f"p99={s['p99_ms']:>8.2f}ms  max={s['max_ms']:>8.2f}ms")
+
+
+def write_results(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"Results written to {path}")
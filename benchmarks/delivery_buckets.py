@@ -0,0 +1,211 @@
+"""Scheduling overhead and fan-out cost of time-bucketed delivery vs one timer per subscriber.
+
+Subscribers are spread over `--timezones` and `--times`; `--custom-share` of
+them pick their own timezone and time, and the rest keep the box default
+(07:00 Israel time).
+
+Part 1 runs a simulated day of scheduler ticks, every `--tick` seconds,
+for `--subscribers` subscribers. Nothing is sent. It compares
+`BucketScheduler`, which has one heap entry per (timezone, time) bucket,
+with a heap that has one timer per subscriber. It reports heap entries,
+heap operations and the CPU time spent building and ticking. Catch-up is
+off in both parts, so each bucket is delivered once in the simulated day.
+
+Part 2 delivers one simulated day against the fakes to
+`--fanout-subscribers` subscribers. Each due bucket is one batched
+broadcast; the per-subscriber baseline makes one delivery per chat. It
+counts broadcasts, renders, SugarWOD requests and messages, and measures
+wall time.
+
+Run from the repository root:
+    python -m benchmarks.delivery_buckets --subscribers 100000 --fanout-subscribers 2000
+"""
+import argparse
+import asyncio
+import contextlib
+import heapq
+import io
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from BoxRegistry import BoxRegistry
+from BroadcastHandler import TokenBucket, deliver_workouts
+from DeliveryBuckets import BucketScheduler, next_occurrence
+from TelegramHandler import TelegramHandler
+from WorkoutCache import WorkoutCache
+from benchmarks.common import write_results
+from benchmarks.fake_servers import FakeSugarWOD, FakeTelegram
+
+DEFAULT_TIMEZONES = "Asia/Jerusalem,Europe/London,Europe/Berlin,America/New_York,America/Los_Angeles,Asia/Tokyo," \
+                    "Australia/Sydney,Asia/Kolkata"
+DEFAULT_TIMES = "06:00,06:30,07:00"
+DAY_START = datetime(2026, 10, 18, tzinfo=timezone.utc)
+
+
+def _registry(sugarwod, tmp, name, subscribers, timezones, times, custom_share, seed=1):
+    registry = BoxRegistry.from_config([{
+        "name": "Bench Box", "slug": "bench", "api_key": "bench-key", "api_url": sugarwod.api_url,
+        "subscribers_db": os.path.join(tmp, f"{name}.db"), "broadcast_rate": 1000,
+    }], cache=WorkoutCache())
+    store = registry.default.subscriber_store
+    rng = random.Random(seed)
+    for n in range(subscribers):
+        chat_id = str(40_000_000 + n)
+        store.subscribe(chat_id)
+        if rng.random() < custom_share:
+            store.set_preferences(chat_id, rng.choice(timezones), rng.choice(times))
+    return registry
+
+
+class DryRunBuckets(BucketScheduler):
+    """Counts who each due bucket would reach instead of sending."""
+
+    async def _fire(self, key, due_at):
+        self.fired += 1
+        return len(self._buckets.get(key, ()))
+
+
+class PerSubscriberTimers:
+    """The baseline: one heap entry per subscriber, re-armed after each delivery."""
+
+    def __init__(self, box, default_times):
+        self.box = box
+        self.default_times = default_times
+        self.heap = []
+        self.operations = 0
+
+    def rebuild(self, now):
+        store = self.box.subscriber_store
+        preferences = store.preferences()
+        for chat_id in store.all():
+            tz_name, hhmm = preferences.get(chat_id, (None, None))
+            tz = ZoneInfo(tz_name) if tz_name else self.box.timezone
+            for at in [hhmm] if hhmm else self.default_times:
+                heapq.heappush(self.heap, (next_occurrence(tz, at, now).timestamp(), chat_id, tz.key, at))
+                self.operations += 1
+
+    async def tick(self, now):
+        fired = 0
+        while self.heap and self.heap[0][0] <= now.timestamp():
+            due, chat_id, tz_name, at = heapq.heappop(self.heap)
+            due_at = datetime.fromtimestamp(due, timezone.utc)
+            heapq.heappush(self.heap, (next_occurrence(ZoneInfo(tz_name), at, due_at).timestamp(), chat_id,
+                                       tz_name, at))
+            self.operations += 2
+            fired += 1
+        return fired
+
+
+async def simulate_day(scheduler, tick):
+    """Ticks through one day; returns CPU seconds spent in ticks."""
+    spent = 0.0
+    now = DAY_START
+    while now < DAY_START + timedelta(days=1):
+        start = time.process_time()
+        await scheduler.tick(now)
+        spent += time.process_time() - start
+        now += timedelta(seconds=tick)
+    return spent
+
+
+async def run_overhead(sugarwod, tmp, args, timezones, times):
+    registry = _registry(sugarwod, tmp, "overhead", args.subscribers, timezones, times, args.custom_share)
+    results = {}
+    for name, scheduler in (("buckets", DryRunBuckets(registry, None, ["07:00"], catch_up_window=0)),
+                            ("per subscriber", PerSubscriberTimers(registry.default, ["07:00"]))):
+        start = time.process_time()
+        scheduler.rebuild(DAY_START)
+        build = time.process_time() - start
+        entries = len(scheduler._heap if name == "buckets" else scheduler.heap)
+        ticking = await simulate_day(scheduler, args.tick)
+        results[name] = {
+            "heap_entries": entries,
+            "build_ms": round(build * 1000, 1),
+            "day_of_ticks_ms": round(ticking * 1000, 1),
+            # Buckets: one pop and one push per bucket delivery; per subscriber: per chat delivery
+            "heap_operations": (scheduler.fired * 2 + entries) if name == "buckets" else scheduler.operations,
+        }
+    await registry.aclose()
+    return results
+
+
+async def run_fanout(sugarwod, telegram, tmp, args, timezones, times, mode):
+    registry = _registry(sugarwod, tmp, f"fanout-{mode}", args.fanout_subscribers, timezones, times,
+                         args.custom_share)
+    box = registry.default
+    telegram_handler = TelegramHandler("123:fake", base_url=telegram.api_url, box_name=box.name)
+    renderer = telegram_handler.renderer_for(box.name)
+    sends_before, sugarwod_before = telegram.calls["sendMessage"], sugarwod.request_count
+    broadcasts = 0
+    start = time.monotonic()
+    if mode == "buckets":
+        scheduler = BucketScheduler(registry, telegram_handler, ["07:00"], global_rate=1000, catch_up_window=0)
+        scheduler.rebuild(DAY_START)
+        now = DAY_START
+        while now < DAY_START + timedelta(days=1):
+            broadcasts += len(await scheduler.tick(now))
+            now += timedelta(seconds=args.tick)
+    else:
+        timers = PerSubscriberTimers(box, ["07:00"])
+        timers.rebuild(DAY_START)
+        bucket = TokenBucket(1000)
+        while timers.heap and timers.heap[0][0] < (DAY_START + timedelta(days=1)).timestamp():
+            due, chat_id, tz_name, at = heapq.heappop(timers.heap)
+            local_date = datetime.fromtimestamp(due, ZoneInfo(tz_name)).date()
+            workouts = await box.workout_api_handler.get_workouts_for_date(local_date.strftime("%Y-%m-%d"))
+            await deliver_workouts(telegram_handler, workouts, box.subscriber_store, rate=1000, box_name=box.name,
+                                   global_bucket=bucket, chat_ids=[chat_id], today=local_date)
+            broadcasts += 1
+    elapsed = time.monotonic() - start
+    await registry.aclose()
+    return {
+        "broadcasts": broadcasts,
+        "renders": renderer.misses,
+        "render_cache_hits": renderer.hits,
+        "sugarwod_requests": sugarwod.request_count - sugarwod_before,
+        "messages": telegram.calls["sendMessage"] - sends_before,
+        "wall_s": round(elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subscribers", type=int, default=100_000)
+    parser.add_argument("--fanout-subscribers", type=int, default=2000)
+    parser.add_argument("--custom-share", type=float, default=0.3, help="share of subscribers with their own schedule")
+    parser.add_argument("--timezones", default=DEFAULT_TIMEZONES)
+    parser.add_argument("--times", default=DEFAULT_TIMES)
+    parser.add_argument("--tick", type=int, default=30, help="seconds between scheduler ticks")
+    parser.add_argument("--output", help="write JSON results to this path")
+    args = parser.parse_args()
+    timezones, times = args.timezones.split(","), args.times.split(",")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, FakeTelegram(latency=0.002) as telegram, \
+            FakeSugarWOD(latency=0.05) as sugarwod:
+        with contextlib.redirect_stdout(io.StringIO()):
+            results["overhead"] = asyncio.run(run_overhead(sugarwod, tmp, args, timezones, times))
+            results["fanout"] = {mode: asyncio.run(run_fanout(sugarwod, telegram, tmp, args, timezones, times, mode))
+                                 for mode in ("buckets", "per subscriber")}
+
+    print(f"Part 1: {args.subscribers} subscribers, {args.custom_share:.0%} over {len(timezones)} timezones x "
+          f"{len(times)} times, a day of {args.tick}s ticks (nothing sent)")
+    for name, r in results["overhead"].items():
+        print(f"{name:<15} heap entries {r['heap_entries']:>7}, heap operations {r['heap_operations']:>7}, "
+              f"build {r['build_ms']:>7.1f}ms, day of ticks {r['day_of_ticks_ms']:>7.1f}ms")
+    print(f"Part 2: {args.fanout_subscribers} subscribers delivered over one simulated day")
+    for name, r in results["fanout"].items():
+        print(f"{name:<15} broadcasts {r['broadcasts']:>5}, renders {r['renders']:>3} "
+              f"(cache hits {r['render_cache_hits']:>5}), SugarWOD requests {r['sugarwod_requests']:>3}, "
+              f"messages {r['messages']:>5}, wall {r['wall_s']:.2f}s")
+
+    if args.output:
+        write_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
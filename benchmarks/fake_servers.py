@@ -0,0 +1,403 @@
+"""Local stand-ins for the upstream services, used by the benchmarks.
+
+Each fake runs an aiohttp app on 127.0.0.1 in its own thread and event loop,
+so it keeps answering even when the code under test blocks its own loop.
+"""
+import asyncio
+import collections
+import itertools
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from aiohttp import web
+
+
+class FakeServer:
+    """Runs an aiohttp application in a background thread."""
+
+    def __init__(self, latency=0.0, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.request_count = 0
+        self.base_url = None
+        self._loop = None
+        self._thread = None
+        self._runner = None
+        self._ready = threading.Event()
+
+    def build_app(self):
+        raise NotImplementedError
+
+    async def simulate_upstream(self):
+        """Applies the configured latency; returns an error response if this request should fail."""
+        self.request_count += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            return web.json_response({"error": "simulated failure"}, status=503)
+        return None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._serve())
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _serve(self):
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+
+
+def make_workout(date, index, description_size=200):
+    """Builds one SugarWOD-shaped workout for `date` (a datetime)."""
+    filler = ("10 burpees\n20 air squats\n30 double unders\n" * (description_size // 40 + 1))[:description_size]
+    return {
+        "id": f"wod-{date:%Y%m%d}-{index}",
+        "type": "workout",
+        "attributes": {
+            "title": f"Workout {index + 1} for {date:%Y-%m-%d}",
+            "scheduled_date": date.strftime("%Y-%m-%dT00:00:00.000Z"),
+            "description": f"20 min AMRAP\n{filler}",
+        },
+    }
+
+
+class FakeSugarWOD(FakeServer):
+    """Serves `GET /v2/workouts?dates=YYYYMMDD[,YYYYMMDD...]`.
+
+    Args:
+        workouts_per_day (int): Workouts returned for each requested date.
+        description_size (int): Approximate description length in characters.
+        unpublished_days_ahead (int): Dates this many days past today (Israel time) or later return nothing.
+    """
+
+    def __init__(self, latency=0.05, error_rate=0.0, workouts_per_day=2, description_size=200,
+                 unpublished_days_ahead=None):
+        super().__init__(latency, error_rate)
+        self.workouts_per_day = workouts_per_day
+        self.description_size = description_size
+        self.unpublished_days_ahead = unpublished_days_ahead
+        self.requested_dates = []
+
+    def build_app(self):
+        app = web.Application()
+        app.router.add_get("/v2/workouts", self.workouts)
+        return app
+
+    @property
+    def api_url(self):
+        return f"{self.base_url}/v2"
+
+    async def workouts(self, request):
+        error = await self.simulate_upstream()
+        if error is not None:
+            return error
+        today = datetime.now(ZoneInfo("Asia/Jerusalem")).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+        data = []
+        for token in request.query.get("dates", "").split(","):
+            if not token:
+                continue
+            self.requested_dates.append(token)
+            date = datetime.strptime(token, "%Y%m%d")
+            if self.unpublished_days_ahead is not None and date - today >= timedelta(days=self.unpublished_days_ahead):
+                continue
+            data.extend(make_workout(date, i, self.description_size) for i in range(self.workouts_per_day))
+        return web.json_response({"data": data})
+
+
+class FakeTelegram(FakeServer):
+    """Minimal Bot API: `POST /bot<token>/<method>` for the methods the bot uses.
+
+    Files registered with `add_file()` are served by `getFile` and
+    downloaded from `GET /file/bot<token>/<file_path>` in chunks.
+
+    Args:
+        rate_limit (int, optional): Messages per second accepted before answering 429 with retry_after.
+        blocked_chats (iterable, optional): Chat IDs that answer 403 "bot was blocked by the user".
+    """
+
+    MESSAGE_METHODS = ("sendMessage", "editMessageText")
+
+    def __init__(self, latency=0.03, error_rate=0.0, rate_limit=None, blocked_chats=()):
+        super().__init__(latency, error_rate)
+        self.rate_limit = rate_limit
+        self.blocked_chats = {str(c) for c in blocked_chats}
+        self.calls = collections.Counter()
+        self.sent = []  # (chat_id, text, method, time.monotonic()) in arrival order
+        self.inline_answers = []  # (inline_query_id, result count, cache_time, time.monotonic()) in arrival order
+        self.rate_limited = 0
+        self._recent = collections.deque()
+        self._message_ids = itertools.count(1)
+        self._updates = []  # pending updates served by getUpdates
+        self._updates_changed = None
+        self.files = {}  # file_id -> bytes
+
+    def build_app(self):
+        app = web.Application()
+        app.router.add_post("/{token}/{method}", self.handle)
+        app.router.add_get("/file/{token}/{file_path:.*}", self.download)
+        return app
+
+    @property
+    def api_url(self):
+        """Value for TelegramHandler(base_url=...) / ApplicationBuilder.base_url()."""
+        return f"{self.base_url}/bot"
+
+    @property
+    def file_api_url(self):
+        """Value for `telegram.Bot(base_file_url=...)` / ApplicationBuilder.base_file_url()."""
+        return f"{self.base_url}/file/bot"
+
+    def add_file(self, file_id, data):
+        """Makes `data` downloadable as `file_id`."""
+        self.files[file_id] = data
+
+    async def download(self, request):
+        data = self.files.get(request.match_info["file_path"].rsplit("/", 1)[-1])
+        if data is None:
+            return web.Response(status=404)
+        response = web.StreamResponse(headers={"Content-Length": str(len(data))})
+        await response.prepare(request)
+        for start in range(0, len(data), 64 * 1024):
+            await response.write(data[start:start + 64 * 1024])
+        await response.write_eof()
+        return response
+
+    def enqueue_updates(self, updates):
+        """Queues update dicts for getUpdates (long polling); safe to call from any thread."""
+        asyncio.run_coroutine_threadsafe(self._enqueue(updates), self._loop).result()
+
+    async def _enqueue(self, updates):
+        self._updates.extend(updates)
+        if self._updates_changed is not None:
+            self._updates_changed.set()
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and float(params.get("timeout") or 0) > 0:
+            self._updates_changed = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._updates_changed.wait(), float(params["timeout"]))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit") or 100)
+        return self._updates[:limit]
+
+    @staticmethod
+    def _error(code, description, **parameters):
+        body = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        return web.json_response(body, status=code)
+
+    def _over_rate_limit(self):
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] > 1.0:
+            self._recent.popleft()
+        if len(self._recent) >= self.rate_limit:
+            return True
+        self._recent.append(now)
+        return False
+
+    def _message(self, chat_id, text, message_id=None):
+        numeric = str(chat_id).lstrip("-").isdigit()
+        return {
+            "message_id": message_id or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id) if numeric else -1001, "type": "private" if numeric else "channel"},
+            "text": text,
+        }
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        self.calls[method] += 1
+
+        error = await self.simulate_upstream()
+        if error is not None:
+            return self._error(500, "Internal Server Error: simulated failure")
+
+        chat_id = str(params.get("chat_id", ""))
+        if method in self.MESSAGE_METHODS:
+            if self.rate_limit and self._over_rate_limit():
+                self.rate_limited += 1
+                return self._error(429, "Too Many Requests: retry after 1", retry_after=1)
+            if chat_id in self.blocked_chats:
+                return self._error(403, "Forbidden: bot was blocked by the user")
+            self.sent.append((chat_id, params.get("text", ""), method, time.monotonic()))
+            message_id = int(params["message_id"]) if "message_id" in params else None
+            return web.json_response({"ok": True, "result": self._message(chat_id, params.get("text", ""), message_id)})
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "FitBot", "username": "fitbot_fake_bot",
+                      "can_join_groups": True, "can_read_all_group_messages": False,
+                      "supports_inline_queries": True}
+        elif method == "getFile":
+            file_id = params.get("file_id", "")
+            if file_id not in self.files:
+                return self._error(400, "Bad Request: invalid file_id")
+            result = {"file_id": file_id, "file_unique_id": file_id, "file_size": len(self.files[file_id]),
+                      "file_path": f"documents/{file_id}"}
+        elif method == "getUpdates":
+            result = await self._get_updates(params)
+        elif method == "answerInlineQuery":
+            results = params.get("results", [])
+            if isinstance(results, str):
+                results = json.loads(results)
+            self.inline_answers.append((params.get("inline_query_id"), len(results),
+                                        int(params.get("cache_time", 300)), time.monotonic()))
+            result = True
+        else:
+            # setMyCommands, deleteMessage, ...
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+class FakeOpenAI(FakeServer):
+    """Serves `POST /v1/chat/completions` like the OpenAI API.
+
+    Streaming requests (`"stream": true`) send the answer as server-sent
+    events, one token every `token_interval` seconds after an initial
+    `latency`. Non-streaming requests answer once all tokens would have been
+    generated.
+
+    JSON-mode requests (`response_format` of type "json_object") whose
+    prompt contains `[ID]` header lines, as sent by BatchAnalyzer, get a
+    JSON object with an answer of `completion_tokens` words per ID.
+
+    Args:
+        completion_tokens (int, optional): Tokens (words) in each answer.
+        token_interval (float, optional): Seconds between streamed tokens.
+        drop_rate (float, optional): Chance that an ID is left out of a JSON answer.
+    """
+
+    def __init__(self, latency=1.0, error_rate=0.0, completion_tokens=200, token_interval=0.01, drop_rate=0.0):
+        super().__init__(latency, error_rate)
+        self.completion_tokens = completion_tokens
+        self.token_interval = token_interval
+        self.drop_rate = drop_rate
+        self.prompt_tokens = 0
+        self.requests = []
+
+    def build_app(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.completions)
+        return app
+
+    @property
+    def api_url(self):
+        """Value for `openai.api_base`."""
+        return f"{self.base_url}/v1"
+
+    def _answer_tokens(self):
+        return [f"word{i} " for i in range(self.completion_tokens)]
+
+    def _json_answer(self, messages):
+        ids = [line.strip()[1:-1] for m in messages if m.get("role") == "user"
+               for line in m.get("content", "").splitlines()
+               if line.startswith("[") and line.strip().endswith("]")]
+        answer = "".join(self._answer_tokens()).strip()
+        reply = {i: answer for i in ids if not (self.drop_rate and random.random() < self.drop_rate)}
+        return json.dumps(reply), self.completion_tokens * len(reply)
+
+    async def completions(self, request):
+        body = await request.json()
+        self.requests.append(body)
+        prompt_tokens = sum(len(m.get("content", "").split()) for m in body.get("messages", []))
+        self.prompt_tokens += prompt_tokens
+        error = await self.simulate_upstream()
+        if error is not None:
+            return error
+
+        tokens = self._answer_tokens()
+        if not body.get("stream"):
+            content = "".join(tokens)
+            completion_tokens = len(tokens)
+            if (body.get("response_format") or {}).get("type") == "json_object":
+                content, completion_tokens = self._json_answer(body.get("messages", []))
+            # A blocking completion still takes as long as generating every token
+            await asyncio.sleep(self.token_interval * completion_tokens)
+            return web.json_response({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens},
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for token in tokens:
+            chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": body.get("model"),
+                     "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            if self.token_interval:
+                await asyncio.sleep(self.token_interval)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+
+def make_command_update(update_id, chat_id, command):
+    """Builds a Bot API update dict for a private-chat command such as "/get_wod"."""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": "Member"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Member"},
+            "text": command,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command.split()[0])}],
+        },
+    }
+
+
+def make_inline_query_update(update_id, user_id, query):
+    """Builds a Bot API update dict for an inline query such as "@bot today"."""
+    return {
+        "update_id": update_id,
+        "inline_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "Member"},
+            "query": query,
+            "offset": "",
+        },
+    }
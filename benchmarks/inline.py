@@ -0,0 +1,131 @@
+"""Inline-query ("@bot today") answer latency: pre-built results vs fetching and rendering per query.
+
+Drives the real bot.py Application against the fakes. `--queries` inline
+queries from distinct users arrive at `--rate` per second, each asking
+for "today", "tomorrow", "tom" or nothing. Latency runs from the update
+entering the Application until the fake Bot API receives
+answerInlineQuery.
+
+* prebuilt   - the bot's InlineResultCache, built once before the burst.
+* on demand  - the same handler, but every query fetches the two days
+               from SugarWOD (`--sugarwod-latency`) and renders them first.
+* cold       - the InlineResultCache before its first build. Queries get
+               an empty answer with a short cache_time, and the cache is
+               rebuilt in the background.
+
+Run from the repository root:
+    python -m benchmarks.inline --queries 300 --rate 100 --sugarwod-latency 0.5
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from telegram import Update
+from telegram.ext import InlineQueryHandler
+
+from InlineResults import InlineResultCache
+from Metrics import timed_command
+from WorkoutCache import WorkoutCache
+from benchmarks.common import summarize, write_results
+from benchmarks.fake_servers import FakeSugarWOD, FakeTelegram, make_inline_query_update
+from benchmarks.update_load import load_bot
+
+QUERIES = ("today", "tomorrow", "tom", "")
+USER_BASE = 70_000
+
+
+def on_demand_handler(bot):
+    async def inline_query(update, context):
+        # Fetch and build on every query, as an inline handler without the cache would
+        box = bot.box_registry.default
+        box.workout_api_handler.cache = WorkoutCache()
+        results = InlineResultCache(bot.box_registry, bot.telegram_handler)
+        await results.refresh_box(box)
+        answer, cache_time, is_personal = results.lookup(update.inline_query.query, update.inline_query.from_user.id)
+        await update.inline_query.answer(answer, cache_time=cache_time, is_personal=is_personal)
+    return timed_command("inline", inline_query)
+
+
+async def run_mode(bot, telegram, sugarwod, args, mode):
+    bot.box_registry.default.workout_api_handler.cache = WorkoutCache()
+    bot.inline_results = InlineResultCache(bot.box_registry, bot.telegram_handler, cache_time=bot.INLINE_CACHE_TIME)
+    application = bot.build_application(coalescer=None)
+    for job in application.job_queue.jobs():
+        job.schedule_removal()
+    if mode == "on demand":
+        for handler in application.handlers[0]:
+            if isinstance(handler, InlineQueryHandler):
+                handler.callback = on_demand_handler(bot)
+    elif mode == "prebuilt":
+        await bot.inline_results.refresh()
+
+    first_answer, sugarwod_before = len(telegram.inline_answers), sugarwod.request_count
+    arrivals = {}
+    async with application:
+        await application.start()
+        for i in range(args.queries):
+            update_id = USER_BASE + i
+            data = make_inline_query_update(update_id, update_id, QUERIES[i % len(QUERIES)])
+            arrivals[str(update_id)] = time.monotonic()
+            await application.update_queue.put(Update.de_json(data, application.bot))
+            await asyncio.sleep(1 / args.rate)
+
+        deadline = time.monotonic() + 120
+        while len(telegram.inline_answers) - first_answer < args.queries and time.monotonic() < deadline:
+            await asyncio.sleep(0.02)
+        await application.stop()
+
+    answers = telegram.inline_answers[first_answer:]
+    latencies = [answered_at - arrivals[query_id] for query_id, _, _, answered_at in answers if query_id in arrivals]
+    return {
+        "latency": summarize(latencies),
+        "empty_answers": sum(1 for _, count, _, _ in answers if count == 0),
+        "cache_times": sorted({cache_time for _, _, cache_time, _ in answers}),
+        "sugarwod_requests": sugarwod.request_count - sugarwod_before,
+        "inline_stats": bot.inline_results.stats() if mode != "on demand" else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=100, help="inline queries per second")
+    parser.add_argument("--sugarwod-latency", type=float, default=0.5)
+    parser.add_argument("--unpublished", action="store_true", help="tomorrow's WOD is not published yet")
+    parser.add_argument("--output", help="write JSON results to this path")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, FakeTelegram(latency=0.02) as telegram, \
+            FakeSugarWOD(latency=args.sugarwod_latency, unpublished_days_ahead=1 if args.unpublished else None) \
+            as sugarwod:
+        with contextlib.redirect_stdout(io.StringIO()):
+            bot = load_bot(telegram, sugarwod, tmp)
+
+        async def run_all():
+            for mode in ("prebuilt", "on demand", "cold"):
+                results[mode] = await run_mode(bot, telegram, sugarwod, args, mode)
+            await bot.box_registry.aclose()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(run_all())
+
+    now = datetime.now(bot.box_registry.default.timezone)
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=now.tzinfo)
+    print(f"{args.queries} inline queries at {args.rate:.0f}/s, SugarWOD latency {args.sugarwod_latency * 1000:.0f}ms"
+          f"{', tomorrow unpublished' if args.unpublished else ''} ({int((midnight - now).total_seconds())}s to midnight)")
+    for mode, r in results.items():
+        print(f"{mode:<10} p50 {r['latency']['p50_ms']:>6.1f}ms  p99 {r['latency']['p99_ms']:>7.1f}ms  "
+              f"answered {r['latency']['count']:>4}, empty {r['empty_answers']:>4}, SugarWOD requests "
+              f"{r['sugarwod_requests']:>4}, cache_time {r['cache_times']}")
+
+    if args.output:
+        write_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
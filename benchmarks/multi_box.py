@@ -0,0 +1,111 @@
+"""How SugarWOD calls and delivery time scale with the number of boxes.
+
+Part 1 has every box's members look up each day of the coming week,
+several times per day, within one cache TTL. Unbatched fetches (only the
+missing days per request) are compared with the week-wide `dates=` batch.
+
+Part 2 delivers to every box's subscribers. It compares one box after
+another with all boxes in parallel, both under the same bot-wide rate
+limit enforced by the fake Bot API.
+
+Run from the repository root:
+    python -m benchmarks.multi_box --boxes 1,2,4,8 --subscribers 100
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from BoxRegistry import BoxRegistry, deliver_boxes
+from TelegramHandler import TelegramHandler
+from WorkoutCache import WorkoutCache
+from benchmarks.common import write_results
+from benchmarks.fake_servers import FakeSugarWOD, FakeTelegram
+
+
+def _registry(api_url, boxes, tmp, batch_days, subscribers=0, rate=30):
+    entries = [{
+        "name": f"Box {i}",
+        "slug": f"box{i}",
+        "api_key": f"key-{i}",
+        "api_url": api_url,
+        "channel_id": f"@box{i}",
+        "subscribers_db": os.path.join(tmp, f"box{i}-{batch_days}.db"),
+        "broadcast_rate": rate,
+    } for i in range(boxes)]
+    registry = BoxRegistry.from_config(entries, cache=WorkoutCache())
+    for i, box in enumerate(registry):
+        box.workout_api_handler.batch_days = batch_days
+        for n in range(subscribers):
+            box.subscriber_store.subscribe(str(40_000_000 + i * 100_000 + n))
+    return registry
+
+
+async def replay_week(sugarwod, boxes, tmp, batch_days, presses_per_day):
+    registry = _registry(sugarwod.api_url, boxes, tmp, batch_days)
+    before = sugarwod.request_count
+    start = datetime.now()
+    for day in range(7):
+        date_str = (start + timedelta(days=day)).strftime("%Y-%m-%d")
+        for box in registry:
+            for _ in range(presses_per_day):
+                await box.workout_api_handler.get_workouts_for_date(date_str)
+    calls = sugarwod.request_count - before
+    await registry.aclose()
+    return calls
+
+
+async def deliver(sugarwod, telegram, boxes, tmp, subscribers, rate, parallel):
+    registry = _registry(sugarwod.api_url, boxes, tmp, 7, subscribers, rate)
+    telegram_handler = TelegramHandler("123:fake", base_url=telegram.api_url)
+    date_str = datetime.now().strftime("%Y-%m-%d")
+    broadcast_id = f"bench-{time.time_ns()}"
+    start = time.perf_counter()
+    if parallel:
+        await deliver_boxes(telegram_handler, registry, date_str, broadcast_id=broadcast_id, global_rate=rate)
+    else:
+        for box in registry:
+            await deliver_boxes(telegram_handler, [box], date_str, broadcast_id=broadcast_id, global_rate=rate)
+    elapsed = time.perf_counter() - start
+    await registry.aclose()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--boxes", default="1,2,4,8", help="comma-separated box counts")
+    parser.add_argument("--presses-per-day", type=int, default=5)
+    parser.add_argument("--subscribers", type=int, default=100, help="subscribers per box")
+    parser.add_argument("--rate", type=float, default=100, help="bot-wide msg/s, enforced by the fake")
+    parser.add_argument("--sugarwod-latency", type=float, default=0.2)
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--output", help="write JSON results to this path")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp, \
+            FakeSugarWOD(latency=args.sugarwod_latency) as sugarwod, \
+            FakeTelegram(latency=args.telegram_latency, rate_limit=int(args.rate)) as telegram:
+        print(f"{'boxes':>5} {'calls/day-batch':>16} {'calls/week-batch':>17} {'sequential s':>13} {'parallel s':>11}")
+        for boxes in (int(b) for b in args.boxes.split(",")):
+            with contextlib.redirect_stdout(io.StringIO()):
+                daily = asyncio.run(replay_week(sugarwod, boxes, tmp, 1, args.presses_per_day))
+                weekly = asyncio.run(replay_week(sugarwod, boxes, tmp, 7, args.presses_per_day))
+                sequential = asyncio.run(deliver(sugarwod, telegram, boxes, tmp, args.subscribers, args.rate, False))
+                parallel = asyncio.run(deliver(sugarwod, telegram, boxes, tmp, args.subscribers, args.rate, True))
+            print(f"{boxes:>5} {daily:>16} {weekly:>17} {sequential:>13.2f} {parallel:>11.2f}")
+            results.append({"boxes": boxes, "week_calls_per_day_fetch": daily, "week_calls_batched": weekly,
+                            "delivery_sequential_s": round(sequential, 3), "delivery_parallel_s": round(parallel, 3)})
+        rate_limited = telegram.rate_limited
+    print(f"429 responses from the fake Bot API: {rate_limited}")
+
+    if args.output:
+        write_results(args.output, {"config": vars(args), "results": results, "rate_limited_responses": rate_limited})
+
+
+if __name__ == "__main__":
+    main()
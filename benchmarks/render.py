@@ -0,0 +1,95 @@
+"""Render cost per recipient: legacy per-chat formatting vs the cached MessageRenderer.
+
+The legacy path (copied from the old TelegramHandler.send_workout_message)
+recomputes the dates, re-filters the workouts and rebuilds the message with
+`+=` for every chat. The renderer builds it once and then only looks it up.
+
+Run from the repository root:
+    python -m benchmarks.render --recipients 10000 --description-size 2000
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from TelegramHandler import MessageRenderer
+from benchmarks.common import write_results
+from benchmarks.fake_servers import make_workout
+
+
+def legacy_render(workouts, include_tomorrow_check=False):
+    today_date_str_compare = datetime.now(ZoneInfo("Asia/Jerusalem")).strftime("%Y-%m-%d")
+    tomorrow_date_str_compare = (datetime.now(ZoneInfo("Asia/Jerusalem")) + timedelta(days=1)).strftime("%Y-%m-%d")
+
+    today_workouts = [w for w in workouts if w.get("attributes", {}).get("scheduled_date", "").startswith(today_date_str_compare)]
+    tomorrow_workouts = [w for w in workouts if w.get("attributes", {}).get("scheduled_date", "").startswith(tomorrow_date_str_compare)]
+
+    message = "🏋️‍♂️ *CrossFit Hatira WODs* 🏋️‍♀️\n\n"
+    message += "📅 *Today's Workouts: ({})*\n\n".format(today_date_str_compare)
+    if not today_workouts:
+        message += "_No workouts found for today._\n"
+    else:
+        for w in today_workouts:
+            attr = w.get("attributes", {})
+            message += (
+                "🔹 *Title*: " + attr.get("title", "N/A") + "\n" +
+                "📝 *Description*: " + attr.get("description", "N/A") + "\n" +
+                "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+            )
+    if include_tomorrow_check:
+        message += "\n📅 *Tomorrow's Workouts: ({})*\n\n".format(tomorrow_date_str_compare)
+        if not tomorrow_workouts:
+            message += "⚠️ _Sorry… Tomorrow's WOD hasn't been published yet._\n"
+        else:
+            for w in tomorrow_workouts:
+                attr = w.get("attributes", {})
+                message += (
+                    "🔹 *Title*: " + attr.get("title", "N/A") + "\n" +
+                    "📝 *Description*: " + attr.get("description", "N/A") + "\n" +
+                    "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+                )
+    return message
+
+
+def _per_recipient_us(render, recipients):
+    start = time.perf_counter()
+    for _ in range(recipients):
+        render()
+    return (time.perf_counter() - start) / recipients * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recipients", type=int, default=10_000)
+    parser.add_argument("--workouts-per-day", type=int, default=3)
+    parser.add_argument("--description-size", type=int, default=400)
+    parser.add_argument("--output", help="write JSON results to this path")
+    args = parser.parse_args()
+
+    today = datetime.now(ZoneInfo("Asia/Jerusalem")).replace(tzinfo=None)
+    workouts = [make_workout(day, i, args.description_size)
+                for day in (today, today + timedelta(days=1)) for i in range(args.workouts_per_day)]
+
+    renderer = MessageRenderer()
+    chunks = renderer.render(workouts, include_tomorrow_check=True)
+    assert "".join(chunks) == legacy_render(workouts, include_tomorrow_check=True)
+
+    legacy_us = _per_recipient_us(lambda: legacy_render(workouts, True), args.recipients)
+    cached_us = _per_recipient_us(lambda: renderer.render(workouts, True), args.recipients)
+
+    print(f"{args.recipients} recipients, {len(workouts)} workouts, {len(chunks)} chunk(s)")
+    print(f"legacy render:  {legacy_us:8.2f} us/recipient")
+    print(f"cached render:  {cached_us:8.2f} us/recipient  ({legacy_us / cached_us:.1f}x faster)")
+
+    if args.output:
+        write_results(args.output, {
+            "recipients": args.recipients,
+            "workouts": len(workouts),
+            "chunks": len(chunks),
+            "legacy_us_per_recipient": round(legacy_us, 3),
+            "cached_us_per_recipient": round(cached_us, 3),
+        })
+
+
+if __name__ == "__main__":
+    main()
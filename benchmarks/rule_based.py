@@ -0,0 +1,127 @@
+"""Share of /analyze_workout answered without the LLM, and prompt-token savings.
+
+Runs a mix of typical SugarWOD programming through OpenAIHandler against
+a local fake OpenAI server. It reports:
+
+* how many analyses the rule-based path answers
+* the estimated prompt tokens, raw description vs structured summary
+* the latency of each path
+* the parse time, cold and cached
+* the memory per parsed workout
+
+Run from the repository root:
+    python -m benchmarks.rule_based --workouts 200
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import random
+import time
+import tracemalloc
+
+import openai
+
+import WorkoutParser
+from AnalysisCache import AnalysisCache
+from OpenAIHandler import OpenAIHandler
+from benchmarks.common import print_summary, summarize, write_results
+from benchmarks.fake_servers import FakeOpenAI
+
+# Typical daily programming; the last ones are the kind the parser can't fully place
+TEMPLATES = [
+    ("Metcon", "{m} min AMRAP\n10 burpees\n15 wall balls (20/14 lb)\n20 double unders"),
+    ("Fran", "For Time:\n21-15-9\nThrusters (95/65 lb)\nPull-ups"),
+    ("Engine", "EMOM {m}:\nMin 1: 12 cal row\nMin 2: 10 box jumps\nMin 3: 8 toes to bar"),
+    ("Strength", "Back Squat 5x{r} @ 75%\nRest 2 min between sets"),
+    ("Helen", "3 Rounds For Time:\n400m Run\n21 KB swings (24/16 kg)\n12 Pull-ups\nTime cap: {m} min"),
+    ("Chipper", "For Time:\n50 double unders\n40 sit-ups\n30 push-ups\n20 power cleans (135/95 lb)\n10 rope climbs\nCap {m}"),
+    ("Partner WOD", "In teams of 2, YGIG:\n{m} min to complete\n100 cal bike\nPartner carry 200m\nSandbag over shoulder x30"),
+    ("Skill", "Handstand walk practice, {m} min\nThen: Turkish get-ups, work up to a heavy single"),
+]
+
+
+def make_workouts(count, seed=7):
+    rng = random.Random(seed)
+    workouts = []
+    for i in range(count):
+        title, description = TEMPLATES[i % len(TEMPLATES)]
+        description = description.format(m=rng.choice((10, 12, 15, 20)), r=rng.choice((3, 5)))
+        workouts.append([{"attributes": {"title": f"{title} #{i}", "description": description}}])
+    return workouts
+
+
+async def run(handler, workouts):
+    samples = {"rule_based": [], "llm": []}
+    for workout in workouts:
+        llm_before = handler.analyses - handler.rule_based
+        start = time.perf_counter()
+        async for _ in handler.stream_analysis(workout):
+            pass
+        path = "llm" if handler.analyses - handler.rule_based > llm_before else "rule_based"
+        samples[path].append(time.perf_counter() - start)
+    return samples
+
+
+def parse_costs(workouts):
+    pairs = [(w[0]["attributes"]["title"], w[0]["attributes"]["description"]) for w in workouts]
+    WorkoutParser.parse_workout.cache_clear()
+    start = time.perf_counter()
+    for title, description in pairs:
+        WorkoutParser.parse_workout(title, description)
+    cold = (time.perf_counter() - start) / len(pairs)
+    start = time.perf_counter()
+    for title, description in pairs:
+        WorkoutParser.parse_workout(title, description)
+    cached = (time.perf_counter() - start) / len(pairs)
+
+    WorkoutParser.parse_workout.cache_clear()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    parsed = [WorkoutParser.parse_workout.__wrapped__(title, description) for title, description in pairs]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    per_workout = sum(stat.size_diff for stat in after.compare_to(before, "filename")) / len(parsed)
+    return cold, cached, per_workout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workouts", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.3, help="fake OpenAI time to first token in seconds")
+    parser.add_argument("--token-interval", type=float, default=0.002)
+    parser.add_argument("--output", help="write JSON results to this path")
+    args = parser.parse_args()
+
+    workouts = make_workouts(args.workouts)
+    with FakeOpenAI(latency=args.latency, token_interval=args.token_interval) as server:
+        handler = OpenAIHandler(cache=AnalysisCache())
+        openai.api_base = server.api_url
+        openai.api_key = "sk-fake"
+        with contextlib.redirect_stdout(io.StringIO()):
+            samples = asyncio.run(run(handler, workouts))
+        llm_requests = len(server.requests)
+    stats = handler.stats()
+    cold, cached, per_workout = parse_costs(workouts)
+
+    print(f"{stats['analyses']} analyses: {stats['rule_based_pct']}% without the LLM ({llm_requests} OpenAI requests)")
+    print(f"prompt tokens (est.): {stats['raw_prompt_tokens']} raw -> {stats['prompt_tokens']} sent "
+          f"({stats['prompt_token_reduction_pct']}% fewer)")
+    print_summary("rule-based analysis", samples["rule_based"])
+    print_summary("LLM analysis", samples["llm"])
+    print(f"parse: {cold * 1e6:.1f}us cold, {cached * 1e6:.2f}us cached, ~{per_workout:.0f} bytes per parsed workout")
+
+    if args.output:
+        write_results(args.output, {
+            "analysis_stats": stats,
+            "openai_requests": llm_requests,
+            "rule_based_latency": summarize(samples["rule_based"]),
+            "llm_latency": summarize(samples["llm"]),
+            "parse_us_cold": round(cold * 1e6, 2),
+            "parse_us_cached": round(cached * 1e6, 3),
+            "bytes_per_parsed_workout": round(per_workout),
+        })
+
+
+if __name__ == "__main__":
+    main()
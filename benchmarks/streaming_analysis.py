@@ -0,0 +1,113 @@
+"""Time-to-first-visible-text for /analyze_workout: blocking call vs streamed edits.
+
+Runs offline against the fake OpenAI streaming endpoint and the fake Bot API.
+While the analysis is produced, a heartbeat task measures how long the event
+loop is stalled, i.e. how long every other chat would wait.
+
+Run from the repository root:
+    python -m benchmarks.streaming_analysis --latency 0.5 --tokens 300
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+
+import openai
+
+from AnalysisCache import AnalysisCache
+from OpenAIHandler import OpenAIHandler
+from TelegramHandler import TelegramHandler
+from benchmarks.common import write_results
+from benchmarks.fake_servers import FakeOpenAI, FakeTelegram
+
+WORKOUT = [{"attributes": {"title": "Test Workout",
+                           "description": "20 min AMRAP\n10 burpees\n20 air squats\n30 double unders"}}]
+CHAT_ID = 1000
+
+
+async def _with_heartbeat(coro, interval=0.01):
+    """Runs `coro` and returns (result, worst event loop stall in seconds)."""
+    worst = 0.0
+    done = asyncio.Event()
+
+    async def heartbeat():
+        nonlocal worst
+        while not done.is_set():
+            before = time.monotonic()
+            await asyncio.sleep(interval)
+            worst = max(worst, time.monotonic() - before - interval)
+
+    beat = asyncio.ensure_future(heartbeat())
+    await asyncio.sleep(0)
+    try:
+        return await coro, worst
+    finally:
+        done.set()
+        await beat
+
+
+async def blocking(telegram_handler, openai_handler):
+    started = time.monotonic()
+    placeholder = await telegram_handler.bot.send_message(CHAT_ID, "🤔 Analyzing...")
+    # What bot.analyze_workout used to do: a synchronous completion inside the handler
+    analysis = openai_handler.analyze_workout(WORKOUT)
+    await telegram_handler.bot.edit_message_text(analysis, chat_id=CHAT_ID, message_id=placeholder.message_id)
+    return {"time_to_first_text": time.monotonic() - started, "total": time.monotonic() - started, "edits": 1}
+
+
+async def streaming(telegram_handler, openai_handler, min_edit_interval):
+    started = time.monotonic()
+    placeholder = await telegram_handler.bot.send_message(CHAT_ID, "🤔 Analyzing...")
+    result = await telegram_handler.stream_edit(CHAT_ID, placeholder.message_id,
+                                                openai_handler.stream_analysis(WORKOUT),
+                                                header="📊 *Workout Analysis*\n\n", started_at=started,
+                                                min_edit_interval=min_edit_interval)
+    return {"time_to_first_text": result["time_to_first_text"], "total": time.monotonic() - started,
+            "edits": result["edits"]}
+
+
+async def run(telegram_url, min_edit_interval):
+    telegram_handler = TelegramHandler("123:fake", base_url=telegram_url)
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        results["blocking"] = await _with_heartbeat(blocking(telegram_handler, _fresh_handler()))
+        results["streaming"] = await _with_heartbeat(
+            streaming(telegram_handler, _fresh_handler(), min_edit_interval))
+    return results
+
+
+def _fresh_handler():
+    # Empty cache, so both runs pay for a real (fake) completion
+    handler = OpenAIHandler(cache=AnalysisCache(), llm_mode="always")
+    openai.api_key = "sk-fake"
+    return handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument("--tokens", type=int, default=300, help="tokens in the analysis")
+    parser.add_argument("--token-interval", type=float, default=0.01, help="seconds between streamed tokens")
+    parser.add_argument("--edit-interval", type=float, default=1.0, help="minimum seconds between edits")
+    parser.add_argument("--output", help="write JSON results to this path")
+    args = parser.parse_args()
+
+    with FakeOpenAI(latency=args.latency, completion_tokens=args.tokens, token_interval=args.token_interval) as llm, \
+            FakeTelegram(latency=0.01) as telegram:
+        openai.api_base = llm.api_url
+        results = asyncio.run(run(telegram.api_url, args.edit_interval))
+
+    report = {}
+    for mode, (result, stall) in results.items():
+        report[mode] = {**{k: round(v, 3) for k, v in result.items()}, "worst_loop_stall": round(stall, 3)}
+        print(f"{mode:<10} first text {result['time_to_first_text'] * 1000:8.1f}ms  "
+              f"done {result['total'] * 1000:8.1f}ms  edits {result['edits']:>3}  "
+              f"worst loop stall {stall * 1000:8.1f}ms")
+
+    if args.output:
+        write_results(args.output, report)
+
+
+if __name__ == "__main__":
+    main()
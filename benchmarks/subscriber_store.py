@@ -0,0 +1,98 @@
+"""Cost of /start and /stop at scale: legacy subscribers.txt vs SQLiteSubscriberStore.
+
+The legacy path re-reads and rewrites the whole text file on every command,
+so each operation is O(N). The store keeps an in-memory set in front of
+SQLite/WAL and writes one row per command.
+
+Run from the repository root:
+    python -m benchmarks.subscriber_store --subscribers 100000 --ops 200
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from SubscriberStore import SQLiteSubscriberStore
+from benchmarks.common import print_summary, summarize, write_results
+
+
+def _legacy_toggle(path, chat_id):
+    # Same logic as the old bot._load_subscribers/_save_subscribers pair
+    with open(path) as f:
+        subs = set(f.read().split())
+    if chat_id in subs:
+        subs.remove(chat_id)
+    else:
+        subs.add(chat_id)
+    with open(path, 'w') as f:
+        f.write('\n'.join(subs))
+
+
+def _store_toggle(store, chat_id):
+    if not store.subscribe(chat_id):
+        store.unsubscribe(chat_id)
+
+
+def _time_ops(op, chat_ids):
+    samples = []
+    for chat_id in chat_ids:
+        start = time.perf_counter()
+        op(chat_id)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subscribers", type=int, default=100_000)
+    parser.add_argument("--ops", type=int, default=200, help="/start or /stop commands to time")
+    parser.add_argument("--output", help="write JSON results to this path")
+    args = parser.parse_args()
+
+    existing = [str(1_000_000_000 + i) for i in range(args.subscribers)]
+    # Half new chats (/start), half existing ones (/stop)
+    chat_ids = [str(9_000_000_000 + i) for i in range(args.ops // 2)] + random.sample(existing, args.ops - args.ops // 2)
+    random.shuffle(chat_ids)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        text_path = os.path.join(tmp, "subscribers.txt")
+        with open(text_path, 'w') as f:
+            f.write('\n'.join(existing))
+
+        legacy = _time_ops(lambda chat_id: _legacy_toggle(text_path, chat_id), chat_ids)
+
+        start = time.perf_counter()
+        store = SQLiteSubscriberStore(os.path.join(tmp, "subscribers.db"), migrate_from=text_path)
+        migration_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        reopened = SQLiteSubscriberStore(os.path.join(tmp, "subscribers.db"))
+        load_s = time.perf_counter() - start
+        reopened.close()
+
+        indexed = _time_ops(lambda chat_id: _store_toggle(store, chat_id), chat_ids)
+        start = time.perf_counter()
+        store.mark_delivered(store.all())
+        mark_all_s = time.perf_counter() - start
+        store.close()
+
+    print(f"{args.subscribers} subscribers, {args.ops} /start + /stop commands")
+    print_summary("legacy text file", legacy)
+    print_summary("SQLite store", indexed)
+    print(f"migration: {migration_s * 1000:.1f}ms  reopen: {load_s * 1000:.1f}ms  "
+          f"mark_delivered(all): {mark_all_s * 1000:.1f}ms")
+
+    if args.output:
+        write_results(args.output, {
+            "subscribers": args.subscribers,
+            "legacy": summarize(legacy),
+            "store": summarize(indexed),
+            "migration_ms": round(migration_s * 1000, 2),
+            "reopen_ms": round(load_s * 1000, 2),
+            "mark_delivered_all_ms": round(mark_all_s * 1000, 2),
+        })
+
+
+if __name__ == "__main__":
+    main()
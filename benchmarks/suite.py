@@ -0,0 +1,266 @@
+"""End-to-end offline benchmark suite for the bot and the daily delivery script.
+
+Starts local stand-ins for SugarWOD, the Telegram Bot API and OpenAI, then
+drives the real bot.py handlers and get_wod.py through three scenarios:
+
+* command_burst   - many chats press /get_wod at once (cold workout cache)
+* analysis_storm  - many chats press /analyze_workout at once (cold analysis cache)
+* broadcast       - get_wod.py delivers to N subscribers
+
+Throughput, p50/p95/p99 latency and upstream call counts per scenario are
+written to a JSON file. Pass an earlier file as --baseline to flag
+regressions between versions.
+
+Run from the repository root, after `pip install -r requirements-bench.txt`:
+    python -m benchmarks.suite --output bench_output.json
+    python -m benchmarks.suite --baseline bench_output.json --fail-on-regression
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from telegram import Update
+
+from AnalysisCache import AnalysisCache
+from SubscriberStore import SQLiteSubscriberStore
+from benchmarks.common import summarize, write_results
+from benchmarks.fake_servers import FakeOpenAI, FakeSugarWOD, FakeTelegram, make_command_update
+from benchmarks.update_load import load_bot
+
+# Metrics compared against a baseline, and which direction is worse
+TRACKED_METRICS = {"p99_ms": "higher", "p50_ms": "higher", "throughput_per_s": "lower"}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class Fakes:
+    """The three fake upstreams plus call-count snapshots."""
+
+    def __init__(self, args):
+        self.sugarwod = FakeSugarWOD(latency=args.sugarwod_latency, error_rate=args.error_rate,
+                                     description_size=args.description_size)
+        self.telegram = FakeTelegram(latency=args.telegram_latency, error_rate=args.error_rate)
+        self.openai = FakeOpenAI(latency=args.openai_latency, error_rate=args.error_rate,
+                                 completion_tokens=args.completion_tokens, token_interval=args.token_interval)
+
+    def __enter__(self):
+        for server in (self.sugarwod, self.telegram, self.openai):
+            server.start()
+        return self
+
+    def __exit__(self, *exc):
+        for server in (self.sugarwod, self.telegram, self.openai):
+            server.stop()
+
+    def counts(self):
+        return {"sugarwod": self.sugarwod.request_count, "telegram": sum(self.telegram.calls.values()),
+                "openai": len(self.openai.requests)}
+
+    def calls_since(self, before):
+        return {name: value - before[name] for name, value in self.counts().items()}
+
+
+def _reset_bot_caches(bot):
+    bot.workout_api_handler.cache.invalidate(bot.workout_api_handler.box_id)
+    bot.openai_handler.cache = AnalysisCache()
+
+
+def _replies_by_chat(telegram, first_index, method):
+    replies = {}
+    for chat_id, _, sent_method, sent_at in telegram.sent[first_index:]:
+        if sent_method == method:
+            replies.setdefault(chat_id, []).append(sent_at)
+    return replies
+
+
+async def _drive(bot, fakes, command, chats, per_chat, wait_for, timeout=120):
+    """Feeds `command` from `chats` chats into a running Application; returns arrival times per chat."""
+    # Each press is timed against its own reply; benchmarks.admission measures coalescing
+    application = bot.build_application(coalescer=None)
+    for job in application.job_queue.jobs():
+        job.schedule_removal()
+
+    arrivals = {}
+    first_index = len(fakes.telegram.sent)
+    async with application:
+        await application.start()
+        update_id = 1
+        for _ in range(per_chat):
+            for chat in range(chats):
+                data = make_command_update(update_id, 20_000 + chat, command)
+                update_id += 1
+                arrivals.setdefault(str(20_000 + chat), []).append(time.monotonic())
+                await application.update_queue.put(Update.de_json(data, application.bot))
+
+        deadline = time.monotonic() + timeout
+        while not wait_for(first_index) and time.monotonic() < deadline:
+            await asyncio.sleep(0.02)
+        await application.stop()
+    return arrivals, first_index
+
+
+async def scenario_command_burst(bot, fakes, args):
+    _reset_bot_caches(bot)
+    before = fakes.counts()
+    expected = args.chats * args.per_chat
+
+    def done(first_index):
+        return sum(1 for s in fakes.telegram.sent[first_index:] if s[2] == "sendMessage") >= expected
+
+    start = time.monotonic()
+    arrivals, first_index = await _drive(bot, fakes, "/get_wod", args.chats, args.per_chat, done)
+    replies = _replies_by_chat(fakes.telegram, first_index, "sendMessage")
+    latencies = [r - a for chat, times in arrivals.items() for a, r in zip(times, replies.get(chat, []))]
+    return _result(latencies, start, replies, fakes.calls_since(before), expected)
+
+
+async def scenario_analysis_storm(bot, fakes, args):
+    _reset_bot_caches(bot)
+    before = fakes.counts()
+    expected = args.chats
+
+    def done(first_index):
+        # Each chat's analysis ends with a Markdown edit; wait until every chat got at least one edit
+        # and the stream has had time to finish
+        edits = _replies_by_chat(fakes.telegram, first_index, "editMessageText")
+        llm_done = bot.openai_handler.llm_mode != "always" or bot.openai_handler.cache.stats()["size"] > 0
+        return len(edits) >= expected and llm_done and not bot.openai_handler._streams
+
+    start = time.monotonic()
+    arrivals, first_index = await _drive(bot, fakes, "/analyze_workout", args.chats, 1, done)
+    await asyncio.sleep(0.2)
+    edits = _replies_by_chat(fakes.telegram, first_index, "editMessageText")
+    first_text = [edits[chat][0] - times[0] for chat, times in arrivals.items() if chat in edits]
+    complete = [edits[chat][-1] - times[0] for chat, times in arrivals.items() if chat in edits]
+    result = _result(complete, start, edits, fakes.calls_since(before), expected)
+    result["time_to_first_text"] = summarize(first_text)
+    return result
+
+
+async def scenario_broadcast(fakes, args, tmp):
+    store = SQLiteSubscriberStore(os.environ["SUBSCRIBERS_DB"])
+    for i in range(args.subscribers):
+        store.subscribe(str(30_000_000 + i))
+    expected = len(store) + 1  # plus the channel
+    store.close()
+
+    os.environ.update({
+        "TELEGRAM_CHANNEL_ID": "@bench_channel",
+        "BROADCAST_CHECKPOINT_DIR": os.path.join(tmp, "checkpoints"),
+        "BROADCAST_RATE": str(args.broadcast_rate),
+        "BROADCAST_ID": f"bench-{time.time_ns()}",
+        "CACHE_DIR": os.path.join(tmp, "cache"),
+    })
+    os.environ.pop("TELEGRAM_CHAT_ID", None)
+    get_wod = importlib.reload(importlib.import_module("get_wod"))
+
+    before = fakes.counts()
+    first_index = len(fakes.telegram.sent)
+    start = time.monotonic()
+    await get_wod.main()
+    elapsed = time.monotonic() - start
+    replies = _replies_by_chat(fakes.telegram, first_index, "sendMessage")
+    messages = sum(len(times) for times in replies.values())
+    return {"delivered": len(replies), "expected": expected, "messages": messages,
+            "elapsed_s": round(elapsed, 3), "throughput_per_s": round(messages / elapsed, 2) if elapsed else 0.0,
+            "upstream_calls": fakes.calls_since(before)}
+
+
+def _result(latencies, start, replies, upstream_calls, expected):
+    last = max((t for times in replies.values() for t in times), default=start)
+    elapsed = last - start
+    return {**summarize(latencies), "expected": expected,
+            "throughput_per_s": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+            "upstream_calls": upstream_calls}
+
+
+async def run_scenarios(bot, fakes, args, tmp):
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        results["command_burst"] = await scenario_command_burst(bot, fakes, args)
+        results["analysis_storm"] = await scenario_analysis_storm(bot, fakes, args)
+        results["broadcast"] = await scenario_broadcast(fakes, args, tmp)
+        await bot.workout_api_handler.aclose()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Prints metric changes against `baseline`; returns the list of regressions."""
+    regressions = []
+    for scenario, metrics in results["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(scenario, {})
+        for metric, worse in TRACKED_METRICS.items():
+            if metric not in metrics or not old.get(metric):
+                continue
+            change = (metrics[metric] - old[metric]) / old[metric] * 100
+            regressed = change > threshold if worse == "higher" else change < -threshold
+            flag = "REGRESSION" if regressed else ""
+            print(f"  {scenario:<16} {metric:<18} {old[metric]:>10} -> {metrics[metric]:>10} ({change:+6.1f}%) {flag}")
+            if regressed:
+                regressions.append((scenario, metric, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=50, help="chats pressing a command at once")
+    parser.add_argument("--per-chat", type=int, default=2, help="/get_wod presses per chat in the burst")
+    parser.add_argument("--subscribers", type=int, default=300)
+    parser.add_argument("--broadcast-rate", type=float, default=100, help="BROADCAST_RATE for get_wod.py")
+    parser.add_argument("--sugarwod-latency", type=float, default=0.1)
+    parser.add_argument("--telegram-latency", type=float, default=0.03)
+    parser.add_argument("--openai-latency", type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument("--token-interval", type=float, default=0.005)
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    parser.add_argument("--description-size", type=int, default=300, help="characters per workout description")
+    parser.add_argument("--analysis-llm", default="always", choices=("always", "auto"),
+                        help="ANALYSIS_LLM for the bot; the fake workouts parse fully, so 'auto' never calls the LLM")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream requests that fail")
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=20.0, help="percent change counted as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, Fakes(args) as fakes:
+        os.environ["ANALYSIS_LLM"] = args.analysis_llm
+        with contextlib.redirect_stdout(io.StringIO()):
+            bot = load_bot(fakes.telegram, fakes.sugarwod, tmp, openai_server=fakes.openai)
+        scenarios = asyncio.run(run_scenarios(bot, fakes, args, tmp))
+        bot.subscriber_store.close()
+
+    results = {
+        "meta": {"revision": git_revision(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 "python": platform.python_version(), "config": vars(args)},
+        "scenarios": scenarios,
+    }
+    for name, metrics in scenarios.items():
+        print(f"{name}: {json.dumps(metrics)}")
+    write_results(args.output, results)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.baseline} ({baseline.get('meta', {}).get('revision', '?')}):")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
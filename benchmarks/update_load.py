@@ -0,0 +1,154 @@
+"""Updates/sec and command latency: polling vs webhook, sequential vs concurrent processing.
+
+Drives the real bot.py Application against the fake Bot API and a fake
+SugarWOD. Synthetic /get_wod updates from several chats arrive at a fixed
+rate, either queued for getUpdates (polling) or POSTed to the bot's local
+webhook listener. Latency is measured from arrival to the bot's reply
+reaching the fake Bot API; each chat's replies arrive in order, so the k-th
+reply in a chat answers that chat's k-th update.
+
+Run from the repository root:
+    python -m benchmarks.update_load --updates 300 --rate 100 --chats 20
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib
+import io
+import itertools
+import os
+import socket
+import tempfile
+import time
+
+import httpx
+import openai
+
+from benchmarks.common import summarize, write_results
+from benchmarks.fake_servers import FakeSugarWOD, FakeTelegram, make_command_update
+
+SECRET_TOKEN = "bench-secret"
+_update_ids = itertools.count(1)
+
+
+def load_bot(telegram, sugarwod, tmp, openai_server=None):
+    """Imports bot.py configured against the fakes and builds its clients."""
+    if openai_server is not None:
+        openai.api_base = openai_server.api_url
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "123:fake",
+        "SUGARWOD_API_KEY": "bench-key",
+        "SUGARWOD_API_URL": sugarwod.api_url,
+        "TELEGRAM_API_BASE_URL": telegram.api_url,
+        "SUBSCRIBERS_DB": os.path.join(tmp, "subscribers.db"),
+        "ARCHIVE_DB": os.path.join(tmp, "archive.db"),
+        "OPENAI_API_KEY": "sk-fake",
+    })
+    bot = importlib.import_module("bot")
+    bot.build_clients()
+    return bot
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_mode(bot, telegram, mode, concurrency, updates, rate, chats, timeout=120):
+    # Every update is measured, so repeated /get_wod presses must not be coalesced
+    application = bot.build_application(concurrency, coalescer=None)
+    # Only measure update handling, not the scheduler's background jobs
+    for job in application.job_queue.jobs():
+        job.schedule_removal()
+
+    port = _free_port()
+    first_sent = len(telegram.sent)
+    posted = {}  # chat_id -> [arrival times]
+    plan = [make_command_update(next(_update_ids), 10_000 + i % chats, "/get_wod") for i in range(updates)]
+
+    async with application:
+        await application.start()
+        if mode == "webhook":
+            await application.updater.start_webhook(listen="127.0.0.1", port=port, url_path="telegram",
+                                                    webhook_url=f"http://127.0.0.1:{port}/telegram",
+                                                    secret_token=SECRET_TOKEN)
+        else:
+            await application.updater.start_polling(poll_interval=0, timeout=5)
+
+        async with httpx.AsyncClient() as client:
+            posts = []
+            start = time.monotonic()
+            for i, update in enumerate(plan):
+                delay = start + i / rate - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                chat_id = str(update["message"]["chat"]["id"])
+                posted.setdefault(chat_id, []).append(time.monotonic())
+                if mode == "webhook":
+                    posts.append(asyncio.ensure_future(client.post(
+                        f"http://127.0.0.1:{port}/telegram", json=update,
+                        headers={"X-Telegram-Bot-Api-Secret-Token": SECRET_TOKEN})))
+                else:
+                    telegram.enqueue_updates([update])
+            await asyncio.gather(*posts)
+
+        deadline = time.monotonic() + timeout
+        while len(telegram.sent) - first_sent < updates and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+        await application.updater.stop()
+        await application.stop()
+
+    replies = {}
+    for chat_id, _, method, sent_at in telegram.sent[first_sent:]:
+        if method == "sendMessage":
+            replies.setdefault(chat_id, []).append(sent_at)
+    latencies = [reply - arrival for chat_id, arrivals in posted.items()
+                 for arrival, reply in zip(arrivals, replies.get(chat_id, []))]
+    last_reply = max((t for times in replies.values() for t in times), default=start)
+    handled = len(latencies)
+    return {"handled": handled, "updates_per_s": round(handled / (last_reply - start), 1) if handled else 0.0,
+            **summarize(latencies)}
+
+
+async def run_all(bot, telegram, args):
+    scenarios = [("polling", 1), ("polling", args.concurrency), ("webhook", args.concurrency)]
+    results = {}
+    for mode, concurrency in scenarios:
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[f"{mode}-x{concurrency}"] = await run_mode(bot, telegram, mode, concurrency,
+                                                               args.updates, args.rate, args.chats)
+    await bot.workout_api_handler.aclose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=100, help="arriving updates per second")
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=16, help="MAX_CONCURRENT_UPDATES for the concurrent runs")
+    parser.add_argument("--telegram-latency", type=float, default=0.03)
+    parser.add_argument("--output", help="write JSON results to this path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, FakeTelegram(latency=args.telegram_latency) as telegram, \
+            FakeSugarWOD(latency=0.05) as sugarwod:
+        with contextlib.redirect_stdout(io.StringIO()):
+            bot = load_bot(telegram, sugarwod, tmp)
+        results = asyncio.run(run_all(bot, telegram, args))
+        bot.subscriber_store.close()
+
+    print(f"{args.updates} /get_wod updates from {args.chats} chats at {args.rate:g}/s")
+    for name, r in results.items():
+        print(f"{name:<14} handled {r['handled']:>5}  {r['updates_per_s']:>7.1f} updates/s  "
+              f"p50 {r['p50_ms']:>8.1f}ms  p99 {r['p99_ms']:>8.1f}ms")
+
+    if args.output:
+        write_results(args.output, {"updates": args.updates, "rate": args.rate, "chats": args.chats,
+                                    "results": results})
+
+
+if __name__ == "__main__":
+    main()
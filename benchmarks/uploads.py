@@ -0,0 +1,176 @@
+"""Upload throughput, and command latency while the parser pool is saturated.
+
+Serves synthetic FIT and CSV exports from the fake Bot API. `--users`
+athletes each send `--per-user` uploads at once through UploadPipeline:
+streamed download, then parsing in the process pool. Meanwhile a probe
+sends a message every `--probe-interval` seconds, the way a command
+would. Its latency is compared across three runs: idle, the pool
+saturated, and the same uploads parsed inline on the event loop, which is
+what the pipeline avoids. Uploads beyond the per-user limit are counted as
+rejected (backpressure). Throughput only scales with workers up to the
+number of CPUs.
+
+Run from the repository root:
+    python -m benchmarks.uploads --users 4 --per-user 4 --workers 2
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import struct
+import tempfile
+import time
+
+from telegram import Bot
+
+from UploadParser import parse_upload
+from UploadPipeline import UploadPipeline, UploadRejected
+from benchmarks.common import print_summary, summarize, write_results
+from benchmarks.fake_servers import FakeTelegram
+
+TOKEN = "123:fake"
+PROBE_CHAT = 1
+
+
+def make_fit(records, seed=1):
+    """A FIT activity: `records` one-second samples (time, heart rate, distance) and a session summary."""
+    rng = random.Random(seed)
+    body = bytearray()
+    # Definition: local 0 = record (20) with timestamp, heart_rate, distance
+    body += bytes([0x40, 0, 0]) + struct.pack("<HB", 20, 3) + bytes([253, 4, 0x86, 3, 1, 0x02, 5, 4, 0x86])
+    distance = 0
+    for second in range(records):
+        distance += rng.randint(250, 400)  # cm
+        body += b"\x00" + struct.pack("<IBI", 1_000_000_000 + second, rng.randint(120, 175), distance)
+    # Definition: local 1 = session (18) with sport, elapsed, timer, distance, calories
+    body += bytes([0x41, 0, 0]) + struct.pack("<HB", 18, 5) + bytes([5, 1, 0x00, 7, 4, 0x86, 8, 4, 0x86,
+                                                                     9, 4, 0x86, 11, 2, 0x84])
+    body += b"\x01" + struct.pack("<BIIIH", 1, records * 1000, records * 1000, distance, records // 6)
+    header = struct.pack("<BBHI4sH", 14, 0x10, 2132, len(body), b".FIT", 0)
+    return header + bytes(body) + b"\x00\x00"
+
+
+def make_csv(rows, seed=1):
+    """A SugarWOD-style workout log export with `rows` entries."""
+    rng = random.Random(seed)
+    lines = ["date,title,description,best_result_raw,best_result_display,rx_or_scaled"]
+    for i in range(rows):
+        minutes = rng.randint(4, 25)
+        lines.append(f"{1 + i % 12:02d}/{1 + i % 28:02d}/{2015 + i % 10},Workout {i},"
+                     f"\"For Time: 21-15-9 thrusters, pull-ups\",{minutes * 60},{minutes}:00,{rng.choice(('RX', 'SCALED'))}")
+    return ("\n".join(lines) + "\n").encode()
+
+
+async def probe(bot, interval, stop, samples):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await bot.send_message(PROBE_CHAT, "ping")
+        samples.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+
+
+async def process_inline(pipeline, bot, user_id, file_id, kind):
+    # The baseline: same download, but parsed on the event loop
+    async with pipeline._users[user_id][0]:
+        path = await pipeline._download(bot, file_id)
+        try:
+            return parse_upload(path, kind)
+        finally:
+            os.remove(path)
+            entry = pipeline._users[user_id]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del pipeline._users[user_id]
+            pipeline._pending -= 1
+
+
+async def run_mode(server, pipeline, uploads, mode, probe_interval, idle_seconds=2.0):
+    probe_samples, upload_samples = [], []
+    rejected = 0
+    async with Bot(TOKEN, base_url=server.api_url, base_file_url=server.file_api_url) as bot:
+        stop = asyncio.Event()
+        probe_task = asyncio.ensure_future(probe(bot, probe_interval, stop, probe_samples))
+        start = time.perf_counter()
+        if mode == "idle":
+            await asyncio.sleep(idle_seconds)
+        else:
+            async def one(user_id, file_id, kind):
+                submitted = time.perf_counter()
+                if mode == "pool":
+                    await pipeline.process(bot, user_id, file_id, kind)
+                else:
+                    await process_inline(pipeline, bot, user_id, file_id, kind)
+                upload_samples.append(time.perf_counter() - submitted)
+
+            tasks = []
+            for user_id, file_id, kind in uploads:
+                try:
+                    pipeline.admit(user_id)
+                except UploadRejected:
+                    rejected += 1
+                    continue
+                tasks.append(one(user_id, file_id, kind))
+            await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await probe_task
+    return probe_samples, upload_samples, rejected, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--per-user", type=int, default=4, help="uploads each user sends at once")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--max-per-user", type=int, default=3)
+    parser.add_argument("--fit-records", type=int, default=20_000, help="one-second samples per FIT file (~10 bytes each)")
+    parser.add_argument("--csv-rows", type=int, default=20_000)
+    parser.add_argument("--probe-interval", type=float, default=0.05)
+    parser.add_argument("--output", help="write JSON results to this path")
+    args = parser.parse_args()
+
+    fit, csv_data = make_fit(args.fit_records), make_csv(args.csv_rows)
+    uploads = [(user, f"{'fit' if i % 2 == 0 else 'csv'}-{user}-{i}", "fit" if i % 2 == 0 else "csv")
+               for i in range(args.per_user) for user in range(args.users)]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, FakeTelegram(latency=0.002) as server:
+        for _, file_id, kind in uploads:
+            server.add_file(file_id, fit if kind == "fit" else csv_data)
+        for mode in ("idle", "pool", "inline"):
+            pipeline = UploadPipeline(os.path.join(tmp, mode), max_workers=args.workers, max_per_user=args.max_per_user)
+
+            async def run():
+                if mode == "pool":
+                    # Start the worker processes before timing, as a running bot already has them
+                    await asyncio.gather(*(asyncio.get_running_loop().run_in_executor(pipeline._get_pool(), sum, ())
+                                           for _ in range(args.workers)))
+                try:
+                    return await run_mode(server, pipeline, uploads, mode, args.probe_interval)
+                finally:
+                    await pipeline.aclose()
+            with contextlib.redirect_stdout(io.StringIO()):
+                results[mode] = asyncio.run(run())
+
+    print(f"{len(uploads)} uploads from {args.users} users ({len(fit) // 1024} KiB FIT, {len(csv_data) // 1024} KiB CSV), "
+          f"{args.workers} workers on {os.cpu_count()} CPUs, {args.max_per_user} per user")
+    for mode in ("idle", "pool", "inline"):
+        probe_samples, upload_samples, rejected, elapsed = results[mode]
+        if mode != "idle":
+            done = len(upload_samples)
+            print(f"{mode}: {done} processed, {rejected} rejected by backpressure, {elapsed:.2f}s "
+                  f"({done / elapsed:.1f} uploads/s)")
+            print_summary(f"  upload end-to-end ({mode})", upload_samples)
+        print_summary(f"  command probe ({mode})", probe_samples)
+
+    if args.output:
+        write_results(args.output, {
+            mode: {"probe": summarize(probe), "uploads": summarize(done_samples), "rejected": rejected,
+                   "seconds": round(elapsed, 3)}
+            for mode, (probe, done_samples, rejected, elapsed) in results.items()
+        })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Telegram messages and SugarWOD calls for one simulated day: fixed resends vs the change-detection watcher.
+
+Both runs deliver at 07:00 (Israel time, simulated) while tomorrow's WOD is
+not yet published. The coach publishes it at `--publish-at` and edits it
+at `--edit-at`.
+
+* resend  - the old schedule: the full message is sent again at 14:00.
+* watch   - `WorkoutWatcher` polls every `--interval` minutes until 23:00.
+            When a change is detected, it edits the delivered messages.
+
+Counts come from the fake servers. Staleness is the simulated time from a
+change until members' messages show it. For the resend run, a change after
+14:00 is not shown until the next morning.
+
+Run from the repository root:
+    python -m benchmarks.watch --subscribers 200 --interval 20
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+
+from BoxRegistry import DEFAULT_TIMEZONE, BoxRegistry, deliver_boxes
+from DeliveryLog import SQLiteDeliveryLog
+from TelegramHandler import TelegramHandler
+from WorkoutCache import WorkoutCache
+from WorkoutWatcher import WorkoutWatcher
+from benchmarks.common import write_results
+from benchmarks.fake_servers import FakeSugarWOD, FakeTelegram
+
+DAY_START = 7 * 60    # minutes after midnight of the first delivery
+RESEND_AT = 14 * 60
+DAY_END = 23 * 60
+
+
+def _minutes(value):
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def _registry(sugarwod, tmp, name, subscribers):
+    registry = BoxRegistry.from_config([{
+        "name": "Bench Box", "slug": "bench", "api_key": "bench-key", "api_url": sugarwod.api_url,
+        "channel_id": "@bench", "subscribers_db": os.path.join(tmp, f"{name}.db"), "broadcast_rate": 1000,
+    }], cache=WorkoutCache())
+    for n in range(subscribers):
+        registry.default.subscriber_store.subscribe(str(40_000_000 + n))
+    return registry
+
+
+def _coach(sugarwod, minute, publish_at, edit_at):
+    # Tomorrow appears at `publish_at`; the edit changes every description at `edit_at`
+    sugarwod.unpublished_days_ahead = None if minute >= publish_at else 1
+    sugarwod.description_size = 260 if minute >= edit_at else 200
+
+
+async def run_resend(sugarwod, telegram, tmp, args, date_str):
+    registry = _registry(sugarwod, tmp, "resend", args.subscribers)
+    telegram_handler = TelegramHandler("123:fake", base_url=telegram.api_url, box_name="Bench Box")
+    shown = {}
+    for minute in (DAY_START, RESEND_AT):
+        _coach(sugarwod, minute, args.publish_at, args.edit_at)
+        # Each cron run starts with a cold cache
+        registry.default.workout_api_handler.cache = WorkoutCache()
+        await deliver_boxes(telegram_handler, registry, date_str, broadcast_id=f"resend-{minute}",
+                            checkpoint_dir=os.path.join(tmp, "checkpoints"), global_rate=1000)
+        for change in (args.publish_at, args.edit_at):
+            if minute >= change and change not in shown:
+                shown[change] = minute
+    await registry.aclose()
+    return shown
+
+
+async def run_watch(sugarwod, telegram, tmp, args, date_str):
+    registry = _registry(sugarwod, tmp, "watch", args.subscribers)
+    telegram_handler = TelegramHandler("123:fake", base_url=telegram.api_url, box_name="Bench Box")
+    delivery_log = SQLiteDeliveryLog(os.path.join(tmp, "deliveries.db"))
+    watcher = WorkoutWatcher(registry, telegram_handler, delivery_log, rate=1000)
+    _coach(sugarwod, DAY_START, args.publish_at, args.edit_at)
+    await deliver_boxes(telegram_handler, registry, date_str, broadcast_id="watch",
+                        checkpoint_dir=os.path.join(tmp, "checkpoints"), global_rate=1000, delivery_log=delivery_log)
+    shown = {}
+    for minute in range(DAY_START + args.interval, DAY_END + 1, args.interval):
+        _coach(sugarwod, minute, args.publish_at, args.edit_at)
+        await watcher.poll(date_str)
+        for change in (args.publish_at, args.edit_at):
+            if minute >= change and change not in shown:
+                shown[change] = minute
+    stats = watcher.stats()
+    await registry.aclose()
+    delivery_log.close()
+    return shown, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subscribers", type=int, default=200)
+    parser.add_argument("--interval", type=int, default=20, help="minutes between watcher polls")
+    parser.add_argument("--publish-at", default="16:30", help="when the coach publishes tomorrow's WOD (HH:MM)")
+    parser.add_argument("--edit-at", default="19:10", help="when the coach edits it (HH:MM)")
+    parser.add_argument("--output", help="write JSON results to this path")
+    args = parser.parse_args()
+    args.publish_at, args.edit_at = _minutes(args.publish_at), _minutes(args.edit_at)
+
+    from datetime import datetime
+    from zoneinfo import ZoneInfo
+    date_str = datetime.now(ZoneInfo(DEFAULT_TIMEZONE)).strftime("%Y-%m-%d")
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, FakeTelegram(latency=0.002) as telegram, \
+            FakeSugarWOD(latency=0.005) as sugarwod:
+        for mode in ("resend", "watch"):
+            calls_before, sugarwod_before = dict(telegram.calls), sugarwod.request_count
+            with contextlib.redirect_stdout(io.StringIO()):
+                if mode == "resend":
+                    shown, watch_stats = asyncio.run(run_resend(sugarwod, telegram, tmp, args, date_str)), None
+                else:
+                    shown, watch_stats = asyncio.run(run_watch(sugarwod, telegram, tmp, args, date_str))
+            results[mode] = {
+                "sends": telegram.calls["sendMessage"] - calls_before.get("sendMessage", 0),
+                "edits": telegram.calls["editMessageText"] - calls_before.get("editMessageText", 0),
+                "sugarwod_requests": sugarwod.request_count - sugarwod_before,
+                "staleness_min": {name: (shown[change] - change) if change in shown else None
+                                  for name, change in (("publish", args.publish_at), ("edit", args.edit_at))},
+                "watcher": watch_stats,
+            }
+
+    print(f"{args.subscribers} subscribers + channel, publish at {args.publish_at // 60:02d}:{args.publish_at % 60:02d}, "
+          f"edit at {args.edit_at // 60:02d}:{args.edit_at % 60:02d}, watcher every {args.interval} min")
+    for mode, result in results.items():
+        staleness = ", ".join(f"{name} {'not shown today' if minutes is None else f'{minutes} min'}"
+                              for name, minutes in result["staleness_min"].items())
+        print(f"{mode:<7} sendMessage {result['sends']:>5}, editMessageText {result['edits']:>5}, "
+              f"SugarWOD requests {result['sugarwod_requests']:>3}; staleness: {staleness}")
+
+    if args.output:
+        write_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
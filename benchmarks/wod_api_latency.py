@@ -0,0 +1,103 @@
+"""Tail latency of concurrent /get_wod fetches: blocking client vs async pooled client.
+
+Simulates a burst of `/get_wod` updates arriving at once and measures how long
+each one waits for its workouts. With the blocking client every fetch freezes
+the event loop, so the burst is served one request at a time; the async
+client overlaps them on a shared connection pool. The first two runs disable
+caching to compare the transports; the last one shows the cold-cache rush
+collapsing into a single upstream call.
+
+Run from the repository root:
+    python -m benchmarks.wod_api_latency --updates 200 --latency 0.05
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+
+from WorkoutAPI_Handler import WorkoutAPI_Handler, AsyncWorkoutAPI_Handler
+from benchmarks.common import print_summary, summarize, write_results
+from benchmarks.fake_servers import FakeSugarWOD
+from WorkoutCache import WorkoutCache
+
+
+async def _burst(fetch, updates):
+    """Starts `updates` concurrent fetches and returns each one's latency from burst start."""
+    start = time.perf_counter()
+    latencies = []
+
+    async def one_update():
+        workouts = await fetch()
+        assert workouts, "fake server returned no workouts"
+        latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one_update() for _ in range(updates)))
+    return latencies
+
+
+def _no_cache():
+    return WorkoutCache(ttl=0, unpublished_ttl=0)
+
+
+async def run_blocking(api_url, updates):
+    handler = WorkoutAPI_Handler(api_url, "bench-key", cache=_no_cache())
+
+    async def fetch():
+        # What bot.get_wod used to do: a synchronous call inside the async handler
+        return handler.get_workouts_for_date()
+
+    try:
+        return await _burst(fetch, updates)
+    finally:
+        handler.close()
+
+
+async def run_async(api_url, updates, max_concurrency, cache):
+    handler = AsyncWorkoutAPI_Handler(api_url, "bench-key", max_connections=max_concurrency,
+                                      max_concurrency=max_concurrency, cache=cache)
+    try:
+        return await _burst(handler.get_workouts_for_date, updates), handler.stats()
+    finally:
+        await handler.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=100, help="concurrent /get_wod updates in the burst")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake SugarWOD response time in seconds")
+    parser.add_argument("--concurrency", type=int, default=8, help="async client connection/concurrency bound")
+    parser.add_argument("--output", help="write JSON results to this path")
+    args = parser.parse_args()
+
+    upstream_calls = {}
+    with FakeSugarWOD(latency=args.latency) as server:
+        with contextlib.redirect_stdout(io.StringIO()):
+            blocking = asyncio.run(run_blocking(server.api_url, args.updates))
+            upstream_calls["blocking"] = server.request_count
+            non_blocking, _ = asyncio.run(run_async(server.api_url, args.updates, args.concurrency, _no_cache()))
+            upstream_calls["async"] = server.request_count - upstream_calls["blocking"]
+            cached, cache_stats = asyncio.run(run_async(server.api_url, args.updates, args.concurrency, WorkoutCache()))
+            upstream_calls["async_cached"] = cache_stats["upstream_requests"]
+
+    print(f"{args.updates} concurrent updates, upstream latency {args.latency * 1000:.0f}ms")
+    print_summary("blocking (sync client)", blocking)
+    print_summary(f"async (pool={args.concurrency}, no cache)", non_blocking)
+    print_summary("async + cache", cached)
+    print(f"upstream calls: {upstream_calls}")
+    print(f"cache stats: {cache_stats}")
+
+    if args.output:
+        write_results(args.output, {
+            "updates": args.updates,
+            "upstream_latency_s": args.latency,
+            "blocking": summarize(blocking),
+            "async": summarize(non_blocking),
+            "async_cached": summarize(cached),
+            "upstream_calls": upstream_calls,
+            "cache_stats": cache_stats,
+        })
+
+
+if __name__ == "__main__":
+    main()
@@ -1,80 +1,362 @@
+import contextlib
 import os
-import requests
+import time
 from dotenv import load_dotenv
 from telegram import Update, BotCommand, ReplyKeyboardMarkup, KeyboardButton
-from telegram.ext import Application, ApplicationBuilder, CommandHandler, MessageHandler, filters, CallbackContext
-from TelegramHandler import TelegramHandler
-from WorkoutAPI_Handler import WorkoutAPI_Handler
-from OpenAIHandler import OpenAIHandler
+from telegram.ext import (Application, ApplicationBuilder, CommandHandler, InlineQueryHandler, MessageHandler, filters,
+                          CallbackContext)
+from TelegramHandler import TelegramHandler, SEPARATOR, split_message
+from OpenAIHandler import OpenAIHandler, UPLOAD_PROMPT
+from BatchAnalyzer import BatchAnalyzer
+from WorkoutCache import WorkoutCache
+from AnalysisCache import AnalysisCache
+from BoxRegistry import load_box_registry
+from WorkoutArchive import WorkoutArchive, ArchiveSync
+from UploadPipeline import UploadPipeline, UploadRejected
+from UploadParser import UploadError, detect_kind
+from Scheduler import DailyScheduler, parse_delivery_times
+from DeliveryBuckets import DEFAULT_TICK, BucketScheduler, parse_hhmm
+from DeliveryLog import SQLiteDeliveryLog
+from WorkoutWatcher import WorkoutWatcher
+from InlineResults import InlineResultCache
+from UpdateProcessor import PerChatUpdateProcessor
+from AdmissionControl import CommandCoalescer, ConcurrencyGate, Overloaded
+from Metrics import REGISTRY, start_metrics_server, timed_command
 from datetime import datetime
-from zoneinfo import ZoneInfo
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 load_dotenv()
 
 BOT_TOKEN = os.environ['TELEGRAM_BOT_TOKEN']
 SUGARWOD_API_KEY = os.environ['SUGARWOD_API_KEY']
-SUGARWOD_API_URL = "https://api.sugarwod.com/v2"
+SUGARWOD_API_URL = os.environ.get('SUGARWOD_API_URL', "https://api.sugarwod.com/v2")
+# Optional: point the bot at a different Bot API server (e.g. a local fake)
+TELEGRAM_API_BASE_URL = os.environ.get('TELEGRAM_API_BASE_URL')
+TELEGRAM_API_BASE_FILE_URL = os.environ.get('TELEGRAM_API_BASE_FILE_URL')
+# Legacy subscriber list, imported into SUBSCRIBERS_DB the first time it is created
 SUBSCRIBERS_FILE = 'subscribers.txt'
-telegram_handler = TelegramHandler(BOT_TOKEN)
-workout_api_handler = WorkoutAPI_Handler(SUGARWOD_API_URL, SUGARWOD_API_KEY)
-openai_handler = OpenAIHandler()
-
-def _load_subscribers():
-    try:
-        with open(SUBSCRIBERS_FILE) as f:
-            return set(f.read().split())
-    except FileNotFoundError:
-        return set()
+SUBSCRIBERS_DB = os.environ.get('SUBSCRIBERS_DB', 'subscribers.db')
+# Optional: serve several boxes from one bot; JSON list described in BoxRegistry.load_box_registry.
+# Without it the bot serves one box configured by the variables above and below.
+BOXES_FILE = os.environ.get('BOXES_FILE')
+BOX_NAME = os.environ.get('BOX_NAME', 'CrossFit Hatira')
+# The box's local time (IANA name), for deliveries and "today" of chats that didn't pick their own with /timezone
+BOX_TIMEZONE = os.environ.get('BOX_TIMEZONE', 'Asia/Jerusalem')
+# Optional: persist the workout cache so a restarted bot starts warm
+WORKOUT_CACHE_FILE = os.environ.get('WORKOUT_CACHE_FILE')
+# Optional: persist finished workout analyses across restarts
+ANALYSIS_CACHE_FILE = os.environ.get('ANALYSIS_CACHE_FILE')
+# "auto" answers fully parsed workouts without OpenAI; "always" adds an LLM narrative to every analysis
+ANALYSIS_LLM = os.environ.get('ANALYSIS_LLM', 'auto')
+# Days ahead (from today) whose analyses are pre-computed in packed LLM requests; 0 = only today, one request
+ANALYSIS_BATCH_DAYS = int(os.environ.get('ANALYSIS_BATCH_DAYS', '7'))
+# Optional: deliver the daily WOD from the bot itself, e.g. "07:00,14:00" in each box's timezone;
+# subscribers may pick their own time and timezone with /delivery_time and /timezone.
+# Leave unset while .github/workflows/daily_wod.yml still runs get_wod.py.
+DELIVERY_TIMES = parse_delivery_times(os.environ.get('DELIVERY_TIMES'))
+# Seconds between checks for delivery buckets that are due
+DELIVERY_TICK = int(os.environ.get('DELIVERY_TICK', str(DEFAULT_TICK)))
+TELEGRAM_CHANNEL_ID = os.environ.get('TELEGRAM_CHANNEL_ID')
+TELEGRAM_CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID')
+# Last local date each delivery bucket was sent, so a restart catches up without resending
+DELIVERY_STATE_FILE = os.environ.get('DELIVERY_STATE_FILE', '.delivery_state.json')
+BROADCAST_CHECKPOINT_DIR = os.environ.get('BROADCAST_CHECKPOINT_DIR', '.broadcast_checkpoints')
+# Messages the bot's own deliveries sent, so they can be edited when the WOD is published or changed
+DELIVERY_LOG_DB = os.environ.get('DELIVERY_LOG_DB', 'deliveries.db')
+# Seconds between checks for a newly published or changed WOD after a delivery; 0 = never
+WATCH_INTERVAL = int(os.environ.get('WATCH_INTERVAL', '600'))
+# Updates handled at once (each chat's updates still run in order); 1 = sequential
+MAX_CONCURRENT_UPDATES = int(os.environ.get('MAX_CONCURRENT_UPDATES', '16'))
+# Seconds after a /get_wod or /analyze_workout reply during which the chat's repeats are ignored
+COMMAND_DEBOUNCE = float(os.environ.get('COMMAND_DEBOUNCE', '3'))
+# LLM completions streaming at once, and commands allowed to wait for one before being turned away
+MAX_LLM_CONCURRENCY = int(os.environ.get('MAX_LLM_CONCURRENCY', '4'))
+MAX_LLM_QUEUE = int(os.environ.get('MAX_LLM_QUEUE', '16'))
+# Seconds Telegram may reuse an inline ("@bot today") answer, and between rebuilds of the answers
+INLINE_CACHE_TIME = int(os.environ.get('INLINE_CACHE_TIME', '300'))
+INLINE_REFRESH_INTERVAL = int(os.environ.get('INLINE_REFRESH_INTERVAL', '300'))
+# Optional: serve updates through a webhook instead of polling. WEBHOOK_URL is the
+# public HTTPS base Telegram posts to; the bot listens locally on WEBHOOK_LISTEN:WEBHOOK_PORT.
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.environ.get('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET_TOKEN = os.environ.get('WEBHOOK_SECRET_TOKEN')
+# Local workout history behind /search, /wod and /last, kept in sync with SugarWOD
+ARCHIVE_DB = os.environ.get('ARCHIVE_DB', 'archive.db')
+ARCHIVE_SYNC_INTERVAL = int(os.environ.get('ARCHIVE_SYNC_INTERVAL', '3600'))
+# Optional: archive history back to this date (YYYY-MM-DD) in the background; resumes after restarts
+ARCHIVE_BACKFILL_SINCE = os.environ.get('ARCHIVE_BACKFILL_SINCE')
+# Uploaded files are kept here only while being parsed, by UPLOAD_WORKERS processes
+UPLOAD_DIR = os.environ.get('UPLOAD_DIR', 'uploads')
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', '2'))
+# Uploads one user may have processing at once before being asked to wait
+UPLOADS_PER_USER = int(os.environ.get('UPLOADS_PER_USER', '3'))
+# Optional: serve Prometheus-style metrics on http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_PORT = os.environ.get('METRICS_PORT')
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+# Clients, stores and schedulers, created by build_clients() when the bot starts rather than on import
+telegram_handler = box_registry = workout_api_handler = subscriber_store = None
+openai_handler = batch_analyzer = archive = delivery_log = inline_results = workout_watcher = None
+command_coalescer = llm_gate = upload_pipeline = archive_syncs = scheduler = bucket_scheduler = None
 
 
-def _save_subscribers(subs):
-    with open(SUBSCRIBERS_FILE, 'w') as f:
-        f.write('\n'.join(subs))
+def build_clients():
+    """Creates the clients, stores and schedulers the handlers use, and registers their metrics.
 
+    Does nothing after the first call, so the Application can be rebuilt
+    (as the benchmarks do) around the same clients.
+    """
+    global telegram_handler, box_registry, workout_api_handler, subscriber_store, openai_handler, batch_analyzer
+    global archive, delivery_log, inline_results, workout_watcher, command_coalescer, llm_gate, upload_pipeline
+    global archive_syncs, scheduler, bucket_scheduler
+    if telegram_handler is not None:
+        return
+    telegram_handler = TelegramHandler(BOT_TOKEN, base_url=TELEGRAM_API_BASE_URL, box_name=BOX_NAME)
+    box_registry = load_box_registry(
+        BOXES_FILE,
+        default={
+            "name": BOX_NAME,
+            "api_key": SUGARWOD_API_KEY,
+            "channel_id": TELEGRAM_CHANNEL_ID,
+            "subscribers_db": SUBSCRIBERS_DB,
+            "migrate_from": SUBSCRIBERS_FILE,
+            "timezone": BOX_TIMEZONE,
+        },
+        base_url=SUGARWOD_API_URL,
+        cache=WorkoutCache(path=WORKOUT_CACHE_FILE)
+    )
+    # The default box, for code that only knows about one
+    workout_api_handler = box_registry.default.workout_api_handler
+    subscriber_store = box_registry.default.subscriber_store
+    openai_handler = OpenAIHandler(cache=AnalysisCache(path=ANALYSIS_CACHE_FILE), llm_mode=ANALYSIS_LLM)
+    batch_analyzer = BatchAnalyzer(openai_handler) if ANALYSIS_BATCH_DAYS > 0 else None
+    archive = WorkoutArchive(ARCHIVE_DB)
+    delivery_log = SQLiteDeliveryLog(DELIVERY_LOG_DB)
+    inline_results = InlineResultCache(box_registry, telegram_handler, cache_time=INLINE_CACHE_TIME)
+    workout_watcher = WorkoutWatcher(box_registry, telegram_handler, delivery_log, inline_results=inline_results)
+    command_coalescer = CommandCoalescer(debounce=COMMAND_DEBOUNCE)
+    llm_gate = ConcurrencyGate(MAX_LLM_CONCURRENCY, MAX_LLM_QUEUE)
+    upload_pipeline = UploadPipeline(UPLOAD_DIR, max_workers=UPLOAD_WORKERS, max_per_user=UPLOADS_PER_USER)
+    archive_syncs = [ArchiveSync(archive, box.workout_api_handler, box.slug) for box in box_registry]
+    # Keeps the WOD, analyses and inline answers warm; delivering is bucket_scheduler's job
+    scheduler = DailyScheduler(
+        box_registry,
+        telegram_handler,
+        openai_handler,
+        batch_analyzer=batch_analyzer,
+        batch_days=ANALYSIS_BATCH_DAYS,
+        inline_results=inline_results
+    )
+    bucket_scheduler = BucketScheduler(
+        box_registry,
+        telegram_handler,
+        DELIVERY_TIMES,
+        direct_chat_ids=(TELEGRAM_CHAT_ID,),
+        checkpoint_dir=BROADCAST_CHECKPOINT_DIR,
+        delivery_log=delivery_log,
+        state_file=DELIVERY_STATE_FILE,
+        prefetch=scheduler.prefetch_box
+    ) if DELIVERY_TIMES else None
+    for box in box_registry:
+        metric_prefix = box.slug.replace('-', '_')
+        REGISTRY.register_stats(f"wod_workout_api_{metric_prefix}", box.workout_api_handler.stats,
+                                f"SugarWOD client and workout cache counters for {box.name}")
+        REGISTRY.register_stats(f"wod_subscribers_{metric_prefix}",
+                                lambda box=box: {"count": len(box.subscriber_store)}, f"Subscribed chats of {box.name}")
+    REGISTRY.register_stats("wod_analysis_cache", openai_handler.cache.stats, "Workout analysis cache counters")
+    REGISTRY.register_stats("wod_analysis", openai_handler.stats, "Rule-based analyses and prompt-token savings")
+    if batch_analyzer is not None:
+        REGISTRY.register_stats("wod_batch_analysis", batch_analyzer.stats,
+                                "Pre-computed analyses: requests, days and tokens")
+    REGISTRY.register_stats("wod_archive", archive.stats, "Archived workouts and days")
+    REGISTRY.register_stats("wod_upload_pipeline", upload_pipeline.stats, "Workout uploads by outcome")
+    REGISTRY.register_stats("wod_command_coalescing", command_coalescer.stats, "Repeated commands by verdict")
+    REGISTRY.register_stats("wod_llm_gate", llm_gate.stats,
+                            "LLM completions running and queued, and turned-away commands")
+    REGISTRY.register_stats("wod_watch", lambda: {**workout_watcher.stats(), **delivery_log.stats()},
+                            "Change-detection polls and the delivered messages they keep up to date")
+    REGISTRY.register_stats("wod_inline", inline_results.stats, "Inline answers served from the pre-built results")
+    if bucket_scheduler is not None:
+        REGISTRY.register_stats("wod_delivery_buckets", bucket_scheduler.stats,
+                                "Delivery buckets and their deliveries")
 
 async def start(update: Update, context: CallbackContext):
+    """Subscribes the chat to the box named in `/start <box>`, or the default box."""
     chat_id = str(update.effective_chat.id)
-    subs = _load_subscribers()
-    if chat_id in subs:
-        today_str = datetime.now(ZoneInfo("Asia/Jerusalem")).strftime("%Y-%m-%d")
+    box = box_registry.get(context.args[0].lower()) if context.args else box_registry.default
+    if box is None:
+        await update.message.reply_text(
+            "❓ Unknown box. Available: " + ", ".join(b.slug for b in box_registry),
+            reply_markup=main_menu_keyboard()
+        )
+        return
+    # A chat follows one box at a time
+    for other in box_registry:
+        if other is not box and other.subscriber_store.unsubscribe(chat_id):
+            reschedule(other, chat_id)
+    if not box.subscriber_store.subscribe(chat_id):
         await update.message.reply_text("✅ You're already subscribed!", reply_markup=main_menu_keyboard())
     else:
-        subs.add(chat_id)
-        _save_subscribers(subs)
         await update.message.reply_text(
-            "🎉 Subscribed! You'll get daily workouts here.\n\n"
+            f"🎉 Subscribed to {box.name}! You'll get daily workouts here.\n\n"
             "Use the menu below to see available commands.",
             reply_markup=main_menu_keyboard()
         )
 
 async def stop(update: Update, context: CallbackContext):
     chat_id = str(update.effective_chat.id)
-    subs = _load_subscribers()
-    if chat_id in subs:
-        subs.remove(chat_id)
-        _save_subscribers(subs)
+    unsubscribed = [box for box in box_registry if box.subscriber_store.unsubscribe(chat_id)]
+    for box in unsubscribed:
+        reschedule(box, chat_id)
+    if unsubscribed:
         await update.message.reply_text("🛑 Unsubscribed. You will no longer receive messages.", reply_markup=main_menu_keyboard())
     else:
         await update.message.reply_text("ℹ️ You weren't subscribed.", reply_markup=main_menu_keyboard())
 
+def reschedule(box, chat_id):
+    """Moves the chat to the delivery bucket of its current preferences, if the bot delivers."""
+    if bucket_scheduler is not None:
+        bucket_scheduler.update(box, chat_id)
+
+async def _subscribed_box(update: Update):
+    """The box the chat is subscribed to; replies and returns None if it isn't subscribed."""
+    chat_id = str(update.effective_chat.id)
+    box = box_registry.box_for_chat(chat_id)
+    if chat_id not in box.subscriber_store:
+        await update.message.reply_text("ℹ️ Subscribe with /start first.", reply_markup=main_menu_keyboard())
+        return None
+    return box
+
+async def set_timezone(update: Update, context: CallbackContext):
+    """Shows or sets the chat's timezone, e.g. `/timezone Europe/London`; `/timezone default` uses the box's."""
+    box = await _subscribed_box(update)
+    if box is None:
+        return
+    chat_id = str(update.effective_chat.id)
+    timezone, delivery_time = box.subscriber_store.get_preferences(chat_id)
+    if not context.args:
+        await update.message.reply_text(
+            f"🌍 Your timezone: {timezone or f'{box.timezone.key} (the box default)'}\n"
+            "Change it with /timezone <name>, e.g. /timezone Europe/London"
+        )
+        return
+    name = context.args[0]
+    if name.lower() == "default":
+        timezone = None
+    else:
+        try:
+            timezone = ZoneInfo(name).key
+        except (ZoneInfoNotFoundError, ValueError):
+            await update.message.reply_text(f"❓ Unknown timezone \"{name}\". Use a name like Europe/London.")
+            return
+    box.subscriber_store.set_preferences(chat_id, timezone, delivery_time)
+    reschedule(box, chat_id)
+    await update.message.reply_text(f"🌍 Timezone set to {timezone or box.timezone.key}.")
+
+async def set_delivery_time(update: Update, context: CallbackContext):
+    """Shows or sets when the chat gets the daily WOD, e.g. `/delivery_time 06:30`; `default` uses the box's times."""
+    if bucket_scheduler is None:
+        await update.message.reply_text("ℹ️ The daily WOD goes out at a fixed time on this bot.")
+        return
+    box = await _subscribed_box(update)
+    if box is None:
+        return
+    chat_id = str(update.effective_chat.id)
+    timezone, delivery_time = box.subscriber_store.get_preferences(chat_id)
+    if not context.args:
+        times = delivery_time or f"{', '.join(bucket_scheduler.default_times)} (the box default)"
+        await update.message.reply_text(
+            f"⏰ You get the daily WOD at {times}, {timezone or box.timezone.key} time.\n"
+            "Change it with /delivery_time HH:MM, e.g. /delivery_time 06:30"
+        )
+        return
+    if context.args[0].lower() == "default":
+        delivery_time = None
+    else:
+        try:
+            delivery_time = parse_hhmm(context.args[0]).strftime("%H:%M")
+        except ValueError:
+            await update.message.reply_text("Usage: /delivery_time HH:MM, e.g. /delivery_time 06:30")
+            return
+    box.subscriber_store.set_preferences(chat_id, timezone, delivery_time)
+    reschedule(box, chat_id)
+    times = delivery_time or ", ".join(bucket_scheduler.default_times)
+    await update.message.reply_text(f"⏰ You'll get the daily WOD at {times}, {timezone or box.timezone.key} time.")
+
 async def upload_workout(update: Update, context: CallbackContext):
     await update.message.reply_text(
-        "📤 Great! Send me a photo or data file of your workout, and I'll run it through our AI analyzer (coming soon...)",
+        "📤 Great! Send me a photo of the whiteboard, a CSV or FIT export, or a text file of your workout, "
+        "and I'll run it through our AI analyzer.",
         reply_markup=main_menu_keyboard()
     )
-    # Future: MessageHandler for filters.PHOTO | filters.Document to handle uploads
+
+async def handle_upload(update: Update, context: CallbackContext):
+    """Admits a photo or document into the upload pipeline and replies at once; the work runs in the background."""
+    message = update.message
+    if message.photo:
+        upload, kind = message.photo[-1], "photo"
+    else:
+        upload = message.document
+        kind = detect_kind(upload.file_name, upload.mime_type)
+    if kind is None:
+        await message.reply_text("❓ I can read photos, CSV and FIT exports, and text files.",
+                                 reply_markup=main_menu_keyboard())
+        return
+    if upload.file_size and upload.file_size > upload_pipeline.max_bytes:
+        await message.reply_text(f"❌ That file is too big; the limit is {upload_pipeline.max_bytes // (1024 * 1024)} MB.")
+        return
+    user_id = update.effective_user.id if update.effective_user else update.effective_chat.id
+    try:
+        in_progress = upload_pipeline.admit(user_id)
+    except UploadRejected as e:
+        await message.reply_text(str(e))
+        return
+    status = await message.reply_text(f"📥 Got it! Processing your upload ({in_progress} in progress)...")
+    # Not awaited here, so this chat's next commands aren't queued behind the upload
+    context.application.create_task(process_upload(status, user_id, upload.file_id, kind), update=update)
+
+async def process_upload(status, user_id, file_id, kind):
+    """Background task: downloads and parses the upload, then streams its analysis into `status`."""
+    started_at = time.monotonic()
+    try:
+        result = await upload_pipeline.process(status.get_bot(), user_id, file_id, kind)
+    except UploadError as e:
+        await status.edit_text(f"❌ {e}")
+        return
+    except Exception as e:
+        print(f"Error processing upload from user {user_id}: {e}")
+        await status.edit_text("❌ Sorry, there was an error processing your upload.")
+        return
+    try:
+        async with llm_slot(result["workouts"], UPLOAD_PROMPT):
+            await telegram_handler.stream_edit(
+                status.chat_id,
+                status.message_id,
+                openai_handler.stream_analysis(result["workouts"], prompt=UPLOAD_PROMPT),
+                header=f"📊 *Upload Analysis*\n{result['summary']}\n\n",
+                started_at=started_at
+            )
+    except Overloaded as e:
+        await status.edit_text(f"📊 {result['summary']}\n\n{e}")
+
+def llm_slot(workout_data, prompt=None):
+    """A place in `llm_gate` if the analysis needs a new completion; rule-based and cached ones skip the line."""
+    return llm_gate.slot() if openai_handler.needs_llm(workout_data, prompt) else contextlib.nullcontext()
 
 async def get_wod(update: Update, context: CallbackContext):
     try:
-        today_str = datetime.now(ZoneInfo("Asia/Jerusalem")).strftime("%Y-%m-%d")
-        workout_data = workout_api_handler.get_workouts_for_date(today_str)
+        box = box_registry.box_for_chat(str(update.effective_chat.id))
+        today = datetime.now(box.timezone_for(update.effective_chat.id)).date()
+        workout_data = await box.workout_api_handler.get_workouts_for_date(today.strftime("%Y-%m-%d"))
         if not workout_data:
             await update.message.reply_text(
                 "ℹ️ No workouts found for today.",
                 reply_markup=main_menu_keyboard()
             )
             return
-        await telegram_handler.send_workout_message(update.effective_chat.id, workout_data, include_tomorrow_check=True)
+        await telegram_handler.send_workout_message(update.effective_chat.id, workout_data,
+                                                    include_tomorrow_check=True, box_name=box.name, today=today)
     except Exception as e:
         await update.message.reply_text(
             f"❌ Sorry, there was an error fetching the workouts: {str(e)}",
@@ -82,10 +364,12 @@ async def get_wod(update: Update, context: CallbackContext):
         )
 
 async def analyze_workout(update: Update, context: CallbackContext):
-    """Analyzes today's workout using OpenAI."""
+    """Analyzes today's workout using OpenAI, streaming the answer into the reply."""
+    started_at = time.monotonic()
     try:
-        today_str = datetime.now(ZoneInfo("Asia/Jerusalem")).strftime("%Y-%m-%d")
-        workout_data = workout_api_handler.get_workouts_for_date(today_str, include_tomorrow=False)
+        box = box_registry.box_for_chat(str(update.effective_chat.id))
+        today_str = datetime.now(box.timezone_for(update.effective_chat.id)).strftime("%Y-%m-%d")
+        workout_data = await box.workout_api_handler.get_workouts_for_date(today_str, include_tomorrow=False)
         
         if not workout_data:
             await update.message.reply_text(
@@ -94,24 +378,25 @@ async def analyze_workout(update: Update, context: CallbackContext):
             )
             return
             
-        # Send a "thinking" message
+        # Send a "thinking" message, then edit the analysis into it as it streams
         thinking_message = await update.message.reply_text(
             "🤔 Analyzing today's workout... This might take a moment.",
             reply_markup=main_menu_keyboard()
         )
-        
-        # Get the analysis
-        analysis = openai_handler.analyze_workout(workout_data)
-        
-        # Send the analysis
-        await update.message.reply_text(
-            f"📊 *Workout Analysis*\n\n{analysis}",
-            parse_mode='Markdown',
-            reply_markup=main_menu_keyboard()
-        )
-        
-        # Delete the thinking message
-        await thinking_message.delete()
+        try:
+            async with llm_slot(workout_data):
+                result = await telegram_handler.stream_edit(
+                    thinking_message.chat_id,
+                    thinking_message.message_id,
+                    openai_handler.stream_analysis(workout_data),
+                    header="📊 *Workout Analysis*\n\n",
+                    started_at=started_at
+                )
+        except Overloaded as e:
+            await thinking_message.edit_text(str(e))
+            return
+        print(f"Analysis streamed to chat_id {thinking_message.chat_id}: "
+              f"first text after {result['time_to_first_text']:.2f}s, {result['edits']} edits")
         
     except Exception as e:
         await update.message.reply_text(
@@ -119,6 +404,76 @@ async def analyze_workout(update: Update, context: CallbackContext):
             reply_markup=main_menu_keyboard()
         )
 
+async def inline_query(update: Update, context: CallbackContext):
+    """Answers "@bot today" / "@bot tomorrow" from the pre-built results; never waits on SugarWOD or OpenAI."""
+    query = update.inline_query
+    results, cache_time, is_personal = inline_results.lookup(query.query, query.from_user.id)
+    await query.answer(results, cache_time=cache_time, is_personal=is_personal)
+
+def _parse_date(text):
+    """Accepts YYYY-MM-DD or YYYYMMDD; returns YYYY-MM-DD or None."""
+    try:
+        return datetime.strptime(text.replace('-', ''), "%Y%m%d").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+async def search(update: Update, context: CallbackContext):
+    """Full-text search of the chat's box history, e.g. `/search burpees`."""
+    if not context.args:
+        await update.message.reply_text("Usage: /search <words>, e.g. /search burpees")
+        return
+    box = box_registry.box_for_chat(str(update.effective_chat.id))
+    text = " ".join(context.args)
+    results = archive.search(box.slug, text)
+    if not results:
+        await update.message.reply_text(f"🔍 No workouts found for \"{text}\".")
+        return
+    lines = [f"🔍 Workouts matching \"{text}\":", ""]
+    lines += [f"📅 {r['date']} – {r['title']}\n    {r['snippet']}" for r in results]
+    for chunk in split_message("\n".join(lines)):
+        await update.message.reply_text(chunk)
+
+async def wod(update: Update, context: CallbackContext):
+    """Shows the workouts of a past or upcoming day from the archive, e.g. `/wod 2024-03-20`."""
+    date_str = _parse_date(context.args[0]) if context.args else None
+    if date_str is None:
+        await update.message.reply_text("Usage: /wod YYYY-MM-DD, e.g. /wod 2024-03-20")
+        return
+    box = box_registry.box_for_chat(str(update.effective_chat.id))
+    workouts = archive.get_day(box.slug, date_str)
+    if workouts is None:
+        await update.message.reply_text(f"ℹ️ {date_str} isn't in the archive yet.")
+        return
+    if not workouts:
+        await update.message.reply_text(f"ℹ️ No workouts were programmed on {date_str}.")
+        return
+    text = f"📅 *{box.name} – {date_str}*\n\n" + "".join(
+        f"🔹 *Title*: {w['attributes']['title']}\n📝 *Description*: {w['attributes']['description']}\n{SEPARATOR}"
+        for w in workouts
+    )
+    await telegram_handler.send_chunks(update.effective_chat.id, split_message(text))
+
+async def last(update: Update, context: CallbackContext):
+    """When a benchmark was last programmed: `/last fran`, or today's workouts without arguments."""
+    box = box_registry.box_for_chat(str(update.effective_chat.id))
+    today_str = datetime.now(box.timezone_for(update.effective_chat.id)).strftime("%Y-%m-%d")
+    if context.args:
+        names = [" ".join(context.args)]
+    else:
+        names = [w["attributes"]["title"] for w in archive.get_day(box.slug, today_str) or []]
+        if not names:
+            await update.message.reply_text("Usage: /last <workout name>, e.g. /last Fran")
+            return
+    lines = []
+    for name in names:
+        found = archive.last_time(box.slug, name, before=today_str)
+        if found:
+            days_ago = (datetime.strptime(today_str, "%Y-%m-%d") - datetime.strptime(found["date"], "%Y-%m-%d")).days
+            lines.append(f"🔁 {name}: last done {found['date']} ({days_ago} days ago) as \"{found['title']}\"")
+        else:
+            lines.append(f"🆕 {name}: not found in the archive")
+    await update.message.reply_text("\n".join(lines))
+
 def main_menu_keyboard():
     buttons = [
         [KeyboardButton("/start"), KeyboardButton("/stop")],
@@ -134,31 +489,117 @@ async def register_bot_commands(application: Application):
         BotCommand("stop", "Unsubscribe"),
         BotCommand("upload_workout", "Upload workout for AI analysis"),
         BotCommand("get_wod", "Get today's workout"),
-        BotCommand("analyze_workout", "Get AI analysis of today's workout")
+        BotCommand("analyze_workout", "Get AI analysis of today's workout"),
+        BotCommand("search", "Search past workouts, e.g. /search burpees"),
+        BotCommand("wod", "Workouts of a given day, e.g. /wod 2024-03-20"),
+        BotCommand("last", "When a workout was last programmed, e.g. /last Fran"),
+        BotCommand("timezone", "Your timezone, e.g. /timezone Europe/London"),
+        BotCommand("delivery_time", "When you get the daily WOD, e.g. /delivery_time 06:30")
     ]
     await application.bot.set_my_commands(commands)
 
+async def sync_archive(context: CallbackContext):
+    """Job: brings every box's recent and upcoming days into the archive."""
+    for archive_sync in archive_syncs:
+        try:
+            stats = await archive_sync.sync_recent()
+            print(f"Archive sync of {archive_sync.box}: {stats}")
+        except Exception as e:
+            print(f"Error syncing the archive of {archive_sync.box}: {e}")
 
-def main():
-    application = (
+async def backfill_archive(context: CallbackContext):
+    """Job: archives history back to ARCHIVE_BACKFILL_SINCE, resuming any earlier run."""
+    for archive_sync in archive_syncs:
+        try:
+            await archive_sync.backfill(ARCHIVE_BACKFILL_SINCE)
+        except Exception as e:
+            print(f"Error backfilling the archive of {archive_sync.box} (will resume on restart): {e}")
+
+async def close_clients(application: Application):
+    await box_registry.aclose()
+    await upload_pipeline.aclose()
+    archive.close()
+    delivery_log.close()
+
+
+_BOT_COALESCER = object()  # build_application's default: the bot's own command_coalescer
+
+
+def build_application(max_concurrent_updates=MAX_CONCURRENT_UPDATES, coalescer=_BOT_COALESCER):
+    """Builds the clients (see build_clients) and the Application with all handlers and jobs, without starting it.
+
+    `coalescer` collapses repeated commands per chat; None handles every update.
+    """
+    build_clients()
+    if coalescer is _BOT_COALESCER:
+        coalescer = command_coalescer
+    builder = (
         ApplicationBuilder()
         .token(BOT_TOKEN)
+        .concurrent_updates(PerChatUpdateProcessor(max_concurrent_updates, coalescer=coalescer))
         .post_init(register_bot_commands)
-        .build()
+        .post_shutdown(close_clients)
+    )
+    if TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(TELEGRAM_API_BASE_URL)
+    if TELEGRAM_API_BASE_FILE_URL:
+        builder = builder.base_file_url(TELEGRAM_API_BASE_FILE_URL)
+    application = builder.build()
+    REGISTRY.register_stats(
+        "wod_updates", lambda: {"in_flight": application.update_processor.in_flight}, "Updates being handled"
     )
 
-    # Register command handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("get_wod", get_wod))
-    application.add_handler(CommandHandler("stop", stop))
-    application.add_handler(CommandHandler("upload_workout", upload_workout))
-    application.add_handler(CommandHandler("analyze_workout", analyze_workout))
+    # Register command handlers, timed per command
+    application.add_handler(CommandHandler("start", timed_command("start", start)))
+    application.add_handler(CommandHandler("get_wod", timed_command("get_wod", get_wod)))
+    application.add_handler(CommandHandler("stop", timed_command("stop", stop)))
+    application.add_handler(CommandHandler("upload_workout", timed_command("upload_workout", upload_workout)))
+    application.add_handler(CommandHandler("analyze_workout", timed_command("analyze_workout", analyze_workout)))
+    application.add_handler(CommandHandler("search", timed_command("search", search)))
+    application.add_handler(CommandHandler("wod", timed_command("wod", wod)))
+    application.add_handler(CommandHandler("last", timed_command("last", last)))
+    application.add_handler(CommandHandler("timezone", timed_command("timezone", set_timezone)))
+    application.add_handler(CommandHandler("delivery_time", timed_command("delivery_time", set_delivery_time)))
+    application.add_handler(InlineQueryHandler(timed_command("inline", inline_query)))
 
-    # Placeholder for upload handler
-    # application.add_handler(MessageHandler(filters.PHOTO | filters.Document.ALL, handle_upload))
+    # Keep today's WOD and analysis warm, and deliver it (then keep it up to date) if DELIVERY_TIMES is set
+    if application.job_queue is not None:
+        scheduler.register(application.job_queue)
+        if bucket_scheduler is not None:
+            bucket_scheduler.register(application.job_queue, DELIVERY_TICK)
+        if DELIVERY_TIMES and WATCH_INTERVAL > 0:
+            workout_watcher.register(application.job_queue, WATCH_INTERVAL)
+        if INLINE_REFRESH_INTERVAL > 0:
+            application.job_queue.run_repeating(inline_results.refresh_job, interval=INLINE_REFRESH_INTERVAL,
+                                                first=1, name="inline-refresh")
+        application.job_queue.run_repeating(sync_archive, interval=ARCHIVE_SYNC_INTERVAL, first=10, name="archive-sync")
+        if ARCHIVE_BACKFILL_SINCE:
+            application.job_queue.run_once(backfill_archive, when=60, name="archive-backfill")
+    else:
+        print("Job queue unavailable (install python-telegram-bot[job-queue]); prefetching disabled.")
 
-    # Start the bot
-    application.run_polling()
+    application.add_handler(MessageHandler(filters.PHOTO | filters.Document.ALL, timed_command("upload", handle_upload)))
+
+    return application
+
+
+def main():
+    application = build_application()
+    if METRICS_PORT:
+        start_metrics_server(int(METRICS_PORT), METRICS_HOST)
+
+    # Start the bot: webhook if a public URL is configured, long polling otherwise.
+    # Both stop on SIGINT/SIGTERM after draining the updates already being handled.
+    if WEBHOOK_URL:
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET_TOKEN
+        )
+    else:
+        application.run_polling()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,261 @@
+"""Lean entry point for scheduled runs: deliver the WOD, warm the caches, sync the archive.
+
+    python cli.py deliver            # the daily message (what get_wod.py does)
+    python cli.py deliver --channel-only  # ...to the channels and TELEGRAM_CHAT_ID, not the subscribers
+    python cli.py watch              # edit today's delivered message if the WOD was published or changed
+    python cli.py prefetch --analyze # the week's workouts, and analyses, into the on-disk caches
+    python cli.py sync               # recent days into the archive (--backfill-since for history)
+
+Only the standard library is imported up front. Each subcommand imports
+the modules it needs and builds only the clients it uses, so `deliver`
+never loads telegram.ext, openai or the requests stack. The workout and
+analysis caches live on disk (CACHE_DIR), so a run reuses what the
+previous one fetched. When the workflow restores that directory, this
+holds across fresh runners too. Every run ends with a line of its own
+timings: imports, client start-up and the work itself.
+
+Settings come from the same environment variables as get_wod.py and bot.py.
+They are read when a command runs, not at import.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+_STARTED = time.perf_counter()
+
+# On-disk caches shared between runs (keep this directory between workflow runs)
+DEFAULT_CACHE_DIR = ".cache"
+DEFAULT_SUGARWOD_API_URL = "https://api.sugarwod.com/v2"
+DEFAULT_BOX_NAME = "CrossFit Hatira"
+
+
+class Timings:
+    """Wall time per phase of one run, reported on exit."""
+
+    def __init__(self, command):
+        self.command = command
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def report(self):
+        total = time.perf_counter() - _STARTED
+        parts = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.phases.items())
+        print(f"⏱ {self.command}: {parts}, total {total * 1000:.0f}ms")
+        return {**{name: round(seconds, 4) for name, seconds in self.phases.items()}, "total": round(total, 4)}
+
+
+def _load_env():
+    # python-dotenv is only needed (and imported) when there is a .env file
+    if os.path.exists(".env"):
+        from dotenv import load_dotenv
+        load_dotenv()
+
+
+def _cache_path(name):
+    cache_dir = os.environ.get('CACHE_DIR', DEFAULT_CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, name)
+
+
+def _delivery_log_path():
+    # Kept with the caches, so the watch run after a delivery knows which messages to edit
+    return os.environ.get('DELIVERY_LOG_DB') or _cache_path("deliveries.db")
+
+
+def _telegram_handler(telegram_handler_class):
+    return telegram_handler_class(os.environ['TELEGRAM_BOT_TOKEN'],
+                                  base_url=os.environ.get('TELEGRAM_API_BASE_URL'),
+                                  box_name=os.environ.get('BOX_NAME', DEFAULT_BOX_NAME))
+
+
+def _box_registry(load_box_registry, workout_cache_class, with_broadcast_rate=False):
+    """The boxes from BOXES_FILE, or the single box configured by the environment."""
+    default = {
+        "name": os.environ.get('BOX_NAME', DEFAULT_BOX_NAME),
+        "api_key": os.environ['SUGARWOD_API_KEY'],
+        "channel_id": os.environ.get('TELEGRAM_CHANNEL_ID'),
+        "subscribers_db": os.environ.get('SUBSCRIBERS_DB', 'subscribers.db'),
+        "migrate_from": 'subscribers.txt',
+        "timezone": os.environ.get('BOX_TIMEZONE', 'Asia/Jerusalem'),
+    }
+    if with_broadcast_rate:
+        default["broadcast_rate"] = float(os.environ.get('BROADCAST_RATE', '30'))
+    return load_box_registry(
+        os.environ.get('BOXES_FILE'),
+        default=default,
+        base_url=os.environ.get('SUGARWOD_API_URL', DEFAULT_SUGARWOD_API_URL),
+        cache=workout_cache_class(path=os.environ.get('WORKOUT_CACHE_FILE') or _cache_path("workouts.json")),
+    )
+
+
+async def deliver(timings, date_str=None, channel_only=False):
+    """Sends the day's message to every box's channel, subscribers and TELEGRAM_CHAT_ID.
+
+    With `channel_only` the subscribers are skipped: their database belongs
+    to the bot host, which delivers to them (see DELIVERY_TIMES in bot.py).
+    """
+    with timings.phase("imports"):
+        from datetime import datetime, timezone
+        from BoxRegistry import deliver_boxes, load_box_registry
+        from DeliveryLog import SQLiteDeliveryLog
+        from TelegramHandler import TelegramHandler
+        from WorkoutCache import WorkoutCache
+    with timings.phase("clients"):
+        box_registry = _box_registry(load_box_registry, WorkoutCache, with_broadcast_rate=True)
+        telegram_handler = _telegram_handler(TelegramHandler)
+        delivery_log = SQLiteDeliveryLog(_delivery_log_path())
+    chat_id = os.environ.get('TELEGRAM_CHAT_ID')
+    now = datetime.now(timezone.utc)
+    if not os.environ.get('TELEGRAM_CHANNEL_ID') and not os.environ.get('BOXES_FILE'):
+        print("TELEGRAM_CHANNEL_ID not set in environment variables.")
+    if not chat_id:
+        print("TELEGRAM_CHAT_ID not set in environment variables.")
+
+    try:
+        with timings.phase("run"):
+            # Re-running the same hour (or setting BROADCAST_ID) resumes instead of resending
+            return await deliver_boxes(
+                telegram_handler,
+                box_registry,
+                date_str,
+                direct_chat_ids=(chat_id,) if chat_id else (),
+                broadcast_id=os.environ.get('BROADCAST_ID', f"wod-{date_str or f'{now:%Y-%m-%d}'}-{now:%H}"),
+                checkpoint_dir=os.environ.get('BROADCAST_CHECKPOINT_DIR', '.broadcast_checkpoints'),
+                global_rate=float(os.environ.get('BROADCAST_RATE', '30')),
+                delivery_log=delivery_log,
+                subscribers=not channel_only,
+            )
+    finally:
+        await box_registry.aclose()
+        delivery_log.close()
+
+
+async def watch(timings, date_str=None):
+    """Edits the day's delivered messages of every box whose workouts were published or changed since."""
+    with timings.phase("imports"):
+        from BoxRegistry import load_box_registry
+        from DeliveryLog import SQLiteDeliveryLog
+        from TelegramHandler import TelegramHandler
+        from WorkoutCache import WorkoutCache
+        from WorkoutWatcher import WorkoutWatcher
+    with timings.phase("clients"):
+        box_registry = _box_registry(load_box_registry, WorkoutCache, with_broadcast_rate=True)
+        delivery_log = SQLiteDeliveryLog(_delivery_log_path())
+        watcher = WorkoutWatcher(box_registry, _telegram_handler(TelegramHandler), delivery_log,
+                                 rate=float(os.environ.get('BROADCAST_RATE', '30')))
+
+    try:
+        with timings.phase("run"):
+            # Without --date every box is checked for its own local date(s)
+            results = await watcher.poll(date_str)
+            print(f"Watch: {watcher.stats()} {results}")
+            return results
+    finally:
+        await box_registry.aclose()
+        delivery_log.close()
+
+
+async def prefetch(timings, analyze=False):
+    """Refreshes the week's workouts of every box on disk and, with `analyze`, the week's analyses."""
+    with timings.phase("imports"):
+        from BoxRegistry import load_box_registry
+        from WorkoutCache import WorkoutCache
+        if analyze:
+            from AnalysisCache import AnalysisCache
+            from BatchAnalyzer import BatchAnalyzer
+            from OpenAIHandler import OpenAIHandler
+    with timings.phase("clients"):
+        box_registry = _box_registry(load_box_registry, WorkoutCache)
+        batch_analyzer = None
+        if analyze:
+            openai_handler = OpenAIHandler(
+                cache=AnalysisCache(path=os.environ.get('ANALYSIS_CACHE_FILE') or _cache_path("analyses.json")),
+                llm_mode=os.environ.get('ANALYSIS_LLM', 'auto'))
+            batch_analyzer = BatchAnalyzer(openai_handler)
+
+    try:
+        with timings.phase("run"):
+            days = int(os.environ.get('ANALYSIS_BATCH_DAYS', '7'))
+            for box in box_registry:
+                workouts = await box.workout_api_handler.refresh()
+                print(f"Prefetched {len(workouts)} workouts for today and tomorrow at {box.name}")
+                if batch_analyzer is not None:
+                    analyzed = await batch_analyzer.analyze_range(box.workout_api_handler, days=days)
+                    print(f"Analyzed {analyzed} new days at {box.name}")
+    finally:
+        await box_registry.aclose()
+
+
+async def sync(timings, backfill_since=None):
+    """Brings every box's recent days (and optionally history back to `backfill_since`) into ARCHIVE_DB."""
+    with timings.phase("imports"):
+        from BoxRegistry import load_box_registry
+        from WorkoutArchive import ArchiveSync, WorkoutArchive
+        from WorkoutCache import WorkoutCache
+    with timings.phase("clients"):
+        box_registry = _box_registry(load_box_registry, WorkoutCache)
+        archive = WorkoutArchive(os.environ.get('ARCHIVE_DB', 'archive.db'))
+
+    try:
+        with timings.phase("run"):
+            for box in box_registry:
+                archive_sync = ArchiveSync(archive, box.workout_api_handler, box.slug)
+                print(f"Archive sync of {box.slug}: {await archive_sync.sync_recent()}")
+                if backfill_since:
+                    await archive_sync.backfill(backfill_since)
+    finally:
+        await box_registry.aclose()
+        archive.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    deliver_parser = commands.add_parser("deliver", help="send the daily WOD message")
+    deliver_parser.add_argument("--date", help="day to deliver (YYYY-MM-DD); each box's own today by default")
+    deliver_parser.add_argument("--channel-only", action="store_true",
+                                help="deliver to the channels and TELEGRAM_CHAT_ID only, not to subscribers")
+    watch_parser = commands.add_parser("watch", help="update delivered messages whose workouts changed")
+    watch_parser.add_argument("--date", help="day whose delivery to update (YYYY-MM-DD); today by default")
+    prefetch_parser = commands.add_parser("prefetch", help="warm the on-disk workout (and analysis) caches")
+    prefetch_parser.add_argument("--analyze", action="store_true", help="also pre-compute the week's analyses")
+    sync_parser = commands.add_parser("sync", help="sync recent days into the workout archive")
+    sync_parser.add_argument("--backfill-since", help="also archive history back to this date (YYYY-MM-DD)")
+    args = parser.parse_args(argv)
+
+    _load_env()
+    timings = Timings(args.command)
+    if args.command == "deliver":
+        run = deliver(timings, args.date, args.channel_only)
+    elif args.command == "watch":
+        run = watch(timings, args.date)
+    elif args.command == "prefetch":
+        run = prefetch(timings, args.analyze)
+    else:
+        run = sync(timings, args.backfill_since)
+
+    metrics_file = os.environ.get('METRICS_FILE')
+    try:
+        if metrics_file:
+            from Metrics import PeriodicDump
+            with PeriodicDump(metrics_file, float(os.environ.get('METRICS_DUMP_INTERVAL', '30'))):
+                asyncio.run(run)
+        else:
+            asyncio.run(run)
+    finally:
+        timings.report()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import asyncio
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+import pytest
+import BoxRegistry
+from BoxRegistry import Box, BoxRegistry as Registry, deliver_boxes
+from SubscriberStore import SQLiteSubscriberStore
+from WorkoutAPI_Handler import _date_range, _requested_dates
+
+
+class FakeWorkoutAPI:
+    def __init__(self):
+        self.requested = []
+
+    async def get_workouts_for_date(self, date_str=None, include_tomorrow=True):
+        self.requested.append(date_str)
+        return []
+
+
+@pytest.fixture
+def deliveries(monkeypatch):
+    calls = []
+
+    async def fake_deliver(telegram_handler, workouts, subscriber_store=None, **kwargs):
+        calls.append({"subscriber_store": subscriber_store, **kwargs})
+        return {}
+
+    monkeypatch.setattr(BoxRegistry, "deliver_workouts", fake_deliver)
+    return calls
+
+
+@pytest.fixture
+def stores(tmp_path):
+    opened = []
+
+    def make(slug):
+        store = SQLiteSubscriberStore(str(tmp_path / f"{slug}.db"))
+        opened.append(store)
+        return store
+
+    yield make
+    for store in opened:
+        store.close()
+
+
+def test_requested_dates_with_explicit_date():
+    assert _requested_dates("20240320") == ["2024-03-20", "2024-03-21"]
+    assert _requested_dates("2024-03-20", include_tomorrow=False) == ["2024-03-20"]
+
+
+def test_requested_dates_default_to_today_in_the_given_timezone():
+    for name in ("Pacific/Kiritimati", "Pacific/Pago_Pago"):
+        tz = ZoneInfo(name)
+        assert _requested_dates(tz=tz, include_tomorrow=False) == [datetime.now(tz).strftime("%Y-%m-%d")]
+
+
+def test_date_range_is_consecutive():
+    assert _date_range("2024-02-28", 3) == ["2024-02-28", "2024-02-29", "2024-03-01"]
+
+
+def test_from_config_gives_the_client_the_box_timezone(tmp_path):
+    registry = Registry.from_config([
+        {"name": "Hatira", "api_key": "key", "subscribers_db": str(tmp_path / "a.db")},
+        {"name": "London Box", "api_key": "key", "subscribers_db": str(tmp_path / "b.db"),
+         "timezone": "Europe/London"},
+    ])
+    try:
+        hatira, london = registry
+        assert hatira.slug == "hatira" and london.slug == "london-box"
+        assert hatira.timezone.key == hatira.workout_api_handler.timezone.key == "Asia/Jerusalem"
+        assert london.timezone.key == london.workout_api_handler.timezone.key == "Europe/London"
+    finally:
+        asyncio.run(registry.aclose())
+
+
+def test_deliver_boxes_calls_the_requested_day_today(stores, deliveries):
+    api = FakeWorkoutAPI()
+    box = Box("box", "Box", api, stores("box"), channel_id="@channel")
+    asyncio.run(deliver_boxes(None, [box], "2024-03-20", broadcast_id="wod"))
+    assert api.requested == ["2024-03-20"]
+    assert deliveries[0]["today"] == date(2024, 3, 20)
+    assert deliveries[0]["broadcast_id"] == "wod-box"
+
+
+def test_deliver_boxes_defaults_to_each_box_own_today(stores, deliveries):
+    # UTC+14 and UTC-11 are on different dates at any moment
+    east = Box("east", "East", FakeWorkoutAPI(), stores("east"), timezone="Pacific/Kiritimati")
+    west = Box("west", "West", FakeWorkoutAPI(), stores("west"), timezone="Pacific/Pago_Pago")
+    asyncio.run(deliver_boxes(None, [east, west], None))
+    days = {call["box_name"]: call["today"] for call in deliveries}
+    assert days["East"] == datetime.now(ZoneInfo("Pacific/Kiritimati")).date()
+    assert days["West"] == datetime.now(ZoneInfo("Pacific/Pago_Pago")).date()
+    assert days["East"] - days["West"] in (timedelta(days=1), timedelta(days=2))
+
+
+def test_deliver_boxes_can_skip_subscribers(stores, deliveries):
+    box = Box("box", "Box", FakeWorkoutAPI(), stores("box"), channel_id="@channel")
+    asyncio.run(deliver_boxes(None, [box], "2024-03-20", subscribers=False))
+    assert deliveries[0]["subscriber_store"] is None
+    assert deliveries[0]["direct_chat_ids"] == ("@channel",)
@@ -0,0 +1,130 @@
+import asyncio
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+import pytest
+import DeliveryBuckets
+from BoxRegistry import Box, BoxRegistry
+from DeliveryBuckets import BucketScheduler, next_occurrence, parse_hhmm
+from SubscriberStore import SQLiteSubscriberStore
+
+
+class FakeWorkoutAPI:
+    async def get_workouts_for_date(self, date_str=None, include_tomorrow=True):
+        return []
+
+
+@pytest.fixture
+def deliveries(monkeypatch):
+    """Every deliver_workouts call the scheduler makes, instead of sending anything."""
+    calls = []
+
+    async def fake_deliver(telegram_handler, workouts, subscriber_store=None, **kwargs):
+        calls.append(kwargs)
+        return {"sent": len(kwargs.get("chat_ids") or ())}
+
+    monkeypatch.setattr(DeliveryBuckets, "deliver_workouts", fake_deliver)
+    return calls
+
+
+@pytest.fixture
+def registry(tmp_path):
+    store = SQLiteSubscriberStore(str(tmp_path / "subscribers.db"))
+    registry = BoxRegistry([Box("box", "Box", FakeWorkoutAPI(), store, channel_id="@channel",
+                                timezone="Asia/Jerusalem")])
+    yield registry
+    store.close()
+
+
+def _utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_parse_hhmm_rejects_garbage():
+    assert parse_hhmm("7:05").hour == 7
+    with pytest.raises(ValueError):
+        parse_hhmm("7am")
+
+
+def test_next_occurrence_is_local_and_strictly_after():
+    tz = ZoneInfo("Asia/Jerusalem")
+    # 05:00 UTC on 2024-03-20 is 07:00 in Jerusalem (UTC+2)
+    assert next_occurrence(tz, "07:00", _utc(2024, 3, 20, 4, 0)) == datetime(2024, 3, 20, 7, 0, tzinfo=tz)
+    assert next_occurrence(tz, "07:00", _utc(2024, 3, 20, 5, 0)) == datetime(2024, 3, 21, 7, 0, tzinfo=tz)
+
+
+def test_buckets_group_chats_by_timezone_and_time(registry, deliveries):
+    store = registry.default.subscriber_store
+    for chat_id in ("1", "2", "3"):
+        store.subscribe(chat_id)
+    store.set_preferences("2", "Europe/London", None)
+    store.set_preferences("3", None, "06:00")
+    scheduler = BucketScheduler(registry, None, ["07:00"], catch_up_window=0)
+    scheduler.rebuild(_utc(2024, 3, 20, 0, 0))
+    assert set(scheduler._buckets) == {("box", "Asia/Jerusalem", "07:00"), ("box", "Europe/London", "07:00"),
+                                       ("box", "Asia/Jerusalem", "06:00")}
+
+    stats = asyncio.run(scheduler.tick(_utc(2024, 3, 20, 5, 0)))
+    assert list(stats) == [("box", "Asia/Jerusalem", "07:00")]
+    # The default bucket takes the chats without preferences and the channel
+    assert deliveries[-1]["chat_ids"] == ["1"]
+    assert deliveries[-1]["direct_chat_ids"] == ("@channel",)
+    assert deliveries[-1]["today"].isoformat() == "2024-03-20"
+
+
+def test_due_buckets_fire_once_and_requeue_for_tomorrow(registry, deliveries):
+    scheduler = BucketScheduler(registry, None, ["07:00"], catch_up_window=0)
+    scheduler.rebuild(_utc(2024, 3, 20, 0, 0))
+    assert asyncio.run(scheduler.tick(_utc(2024, 3, 20, 4, 59))) == {}
+    asyncio.run(scheduler.tick(_utc(2024, 3, 20, 5, 0)))
+    asyncio.run(scheduler.tick(_utc(2024, 3, 20, 5, 1)))
+    assert len(deliveries) == 1
+    assert scheduler.next_due() == datetime(2024, 3, 21, 7, 0, tzinfo=ZoneInfo("Asia/Jerusalem")).timestamp()
+
+
+def test_restart_catches_up_on_a_missed_bucket(registry, deliveries):
+    scheduler = BucketScheduler(registry, None, ["07:00"], catch_up_window=3 * 60 * 60)
+    # Started at 08:00 local, an hour after the bucket's time, with no delivery recorded today
+    scheduler.rebuild(_utc(2024, 3, 20, 6, 0))
+    asyncio.run(scheduler.tick(_utc(2024, 3, 20, 6, 0)))
+    assert len(deliveries) == 1
+    assert scheduler.stats()["max_lag_seconds"] == 3600
+
+
+def test_restart_skips_a_bucket_already_delivered(registry, deliveries, tmp_path):
+    state_file = str(tmp_path / "state.json")
+    first = BucketScheduler(registry, None, ["07:00"], state_file=state_file, catch_up_window=3 * 60 * 60)
+    first.rebuild(_utc(2024, 3, 20, 4, 0))
+    asyncio.run(first.tick(_utc(2024, 3, 20, 5, 0)))
+
+    restarted = BucketScheduler(registry, None, ["07:00"], state_file=state_file, catch_up_window=3 * 60 * 60)
+    restarted.rebuild(_utc(2024, 3, 20, 6, 0))
+    asyncio.run(restarted.tick(_utc(2024, 3, 20, 6, 0)))
+    assert len(deliveries) == 1
+
+
+def test_bucket_missed_beyond_the_window_waits_for_tomorrow(registry, deliveries):
+    scheduler = BucketScheduler(registry, None, ["07:00"], catch_up_window=60 * 60)
+    scheduler.rebuild(_utc(2024, 3, 20, 8, 0))
+    asyncio.run(scheduler.tick(_utc(2024, 3, 20, 8, 0)))
+    assert deliveries == []
+
+
+def test_tick_does_not_wait_for_prefetch(registry, deliveries):
+    started = asyncio.Event()
+
+    async def slow_prefetch(box):
+        started.set()
+        await asyncio.sleep(60)
+
+    async def run():
+        scheduler = BucketScheduler(registry, None, ["07:00"], catch_up_window=0, prefetch=slow_prefetch,
+                                    prefetch_lead=15 * 60)
+        scheduler.rebuild(_utc(2024, 3, 20, 4, 0))
+        await asyncio.wait_for(scheduler.tick(_utc(2024, 3, 20, 5, 0)), timeout=1)
+        await asyncio.sleep(0)
+        assert started.is_set()
+        for task in list(scheduler._prefetching.values()):
+            task.cancel()
+
+    asyncio.run(run())
+    assert len(deliveries) == 1
@@ -0,0 +1,37 @@
+import asyncio
+import time
+from BroadcastHandler import TokenBucket
+
+
+def _time_acquires(bucket, count):
+    async def run():
+        start = time.monotonic()
+        for _ in range(count):
+            await bucket.acquire()
+        return time.monotonic() - start
+    return asyncio.run(run())
+
+
+def test_first_token_is_immediate():
+    assert _time_acquires(TokenBucket(1), 1) < 0.05
+
+
+def test_acquires_are_spread_at_rate():
+    # One token up front, then one every 1/rate seconds
+    elapsed = _time_acquires(TokenBucket(50), 11)
+    assert 0.18 <= elapsed < 0.5
+
+
+def test_capacity_allows_a_burst():
+    bucket = TokenBucket(10, capacity=5)
+    assert _time_acquires(bucket, 5) < 0.05
+
+
+def test_pause_holds_every_sender():
+    async def run():
+        bucket = TokenBucket(1000)
+        bucket.pause(0.2)
+        start = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(3)))
+        return time.monotonic() - start
+    assert asyncio.run(run()) >= 0.2
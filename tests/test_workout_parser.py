@@ -0,0 +1,85 @@
+from WorkoutParser import estimate, format_estimate, parse_workout
+
+
+def test_fran_one_liner_scheme():
+    parsed = parse_workout("Fran", "21-15-9 For time\nThrusters 95/65 lb\nPull-ups")
+    assert parsed.complete
+    assert parsed.format == "for_time"
+    assert parsed.rep_scheme == (21, 15, 9)
+    assert [m.name for m in parsed.movements] == ["thruster", "pull-up"]
+    assert parsed.movements[0].load == "95/65 lb"
+    assert "⏱" in format_estimate([parsed])
+
+
+def test_rep_scheme_with_trailing_reps_of():
+    parsed = parse_workout("Diane", "21-15-9 reps of:\nDeadlifts 225/155 lb\nHSPU")
+    assert parsed.rep_scheme == (21, 15, 9)
+    assert not parsed.unparsed
+
+
+def test_es_plurals_match():
+    parsed = parse_workout("WOD", "5 rounds\n10 push presses\n10 snatches\n12 lunges\n10 dumbbell snatches")
+    assert [m.name for m in parsed.movements] == ["push press", "snatch", "lunge", "dumbbell snatch"]
+    assert parsed.complete
+
+
+def test_amrap_rounds_estimate():
+    parsed = parse_workout("Cindy", "20 min AMRAP\n5 pull-ups\n10 push-ups\n15 air squats")
+    assert parsed.format == "amrap"
+    assert parsed.minutes == 20
+    times = estimate(parsed)
+    assert times["intermediate"]["minutes"] == 20
+    assert times["advanced"]["rounds"] > times["intermediate"]["rounds"] > times["beginner"]["rounds"]
+
+
+def test_time_cap_limits_estimate():
+    parsed = parse_workout("Chipper", "For time\nTime cap: 2\n100 burpees")
+    assert parsed.time_cap == 2
+    assert estimate(parsed)["beginner"]["minutes"] == 2
+
+
+def test_unknown_line_leaves_workout_incomplete():
+    parsed = parse_workout("WOD", "For time\n1 min plank\n20 squats")
+    assert not parsed.complete
+    assert parsed.unparsed == ("1 min plank",)
+
+
+def test_unusable_unit_leaves_workout_incomplete():
+    parsed = parse_workout("WOD", "For time\n30 sec handstand hold\n20 burpees\n2 min row")
+    assert not parsed.complete
+
+
+def test_incomplete_workout_gets_no_time_estimate():
+    parsed = parse_workout("WOD", "For time\n1 min plank\n20 squats")
+    text = format_estimate([parsed])
+    assert "⏱" not in text
+    # Scaling for the movements that were understood is still shown
+    assert "air squat" in text
+
+
+def test_complete_workouts_with_distance_and_es_plural():
+    parsed = parse_workout("WOD", "4 Rounds:\n250m ski\n10 dumbbell snatches")
+    assert parsed.complete
+    assert parsed.rounds == 4
+    assert parsed.movements[0].unit == "m" and parsed.movements[0].reps == 250
+
+
+def test_distance_for_non_distance_movement_is_uncertain():
+    parsed = parse_workout("WOD", "3 rounds\n50 ft lunges\n10 burpees")
+    assert not parsed.complete
+
+
+def test_strength_sets():
+    parsed = parse_workout("Strength", "Back squat 5x5 @ 75%")
+    assert parsed.format == "strength"
+    assert parsed.sets == (5, 5)
+    assert parsed.movements[0].load == "75%"
+    assert estimate(parsed)["intermediate"]["minutes"] == 12.5
+
+
+def test_rft_rounds_multiply_estimate():
+    parsed = parse_workout("WOD", "3 RFT\n30 DU\n10 snatches")
+    assert parsed.complete
+    assert parsed.rounds == 3
+    # (30 double unders * 0.6 s + 10 snatches * 4 s) * 3 rounds
+    assert estimate(parsed)["intermediate"]["minutes"] == 2.9